@@ -1,36 +1,120 @@
 import asyncio
+import concurrent.futures
 import enum
-import glob
+import gc
 import json
 import logging
+import math
 import os
 import re
+import shlex
 import sys
-from typing import Dict, Optional
+import threading
+import time
+import unicodedata
+import urllib.parse
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
+import aiohttp
 import pydantic
-import requests
+import yt_dlp
 from bs4 import BeautifulSoup
 from discord import (
+    AudioSource,
     AutocompleteContext,
     Bot,
     Embed,
+    FFmpegOpusAudio,
     FFmpegPCMAudio,
     OptionChoice,
     PCMVolumeTransformer,
+    default_permissions,
     option,
     slash_command,
 )
-from discord.ext import commands
-from discord.utils import get
+from discord import opus
+from discord.oggparse import OggError
+from discord.ext import commands, tasks
 from models import config
 from songbirdcore import youtube
-from util import trie
+from util import (
+    cache,
+    loudness,
+    metrics,
+    ngram,
+    ratelimit,
+    singleflight,
+    storage,
+    titleindex,
+    trie,
+    workpool,
+)
 import abc
+import collections
+import heapq
+import itertools
 
 logger = logging.getLogger(__name__)
 
 SONG_MATCH_SPLIT_KEY = "--> "
+# discord displays at most 25 autocomplete choices
+AUTOCOMPLETE_LIMIT = 25
+AUTOCOMPLETE_CACHE_SIZE = 1024
+TITLE_FETCH_CONCURRENCY = 4
+# seconds before a title fetch is abandoned
+TITLE_FETCH_TIMEOUT = 10.0
+TITLE_FETCH_CHUNK_BYTES = 16 * 1024
+TITLE_FETCH_MAX_BYTES = 1024 * 1024
+# charset declared by a page itself, for responses whose headers lack one
+META_CHARSET_PATTERN = re.compile(rb"<meta[^>]+charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+# title fetches per second allowed to each provider
+TITLE_FETCH_RATES = {"youtube": 2.0, "vimeo": 1.0, "soundcloud": 1.0}
+# fetched titles committed to the metadb at once by a title backfill
+TITLE_BACKFILL_BATCH_SIZE = 50
+# seconds between sweeps for idle guild players
+PLAYER_REAP_INTERVAL = 60
+# seconds between checks of the downloads folder against its budget
+CACHE_EVICTION_INTERVAL = 300
+# seconds between checks for title index changes missing from its snapshot
+TITLE_SNAPSHOT_INTERVAL = 60
+# seconds between writes of play counts recorded in memory to the metadb
+PLAY_FLUSH_INTERVAL = 60
+# seconds for a play's weight in search ranking to halve
+POPULARITY_HALF_LIFE = 30 * 24 * 60 * 60
+# queue entries shown per page of '/list', and after an enqueue
+QUEUE_PAGE_SIZE = 10
+QUEUE_TAIL_SIZE = 5
+# longest queue entry label, keeping a full page well within embed limits
+QUEUE_LABEL_MAX_CHARS = 100
+# seconds between progress updates of long running commands
+PROGRESS_INTERVAL = 5.0
+# songs whose loudness gain is within this many dB of 0 are played unscaled
+GAIN_TOLERANCE_DB = 0.5
+# canonical song urls whose provider and id are remembered
+PROVIDER_CACHE_SIZE = 4096
+# seconds of audio in each frame read by the voice client
+FRAME_SECONDS = 0.02
+# seconds between checks on a song played while it downloads
+STREAM_CHECK_INTERVAL = 1.0
+# seconds without a frame before a stream counts as stalled
+STREAM_STALL_TIMEOUT = 5.0
+# longest a read waits for the download of a stream that ran out
+STREAM_HANDOVER_TIMEOUT = 600.0
+# lets ffmpeg ride out dropped connections to a stream
+STREAM_BEFORE_OPTIONS = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
 
 
 class SongMeta(pydantic.BaseModel):
@@ -38,19 +122,179 @@ class SongMeta(pydantic.BaseModel):
     file_path: str
     # set title via best-effort.
     title: Optional[str]
+    # unix time the song last started playing, and how often it has
+    last_played: Optional[float] = None
+    play_count: int = 0
+    # integrated loudness in LUFS, and the linear gain normalizing it
+    lufs: Optional[float] = None
+    gain: Optional[float] = None
 
 
-class MetaDbManager:
+class SearchModes(enum.StrEnum):
+    # match titles starting with the query
+    PREFIX = "prefix"
+    # match titles containing the query anywhere, tolerating typos
+    SUBSTRING = "substring"
+
+
+class EvictionPolicies(enum.StrEnum):
+    # evict the songs played longest ago
+    LRU = "lru"
+    # evict the songs played least often
+    LFU = "lfu"
+
+
+class CachedSong(NamedTuple):
+    id: str
+    size: int
+    last_played: float
+    play_count: int
+
+
+def measure_songs(items: List[Tuple[str, dict]]) -> List[CachedSong]:
+    """stat the file of each metadb item. blocks, so run it in an executor."""
+    songs = []
+    for id, item in items:
+        try:
+            size = os.stat(item["file_path"]).st_size
+        except OSError:
+            size = 0
+        songs.append(
+            CachedSong(
+                id, size, item.get("last_played") or 0.0, item.get("play_count", 0)
+            )
+        )
+    return songs
+
+
+def plan_evictions(
+    songs: List[CachedSong],
+    protected: Set[str],
+    max_bytes: int,
+    max_songs: int,
+    policy: str = EvictionPolicies.LRU,
+) -> List[str]:
+    """choose songs to evict until the cache fits within max_bytes and
+    max_songs, either of which is ignored if not positive. protected songs
+    are never chosen, even if the budget can't be met without them.
+
+    Returns: the ids to evict, in eviction order
+    """
+    total_bytes = sum(song.size for song in songs)
+    total_songs = len(songs)
+
+    def over_budget() -> bool:
+        return (max_bytes > 0 and total_bytes > max_bytes) or (
+            max_songs > 0 and total_songs > max_songs
+        )
 
-    def __init__(self, path: str):
+    if not over_budget():
+        return []
+    if policy == EvictionPolicies.LFU:
+        rank = lambda song: (song.play_count, song.last_played)
+    else:
+        rank = lambda song: (song.last_played, song.play_count)
+    victims = []
+    for song in sorted(songs, key=rank):
+        if not over_budget():
+            break
+        if song.id in protected:
+            continue
+        victims.append(song.id)
+        total_bytes -= song.size
+        total_songs -= 1
+    return victims
+
+
+def remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"unable to remove '{path}': {e}")
+
+
+class TitleMatches(NamedTuple):
+    """cached result of a title prefix query."""
+
+    # metadb generation the matches were computed at
+    generation: int
+    # plays recorded when the matches were ranked
+    plays: int
+    matches: List[Tuple[str, str, str]]
+    # True if matches holds every song with the prefix, not just the first few
+    complete: bool
+
+
+# titles mapped from a snapshot, or read live from storage
+TitleSource = Union[titleindex.TitleSnapshot, storage.TitleIndex]
+
+
+def normalize_title(title: str) -> str:
+    return unicodedata.normalize("NFC", title)
+
+
+class MetaDbManager:
+    """song metadata db, kept on a pluggable storage backend,
+    with a trie of song titles for rapid lookup of songs by name.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        backend: str = storage.MetaStorageBackends.JSON,
+        journal_max_bytes: int = storage.JOURNAL_MAX_BYTES,
+        autocomplete_cache_size: int = AUTOCOMPLETE_CACHE_SIZE,
+        substring_index: bool = False,
+        fast_load: bool = False,
+        snapshot_path: Optional[str] = None,
+    ):
         self.path = path
+        # index raw records at load, validating each on first access instead
+        self.fast_load = fast_load
+        # ids whose stored record is known to be a valid SongMeta
+        self.validated: Set[str] = set()
+        # seconds spent in each phase of the last load
+        self.load_timings: Dict[str, float] = {}
         self.trie = trie.Trie()
-
-        # initialize metadata db
-        if not os.path.exists(path):
-            with open(path, "w") as f:
-                json.dump({}, f)
-                self.db = {}
+        self.substring_index = substring_index
+        # trigram index over titles, built only when substring search is used
+        self.ngrams: Optional[ngram.NgramIndex] = None
+        # bumped on every change to the title index, invalidating cached queries
+        self.generation = 0
+        # normalized prefix -> TitleMatches
+        self.title_cache = cache.LRUCache(maxsize=autocomplete_cache_size)
+        # title queries answered by filtering a cached shorter prefix
+        self.title_cache_derived_hits = 0
+        # song id -> url for every titled song not served by the snapshot
+        self.urls: Dict[str, str] = {}
+        # song id -> normalized title it is indexed under, for the same songs
+        self.indexed_titles: Dict[str, str] = {}
+        # memory mapped title index written earlier, if any. songs titled
+        # since it was written are held in the trie above, the delta
+        self.snapshot_path = snapshot_path
+        self.snapshot: Optional[TitleSource] = None
+        # whether the snapshot is instead a live view of titles in storage,
+        # which every change reaches without a delta
+        self.titles_live = False
+        # snapshot songs since removed or retitled, skipped when it is read
+        self.shadowed: Set[str] = set()
+        # generation of the title index the snapshot on disk matches
+        self.snapshot_generation: Optional[int] = None
+        # song id -> (play count, last played) of every played song, ranking
+        # search results
+        self.popularity: Dict[str, Tuple[int, float]] = {}
+        # song id -> title it is indexed under, or None, for played songs.
+        # filled in as ranked, and emptied when the title index changes
+        self.popular_titles: Dict[str, Optional[str]] = {}
+        self.popular_titles_generation: Optional[int] = None
+        # song id -> (plays, last played) recorded since the last flush
+        self.unflushed_plays: Dict[str, Tuple[int, float]] = {}
+        # plays recorded since loading, invalidating cached rankings
+        self.plays = 0
+        self.storage = storage.open_storage(
+            backend, path, journal_max_bytes=journal_max_bytes
+        )
 
         # ingest metadb into trie for rapid memory lookup of song names
         # and associated metadb keys
@@ -58,34 +302,93 @@ class MetaDbManager:
 
     def write(self) -> bool:
         try:
-            with open(self.path, "w") as f:
-                json.dump(self.db, f)
-                logger.info(f"wrote meta db '{self.path}'")
-                return True
+            self.storage.flush()
+            return True
         except Exception as e:
-            logger.exception(f"error while writing metadata to {self.path}", e)
+            logger.exception(f"error while writing metadata to {self.path}: {e}")
             return False
 
     def load(self) -> bool:
+        # loading allocates several objects per song, none of them garbage,
+        # and collections triggered along the way rescan the whole index
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
         try:
-            with open(self.path, "r") as f:
-                self.db = json.load(f)
-                logger.info(f"loaded meta db '{self.path}'")
-
-            for id, item in self.db.items():
-                parsed_item = SongMeta.model_validate(item)
-                if parsed_item.title:
-                    self.trie.insert(parsed_item.title, terminator=id)
-                else:
-                    logger.info(
-                        f"skipping insertion of song w/ url {parsed_item.url} as no title exists for it within meta db."
-                    )
-            logger.info(f"trie constructed successfully")
+            start = time.perf_counter()
+            self.storage.load()
+            loaded = time.perf_counter()
+            self.trie = trie.Trie()
+            self.ngrams = ngram.NgramIndex() if self.substring_index else None
+            self.urls = {}
+            self.indexed_titles = {}
+            self.validated = set()
+            self.popularity = {}
+            self._close_snapshot()
+            self.generation += 1
+            self.title_cache.clear()
+            live = self.storage.title_index()
+            self.titles_live = live is not None
+            # (normalized title, id, url) of every titled song
+            entries = []
+            if self.titles_live and self.fast_load:
+                # titles are searched in storage as they are queried, so
+                # only the plays ranking them are read up front
+                for id, play_count, last_played in self.storage.played():
+                    self.popularity[id] = (play_count, last_played or 0.0)
+            else:
+                for id, item in self.storage.items():
+                    if self.fast_load:
+                        title, url = item.get("title"), item.get("url")
+                        if not isinstance(title, str) or not isinstance(url, str):
+                            title = None
+                    else:
+                        parsed_item = SongMeta.model_validate(item)
+                        self.validated.add(id)
+                        title, url = parsed_item.title, parsed_item.url
+                    play_count = item.get("play_count", None)
+                    if play_count:
+                        self.popularity[id] = (
+                            play_count,
+                            item.get("last_played") or 0.0,
+                        )
+                    if title:
+                        entries.append((normalize_title(title), id, url))
+                    else:
+                        logger.debug(
+                            f"skipping insertion of song w/ id {id} as no title exists for it within meta db."
+                        )
+            self.snapshot = live if self.titles_live else self._open_snapshot(entries)
+            if self.titles_live:
+                entries = live
+            elif self.snapshot is not None:
+                self.snapshot_generation = self.generation
+            else:
+                for title, id, url in entries:
+                    self.indexed_titles[id] = title
+                    self.urls[id] = url
+                # building the trie from every title at once beats inserting
+                # them one by one several times over
+                self.trie = trie.Trie.from_items(
+                    (title, id) for title, id, _ in entries
+                )
+            if self.ngrams is not None:
+                for title, id, _ in entries:
+                    self.ngrams.insert(title, terminator=id)
+            indexed = time.perf_counter()
+            self.load_timings = {"storage": loaded - start, "index": indexed - loaded}
+            logger.info(
+                f"loaded {len(entries)} titled songs in {indexed - start:.3f}s "
+                f"(storage {loaded - start:.3f}s, index {indexed - loaded:.3f}s, "
+                f"fast_load={self.fast_load}, snapshot={self.snapshot is not None})"
+            )
             return True
 
         except Exception as e:
-            logger.exception(f"error while initializing metadatadb: ", e)
+            logger.exception(f"error while initializing metadatadb: {e}")
             return False
+        finally:
+            if gc_was_enabled:
+                gc.enable()
 
     def get_song_meta(self, id: str) -> Optional[SongMeta]:
         """retrieve song metadata given an id, and song provider
@@ -95,75 +398,600 @@ class MetaDbManager:
 
         Returns (dict): song metadata
         """
-        item = self.db.get(id, None)
+        item = self.storage.get(id)
         if not item:
             logger.error(f"no item in meta db for id: {id}")
             return None
-        try:
-            return SongMeta.model_validate(item)
-        except pydantic.ValidationError as e:
-            logger.exception(f"could not parse metadata item: {item}", e)
+        return self._song_meta(id, item)
+
+    def find_song_meta(self, id: str) -> Optional[SongMeta]:
+        """get_song_meta for a song that may well not be downloaded yet,
+        which unlike a missing one isn't logged.
+        """
+        item = self.storage.get(id)
+        if not item:
             return None
+        return self._song_meta(id, item)
+
+    def _song_meta(self, id: str, item: dict) -> Optional[SongMeta]:
+        if id in self.validated:
+            song_meta = SongMeta.model_construct(**item)
+        else:
+            try:
+                song_meta = SongMeta.model_validate(item)
+            except pydantic.ValidationError as e:
+                logger.error(f"could not parse metadata item {id}: {e}")
+                return None
+            self.validated.add(id)
+        if id in self.unflushed_plays:
+            plays, last_played = self.unflushed_plays[id]
+            song_meta.play_count += plays
+            song_meta.last_played = last_played
+        return song_meta
 
     def add_song_meta(self, id: str, song_meta: SongMeta) -> bool:
-        # update meta db
-        self.db[id] = song_meta.model_dump()
-        # update trie if title exists for song
-        if song_meta.title:
-            self.trie.insert(song_meta.title, terminator=id)
-        return self.write()
+        return self.add_song_metas([(id, song_meta)])
+
+    def add_song_metas(self, songs: List[Tuple[str, SongMeta]]) -> bool:
+        """add or replace several songs, committed to storage together."""
+        # titles read live from storage can only be compared before the write
+        before = (
+            {id: self._snapshot_entry(id) for id, _ in songs}
+            if self.titles_live
+            else {}
+        )
+        try:
+            self.storage.put_many([(id, meta.model_dump()) for id, meta in songs])
+        except Exception as e:
+            ids = [id for id, _ in songs]
+            logger.exception(f"error while adding metadata for ids {ids}: {e}")
+            return False
+        changed = False
+        for id, song_meta in songs:
+            self.validated.add(id)
+            # the record written is taken to hold every play so far
+            self.unflushed_plays.pop(id, None)
+            if song_meta.play_count:
+                self.popularity[id] = (
+                    song_meta.play_count,
+                    song_meta.last_played or 0.0,
+                )
+            if self.titles_live:
+                title = song_meta.title and normalize_title(song_meta.title)
+                after = (title, song_meta.url) if title else None
+                if self._retitle_live(id, before[id], after):
+                    changed = True
+            # update trie if title exists for song, else drop any it had
+            elif song_meta.title:
+                if self._index_title(id, song_meta.title, song_meta.url):
+                    changed = True
+            elif self._unindex_title(id):
+                changed = True
+        if changed:
+            self.generation += 1
+        return True
+
+    def remove_song_meta(self, id: str) -> Optional[SongMeta]:
+        """remove a song from the db and the title index.
+
+        Returns: the removed song's metadata, or None if it could not be removed
+        """
+        song_meta = self.get_song_meta(id)
+        if song_meta is None:
+            return None
+        before = self._snapshot_entry(id) if self.titles_live else None
+        try:
+            self.storage.delete(id)
+        except Exception as e:
+            logger.exception(f"error while removing metadata for id {id}: {e}")
+            return None
+        self.validated.discard(id)
+        self.unflushed_plays.pop(id, None)
+        self.popularity.pop(id, None)
+        if self.titles_live:
+            changed = self._retitle_live(id, before, None)
+        else:
+            changed = self._unindex_title(id)
+        if changed:
+            self.generation += 1
+        return song_meta
+
+    def record_play(self, id: str) -> bool:
+        """note that a song has just started playing. counted in memory,
+        and written to the metadb by the next ``flush_plays``.
+        """
+        if self.storage.get(id) is None:
+            logger.error(f"no item in meta db for id: {id}")
+            return False
+        now = time.time()
+        plays, _ = self.unflushed_plays.get(id, (0, now))
+        self.unflushed_plays[id] = (plays + 1, now)
+        play_count, _ = self.popularity.get(id, (0, now))
+        self.popularity[id] = (play_count + 1, now)
+        self.plays += 1
+        return True
+
+    def flush_plays(self) -> int:
+        """write the plays recorded since the last flush to the metadb.
+
+        Returns: the number of songs written
+        """
+        pending, self.unflushed_plays = self.unflushed_plays, {}
+        songs = []
+        for id, (plays, last_played) in pending.items():
+            song_meta = self.get_song_meta(id)
+            if song_meta is None:
+                continue
+            song_meta.play_count += plays
+            song_meta.last_played = last_played
+            songs.append((id, song_meta))
+        if songs and not self.add_song_metas(songs):
+            # keep the plays for the next flush, under any recorded meanwhile
+            for id, (plays, last_played) in pending.items():
+                later_plays, later = self.unflushed_plays.get(id, (0, last_played))
+                self.unflushed_plays[id] = (plays + later_plays, later)
+            return 0
+        return len(songs)
+
+    def _score(self, id: str, now: float) -> float:
+        """how likely a song is to be searched for: its plays, each weighed
+        down by half every POPULARITY_HALF_LIFE since the song last played.
+        """
+        play_count, last_played = self.popularity.get(id, (0, 0.0))
+        if not play_count:
+            return 0.0
+        return play_count * 0.5 ** ((now - last_played) / POPULARITY_HALF_LIFE)
+
+    def _open_snapshot(
+        self, entries: List[Tuple[str, str, str]]
+    ) -> Optional[titleindex.TitleSnapshot]:
+        """map the title snapshot, if one exists and matches entries."""
+        if self.snapshot_path is None or not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            snapshot = titleindex.TitleSnapshot(self.snapshot_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"ignoring unreadable title snapshot: {e}")
+            return None
+        # a snapshot older than a change to any title is of no use
+        current = len(snapshot) == len(entries)
+        if not current or snapshot.digest != titleindex.digest(entries):
+            logger.info("title snapshot is out of date, rebuilding the title index")
+            snapshot.close()
+            return None
+        return snapshot
+
+    def _close_snapshot(self) -> None:
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.snapshot = None
+        self.shadowed = set()
+        self.snapshot_generation = None
+
+    def _snapshot_entry(self, id: str) -> Optional[Tuple[str, str]]:
+        """the (title, url) the snapshot serves for a song, if it does."""
+        if self.snapshot is None or id in self.shadowed:
+            return None
+        return self.snapshot.get(id)
+
+    def _url(self, id: str) -> str:
+        url = self.urls.get(id, None)
+        if url is None:
+            url = self.snapshot.get(id)[1]
+        return url
+
+    def snapshot_stale(self) -> bool:
+        """whether the title index changed since the snapshot was written."""
+        return (
+            self.snapshot_path is not None
+            and not self.titles_live
+            and self.snapshot_generation != self.generation
+        )
+
+    def prepare_snapshot(self) -> Tuple[int, Callable[[], bool]]:
+        """capture the title index for a new snapshot. the returned call
+        writes it and blocks, so run it in an executor, then pass the
+        generation to ``install_snapshot``.
+
+        Returns: the generation captured, and the call writing the snapshot
+        """
+        snapshot, shadowed = self.snapshot, set(self.shadowed)
+        delta = [
+            (title, id, self.urls[id]) for id, title in self.indexed_titles.items()
+        ]
+        path = self.snapshot_path
+
+        def write() -> bool:
+            entries = delta
+            if snapshot is not None:
+                entries += [entry for entry in snapshot if entry[1] not in shadowed]
+            try:
+                titleindex.write(path, entries)
+                return True
+            except Exception as e:
+                logger.exception(f"error while writing title snapshot {path}: {e}")
+                return False
+
+        return self.generation, write
+
+    def install_snapshot(self, generation: int) -> bool:
+        """switch to the snapshot written for generation, emptying the delta,
+        unless the title index changed since it was captured.
+
+        Returns: True if the snapshot was installed
+        """
+        if generation != self.generation:
+            return False
+        try:
+            snapshot = titleindex.TitleSnapshot(self.snapshot_path)
+        except (OSError, ValueError) as e:
+            logger.error(f"unable to open title snapshot: {e}")
+            return False
+        self._close_snapshot()
+        self.snapshot = snapshot
+        self.snapshot_generation = generation
+        self.trie = trie.Trie()
+        self.urls = {}
+        self.indexed_titles = {}
+        logger.info(f"installed title snapshot of {len(snapshot)} songs")
+        return True
+
+    def _index_title(self, id: str, title: str, url: str) -> bool:
+        """index a song's title, replacing any title it was indexed under.
+
+        Returns: True if the title index changed, its url included
+        """
+        title = normalize_title(title)
+        previous = self.indexed_titles.get(id, None)
+        if previous == title:
+            # cached matches carry the url, so a new one invalidates them too
+            changed = self.urls[id] != url
+            self.urls[id] = url
+            return changed
+        if previous is None and self._snapshot_entry(id) == (title, url):
+            return False
+        self._unindex_title(id)
+        self.trie.insert(title, terminator=id)
+        if self.ngrams is not None:
+            self.ngrams.insert(title, terminator=id)
+        self.indexed_titles[id] = title
+        self.urls[id] = url
+        return True
+
+    def _unindex_title(self, id: str) -> bool:
+        title = self.indexed_titles.pop(id, None)
+        if title is not None:
+            self.trie.remove(title, id)
+            del self.urls[id]
+        else:
+            entry = self._snapshot_entry(id)
+            if entry is None:
+                return False
+            title = entry[0]
+            self.shadowed.add(id)
+        if self.ngrams is not None:
+            self.ngrams.remove(title, id)
+        return True
+
+    def _retitle_live(
+        self,
+        id: str,
+        before: Optional[Tuple[str, str]],
+        after: Optional[Tuple[str, str]],
+    ) -> bool:
+        """account for a song's (title, url) in storage changing from before
+        to after, where titles are read live from it.
+
+        Returns: True if the title index changed
+        """
+        if before == after:
+            return False
+        if self.ngrams is not None:
+            if before is not None:
+                self.ngrams.remove(before[0], id)
+            if after is not None:
+                self.ngrams.insert(after[0], terminator=id)
+        return True
+
+    def _is_current(self, matches: TitleMatches) -> bool:
+        return matches.generation == self.generation and matches.plays == self.plays
+
+    def find_songs_by_title(
+        self, prefix: str, limit: int = AUTOCOMPLETE_LIMIT
+    ) -> List[Tuple[str, str, str]]:
+        """find the limit most popular songs whose title starts with prefix.
+        results are cached per prefix until the title index changes or a
+        song is played, and a prefix whose parent's full result set is
+        cached is answered by filtering the parent's matches instead of
+        walking the trie.
+
+        Returns: (title, id, url) for each matching song, most popular first
+        """
+        if limit <= 0:
+            return []
+        prefix = normalize_title(prefix)
+        cached = self.title_cache.peek(prefix)
+        if cached is not None and not self._is_current(cached):
+            self.title_cache.pop(prefix)
+        elif cached is not None and (cached.complete or len(cached.matches) >= limit):
+            # counts the hit and refreshes the entry's recency
+            return self.title_cache.get(prefix).matches[:limit]
+        self.title_cache.misses += 1
+
+        for end in range(len(prefix) - 1, -1, -1):
+            parent = self.title_cache.peek(prefix[:end])
+            if parent is None or not self._is_current(parent):
+                continue
+            if not parent.complete:
+                # a truncated parent may be missing songs with this prefix
+                break
+            # filtering keeps the parent's ranking
+            matches = [m for m in parent.matches if m[0].startswith(prefix)]
+            self.title_cache.put(
+                prefix,
+                TitleMatches(self.generation, self.plays, matches, complete=True),
+            )
+            self.title_cache_derived_hits += 1
+            return matches[:limit]
+
+        matches, complete = self._rank_title_matches(prefix, limit)
+        self.title_cache.put(
+            prefix, TitleMatches(self.generation, self.plays, matches, complete)
+        )
+        return matches
+
+    def _iter_title_matches(self, prefix: str) -> Iterator[Tuple[str, str]]:
+        """yield (title, id) of every song whose title starts with prefix,
+        in title order where a snapshot is used, else in trie order.
+        """
+        delta = (
+            (title, id) for title, ids in self.trie.iter_prefix(prefix) for id in ids
+        )
+        if self.snapshot is None:
+            return delta
+        snapshot = (
+            (title, id)
+            for title, id, _ in self.snapshot.iter_prefix(prefix)
+            if id not in self.shadowed
+        )
+        # the delta is small, and the snapshot already in title order
+        by_title = lambda match: match[0]
+        return heapq.merge(sorted(delta, key=by_title), snapshot, key=by_title)
+
+    def _rank_title_matches(
+        self, prefix: str, limit: int
+    ) -> Tuple[List[Tuple[str, str, str]], bool]:
+        """pick the limit highest scoring matches: the best played songs
+        matching prefix, then unplayed ones in the order they are found.
+        costs O((played + limit) log limit), however many songs match.
+
+        Returns: the matches, best first, and whether they are all of them
+        """
+        now = time.time()
+        # played songs, scored above every unplayed one, ranked by a heap
+        played = (
+            (score, title, id)
+            for id, title in self._popular_titles().items()
+            if title is not None
+            and title.startswith(prefix)
+            and (score := self._score(id, now)) > 0
+        )
+        best = heapq.nsmallest(
+            limit, played, key=lambda entry: (-entry[0], entry[1], entry[2])
+        )
+        # unplayed songs all score 0 and keep the order they are found in,
+        # so only the first limit of them can make the cut. one more tells
+        # whether there are more matches than the limit
+        found = list(itertools.islice(self._iter_title_matches(prefix), limit + 1))
+        ranked = {id for _, _, id in best}
+        for title, id in found:
+            if len(best) >= limit:
+                break
+            if id not in ranked:
+                best.append((0.0, title, id))
+        matches = [(title, id, self._url(id)) for _, title, id in best]
+        return matches, len(found) <= limit
+
+    def _popular_titles(self) -> Dict[str, Optional[str]]:
+        """the indexed title of every played song, or None if it has none."""
+        if self.popular_titles_generation != self.generation:
+            self.popular_titles = {}
+            self.popular_titles_generation = self.generation
+        for id in self.popularity.keys() - self.popular_titles.keys():
+            title = self.indexed_titles.get(id, None)
+            if title is None:
+                entry = self._snapshot_entry(id)
+                title = None if entry is None else entry[0]
+            self.popular_titles[id] = title
+        return self.popular_titles
+
+    def find_songs_by_substring(
+        self, query: str, limit: int = AUTOCOMPLETE_LIMIT
+    ) -> List[Tuple[str, str, str]]:
+        """find up to limit songs whose title contains query, or resembles it
+        closely, best match first. requires the metadb to be created with
+        ``substring_index=True``.
+
+        Returns: (title, id, url) for each matching song
+        """
+        matches = []
+        for title, ids in self.ngrams.search(normalize_title(query), limit):
+            for id in ids:
+                matches.append((title, id, self._url(id)))
+                if len(matches) >= limit:
+                    return matches
+        return matches
+
+    def stats(self) -> Dict[str, int]:
+        stats = {f"title_cache_{k}": v for k, v in self.title_cache.stats().items()}
+        stats["title_cache_derived_hits"] = self.title_cache_derived_hits
+        stats["songs"] = len(self.storage)
+        for phase, seconds in self.load_timings.items():
+            stats[f"load_{phase}_ms"] = round(seconds * 1000, 1)
+        if self.snapshot is not None:
+            stats["title_snapshot_songs"] = len(self.snapshot) - len(self.shadowed)
+        stats["title_delta_songs"] = len(self.indexed_titles)
+        return stats
+
+    def wait_for_compaction(self) -> None:
+        if isinstance(self.storage, storage.JsonJournalStorage):
+            self.storage.wait_for_compaction()
+
+    def close(self) -> None:
+        self.flush_plays()
+        self._close_snapshot()
+        self.storage.close()
 
 
 async def _get_url_from_title(ctx: AutocompleteContext):
     db_lock = ctx.cog.meta_db_lock  # pyright: ignore
     db = ctx.cog.meta_db  # pyright: ignore
-    trie = ctx.cog.meta_db.trie  # pyright: ignore
-    output_to_user = []
     try:
+        # must recieve trie matches and their terminators,
+        # which correspond to watch ids
         async with db_lock:
-            if ctx.value == "":
-                trie_matches = trie.list_keys(trie.root)
+            if db.ngrams is not None and ctx.value:
+                matches = db.find_songs_by_substring(ctx.value)  # pyright: ignore
             else:
-                trie_matches = trie.starts_with(ctx.value)  # pyright: ignore
+                matches = db.find_songs_by_title(ctx.value)  # pyright: ignore
 
-        # must recieve trie matches and their terminators,
-        # which correspond to watch ids
-        if not trie_matches:
-            logger.info(f"no matches from trie for query: {ctx.value}")
+        if not matches:
+            logger.debug(f"no matches from trie for query: {ctx.value}")
             return []
 
-        logger.info(f"recieved matches from trie: {trie_matches}")
-        # load matching data from meta_db
-        # for each match from the trie
-        # retrieve the termination value -- which is the watch id
-
-        for match in trie_matches:
-            async with db_lock:
-                # search in trie takes iterations O(k)
-                # where k is length of match
-                match_terminators = trie.search(match)
-
-            # perform constant lookup for each terminator,
-            # and add result to output
-            for terminator in match_terminators:
-                async with db_lock:
-                    song_meta = db.get_song_meta(terminator)
-                label = (
-                    f"{song_meta.title} | {song_meta.url}"
-                    if song_meta.title
-                    else song_meta.url
-                )
-                output_to_user.append(
-                    OptionChoice(name=label[:100], value=song_meta.url)
-                )
-                logger.info(f"output to user = {output_to_user}")
-
-        return output_to_user
+        logger.debug(f"autocomplete matched {len(matches)} songs for '{ctx.value}'")
+        return [
+            OptionChoice(name=f"{title} | {url}"[:100], value=url)
+            for title, _, url in matches
+        ]
     except Exception as e:
-        logger.exception(f"error while attempting autocomplete: ", e)
+        logger.exception(f"error while attempting autocomplete: {e}")
         return []
 
 
+class SongFormats(enum.StrEnum):
+    MP3 = "mp3"
+    # played by copying its packets straight to voice, without re-encoding
+    OPUS = "opus"
+
+
+class PlaybackSource(AudioSource):
+    """the audio source of a playing track, wrapping the source actually
+    decoding it. counts the frames played so far, so the track can be
+    reopened at the same position through a different source, e.g. when
+    the volume changes.
+
+    a song still downloading is played from its stream, with ``streaming``
+    set, until the downloaded file is handed over. if the stream runs out
+    first, reads wait for the hand over rather than ending the track.
+    """
+
+    def __init__(
+        self,
+        song_path: str,
+        source: AudioSource,
+        gain: float = 1.0,
+        streaming: bool = False,
+    ):
+        self.song_path = song_path
+        self.source = source
+        # loudness normalization scale applied on top of the volume
+        self.gain = gain
+        self.frames = 0
+        # whether the frame last read was opus, kept in step with read
+        # since the player asks straight after reading each frame
+        self.opus = source.is_opus()
+        self.lock = threading.Lock()
+        self.streaming = streaming
+        # the downloaded file's source, None if the download failed
+        self.handover: Optional[AudioSource] = None
+        self.handover_ready = threading.Event()
+        # set while a read waits on a stream that ran out
+        self.waiting = False
+
+    def read(self) -> bytes:
+        with self.lock:
+            self._take_over()
+            data = self._read()
+            if not data and self.streaming:
+                # the stream ended or was cut off before the download finished
+                self.waiting = True
+                self.handover_ready.wait(STREAM_HANDOVER_TIMEOUT)
+                self.waiting = False
+                if self._take_over():
+                    data = self._read()
+            self.opus = self.source.is_opus()
+        if data:
+            self.frames += 1
+        return data
+
+    def _read(self) -> bytes:
+        try:
+            return self.source.read()
+        except (OSError, ValueError, OggError):
+            # the stream's ffmpeg was killed mid read, see hand_over
+            if self.streaming:
+                return b""
+            raise
+
+    def _take_over(self) -> bool:
+        """switch from the stream to the downloaded file once handed over.
+
+        Returns: True if switched
+        """
+        if not self.streaming or not self.handover_ready.is_set():
+            return False
+        self.streaming = False
+        if self.handover is None:
+            return False
+        previous, self.source = self.source, self.handover
+        previous.cleanup()
+        return True
+
+    def is_opus(self) -> bool:
+        return self.opus
+
+    @property
+    def position(self) -> float:
+        """seconds of the track played so far"""
+        return self.frames * FRAME_SECONDS
+
+    def replace(self, source: AudioSource) -> None:
+        with self.lock:
+            previous, self.source = self.source, source
+        previous.cleanup()
+
+    def hand_over(
+        self, song_path: str, source: Optional[AudioSource], interrupt: bool = False
+    ) -> None:
+        """continue a streamed track from source, opened on its downloaded
+        file at the current position, from the next frame read. interrupt
+        kills a stalled stream, releasing a read blocked on it. a None
+        source lets the stream play out.
+        """
+        stream = self.source
+        self.song_path = song_path
+        self.handover = source
+        self.handover_ready.set()
+        if interrupt and source is not None:
+            stream.cleanup()
+
+    def cleanup(self) -> None:
+        self.streaming = False
+        self.handover_ready.set()
+        self.source.cleanup()
+        if self.handover is not None and self.handover is not self.source:
+            self.handover.cleanup()
+
+
+class DownloadPriority(enum.IntEnum):
+    # lower values are downloaded first
+    NOW_PLAYING = 0
+    NEXT_UP = 1
+    PREFETCH = 2
+    BACKFILL = 3
+
+
 class SongMetaProviders(enum.StrEnum):
     YOUTUBE = "youtube"
     VIMEO = "vimeo"
@@ -171,24 +999,42 @@ class SongMetaProviders(enum.StrEnum):
 
 
 class SongMetaFetcher(abc.ABC):
-    def __init__(self, url: str):
+    provider: SongMetaProviders
+    # hosts serving the provider's songs, less any www. or m. prefix
+    hosts: Tuple[str, ...]
+    # host of canonical song urls, None to keep the host as given
+    canonical_host: Optional[str] = None
+    # query parameters identifying a song, all others are dropped
+    query_params: Tuple[str, ...] = ()
+    # matches a canonical song url, capturing the song's id
+    pattern: re.Pattern
+
+    def __init__(self, url: str, id: Optional[str] = None):
         self.url = url
+        self.id = id
+
+    @classmethod
+    def canonicalize(cls, host: str, path: str, query: List[Tuple[str, str]]) -> str:
+        query = [(key, value) for key, value in query if key in cls.query_params]
+        return urllib.parse.urlunsplit(
+            (
+                "https",
+                cls.canonical_host or host,
+                path.rstrip("/"),
+                urllib.parse.urlencode(query),
+                "",
+            )
+        )
 
-    @abc.abstractmethod
     def get_video_id(self) -> str:
-        pass
-
-    def get_video_title(self) -> Optional[str]:
-        try:
-            r = requests.get(self.url)
-            soup = BeautifulSoup(r.text, "html.parser")
-            return self.parse_title_from_soup(soup)
-
-        except Exception as e:
-            logger.exception(
-                f"could not get title for video '{self.url}'. Continuing without", e
-            )
-            return None
+        if self.id is None:
+            results = self.pattern.search(self.url)
+            if not results or not results.group(1):
+                raise ValueError(
+                    f"No match for regex pattern {self.pattern.pattern} within {self.url}."
+                )
+            self.id = results.group(1)
+        return self.id
 
     @abc.abstractmethod
     def parse_title_from_soup(self, soup: BeautifulSoup):
@@ -196,229 +1042,1523 @@ class SongMetaFetcher(abc.ABC):
 
 
 class YoutubeMetaFetcher(SongMetaFetcher):
-    def __init__(self, url: str):
-        super().__init__(url)
-
-    def get_video_id(self) -> str:
-        pattern = r"(?:v=|\/)([0-9A-Za-z_-]{11}).*"
-        regex = re.compile(pattern)
-        results = regex.search(self.url)
-        if not results:
-            raise ValueError(f"No match for regex pattern {pattern} within {self.url}.")
-        return results.group(1)
+    provider = SongMetaProviders.YOUTUBE
+    hosts = ("youtube.com", "music.youtube.com", "youtube-nocookie.com", "youtu.be")
+    canonical_host = "www.youtube.com"
+    query_params = ("v",)
+    pattern = re.compile(r"(?:v=|\/)([0-9A-Za-z_-]{11}).*")
+
+    @classmethod
+    def canonicalize(cls, host: str, path: str, query: List[Tuple[str, str]]) -> str:
+        if host == "youtu.be":
+            query = [("v", path.strip("/"))] + query
+            path = "/watch"
+        return super().canonicalize(host, path, query)
 
     def parse_title_from_soup(self, soup: BeautifulSoup):
         return soup.find("title").string
 
 
 class VimeoMetaFetcher(SongMetaFetcher):
-    def __init__(self, url: str):
-        super().__init__(url)
-
-    def get_video_id(self) -> str:
-        pattern = r"(?:http:|https:|)\/\/(?:player.|www.)?vimeo\.com\/(?:video\/|embed\/|watch\?\S*v=|v\/)?(\d*)"
-        regex = re.compile(pattern)
-        results = regex.search(self.url)
-        if not results:
-            raise ValueError(f"No match for regex pattern {pattern} within {self.url}.")
-        return results.group(1)
+    provider = SongMetaProviders.VIMEO
+    hosts = ("vimeo.com", "player.vimeo.com")
+    # the access hash of an unlisted video
+    query_params = ("h",)
+    pattern = re.compile(
+        r"(?:http:|https:|)\/\/(?:player.|www.)?vimeo\.com\/(?:video\/|embed\/|watch\?\S*v=|v\/)?(\d*)"
+    )
 
     def parse_title_from_soup(self, soup: BeautifulSoup):
         return soup.find("title").string
 
 
 class SoundcloudMetaFetcher(SongMetaFetcher):
-    def __init__(self, url: str):
-        super().__init__(url)
-
-    def get_video_id(self) -> str:
-        return f"{self.url.split('/')[-2]}/{self.url.split('/')[-1]}"
+    provider = SongMetaProviders.SOUNDCLOUD
+    hosts = ("soundcloud.com", "on.soundcloud.com")
+    # the last two segments of the path, the artist and track
+    pattern = re.compile(r"([^/?#]+/[^/?#]+)/?(?:[?#]|$)")
 
     def parse_title_from_soup(self, soup: BeautifulSoup):
         return soup.find("title").string
 
 
+class ProviderRegistry:
+    """picks the fetcher for a song url by its host, and parses the song's
+    id with the fetcher's precompiled pattern. urls are canonicalized first,
+    so every form of a song's url shares one entry in a bounded cache of
+    canonical url -> (provider, id), and repeat lookups skip the parsing.
+    """
+
+    def __init__(
+        self,
+        fetchers: List[Type[SongMetaFetcher]],
+        cache_size: int = PROVIDER_CACHE_SIZE,
+    ):
+        self.fetchers = {fetcher.provider: fetcher for fetcher in fetchers}
+        self.hosts = {host: fetcher for fetcher in fetchers for host in fetcher.hosts}
+        self.ids = cache.LRUCache(cache_size)
+
+    def canonicalize(self, url: str) -> Optional[Tuple[str, Type[SongMetaFetcher]]]:
+        """Returns: the canonical form of url and its provider's fetcher, or
+        None if no provider serves url
+        """
+        url = url.strip()
+        if "//" not in url:
+            url = f"https://{url}"
+        parts = urllib.parse.urlsplit(url)
+        host = parts.hostname or ""
+        for prefix in ("www.", "m."):
+            host = host.removeprefix(prefix)
+        fetcher = self.hosts.get(host, None)
+        if fetcher is None:
+            return None
+        query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        return fetcher.canonicalize(host, parts.path, query), fetcher
+
+    def get_meta_fetcher(self, url: str) -> Optional[SongMetaFetcher]:
+        canonical = self.canonicalize(url)
+        if canonical is None:
+            logger.error(
+                f"unsupported url {url} not one of expected providers {list(self.fetchers)}"
+            )
+            return None
+        url, fetcher = canonical
+        cached = self.ids.get(url)
+        if cached is not None:
+            provider, id = cached
+            return self.fetchers[provider](url, id)
+        meta_fetcher = fetcher(url)
+        try:
+            id = meta_fetcher.get_video_id()
+        except ValueError as e:
+            logger.error(f"unable to find a song id in url {url}: {e}")
+            return None
+        self.ids.put(url, (fetcher.provider, id))
+        return meta_fetcher
+
+
+providers = ProviderRegistry(
+    [YoutubeMetaFetcher, VimeoMetaFetcher, SoundcloudMetaFetcher]
+)
+
+
+def get_meta_fetcher(url: str) -> Optional[SongMetaFetcher]:
+    return providers.get_meta_fetcher(url)
+
+
+async def read_until_title(content, max_bytes: int = TITLE_FETCH_MAX_BYTES) -> bytes:
+    """read an html response body incrementally, stopping as soon as the
+    closing title tag has arrived rather than downloading the whole page.
+
+    Args:
+        content (aiohttp.StreamReader): the response body
+        max_bytes (int): give up once this much has been read
+
+    Returns (bytes): the body up to and including ``</title>``, or as much as was read
+    """
+    closing_tag = b"</title>"
+    head = bytearray()
+    async for chunk in content.iter_chunked(TITLE_FETCH_CHUNK_BYTES):
+        # rescan the tail of the previous chunk, in case the tag straddles chunks
+        scan_from = max(0, len(head) - len(closing_tag) + 1)
+        head += chunk
+        end = head[scan_from:].lower().find(closing_tag)
+        if end != -1:
+            return bytes(head[: scan_from + end + len(closing_tag)])
+        if len(head) >= max_bytes:
+            break
+    return bytes(head)
+
+
+def page_text(head: bytes, charset: Optional[str]) -> str:
+    """decode the start of a page by the charset in its headers, else the
+    one its meta tag declares, else utf-8.
+    """
+    if charset is None:
+        match = META_CHARSET_PATTERN.search(head)
+        charset = match.group(1).decode() if match else None
+    try:
+        return head.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return head.decode("utf-8", errors="replace")
+
+
+class TitleFetcher:
+    """fetches song titles from their pages over one pooled aiohttp session,
+    with a per-request timeout, a cap on concurrent fetches and a rate limit
+    per provider.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = TITLE_FETCH_CONCURRENCY,
+        timeout: float = TITLE_FETCH_TIMEOUT,
+        rates: Optional[Dict[str, float]] = None,
+    ):
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session: Optional[aiohttp.ClientSession] = None
+        # provider -> limit on fetches from its pages, unlimited if missing
+        self.rate_limits = {
+            provider: ratelimit.TokenBucket(rate, burst=concurrency)
+            for provider, rate in (
+                TITLE_FETCH_RATES if rates is None else rates
+            ).items()
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # sessions must be created on the running loop, so this is done lazily
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+            )
+        return self.session
+
+    async def fetch(self, meta_fetcher: SongMetaFetcher) -> Optional[str]:
+        """fetch the title of the song at meta_fetcher.url, best-effort."""
+        try:
+            rate_limit = self.rate_limits.get(meta_fetcher.provider, None)
+            if rate_limit is not None:
+                await rate_limit.acquire()
+            async with self.semaphore:
+                async with self._get_session().get(meta_fetcher.url) as response:
+                    head = await read_until_title(response.content)
+                    charset = response.charset
+            soup = BeautifulSoup(page_text(head, charset), "html.parser")
+            return meta_fetcher.parse_title_from_soup(soup)
+        except Exception as e:
+            logger.error(
+                f"could not get title for video '{meta_fetcher.url}'. Continuing without: {e!r}"
+            )
+            return None
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+
+class TitleBackfill:
+    """fetches the titles of metadb songs stored without one, making them
+    searchable. fetched titles are committed to the metadb in batches, and
+    songs whose fetch failed are recorded in a checkpoint after each batch,
+    so a backfill interrupted midway resumes with the songs it has yet to
+    try rather than retrying those that failed. the checkpoint is removed
+    once a backfill completes.
+    """
+
+    def __init__(
+        self,
+        meta_db: MetaDbManager,
+        meta_db_lock: asyncio.Lock,
+        titles: TitleFetcher,
+        checkpoint_path: str,
+        batch_size: int = TITLE_BACKFILL_BATCH_SIZE,
+    ):
+        self.meta_db = meta_db
+        self.meta_db_lock = meta_db_lock
+        self.titles = titles
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = max(1, batch_size)
+        # (id, title) fetched but not yet committed
+        self.batch: List[Tuple[str, str]] = []
+        # ids whose title could not be fetched
+        self.failed: Set[str] = set()
+        self.committed = 0
+
+    def _read_checkpoint(self) -> Set[str]:
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                return set(json.load(f)["failed"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"ignoring unreadable title backfill checkpoint: {e}")
+            return set()
+
+    def _write_checkpoint(self) -> None:
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"failed": sorted(self.failed)}, f)
+            os.replace(tmp_path, self.checkpoint_path)
+        except OSError as e:
+            logger.error(f"unable to write title backfill checkpoint: {e}")
+
+    async def pending(self, retry_failed: bool = False) -> List[Tuple[str, str]]:
+        """(id, url) of each untitled song to fetch, skipping those that
+        failed before an interruption unless retry_failed.
+        """
+        self.failed = set() if retry_failed else self._read_checkpoint()
+        async with self.meta_db_lock:
+            return [
+                (id, item["url"])
+                for id, item in self.meta_db.storage.items()
+                if not item.get("title") and id not in self.failed
+            ]
+
+    async def _backfill(self, song: Tuple[str, str]) -> bool:
+        id, url = song
+        meta_fetcher = get_meta_fetcher(url)
+        title = None if meta_fetcher is None else await self.titles.fetch(meta_fetcher)
+        if not title:
+            self.failed.add(id)
+            return False
+        self.batch.append((id, title))
+        if len(self.batch) >= self.batch_size:
+            await self.commit()
+        return True
+
+    async def commit(self) -> None:
+        """commit the titles fetched so far, and checkpoint progress."""
+        batch, self.batch = self.batch, []
+        songs = []
+        async with self.meta_db_lock:
+            for id, title in batch:
+                song_meta = self.meta_db.get_song_meta(id)
+                # skip songs evicted or titled since they were listed
+                if song_meta is None or song_meta.title:
+                    continue
+                song_meta.title = title
+                songs.append((id, song_meta))
+            if songs and self.meta_db.add_song_metas(songs):
+                self.committed += len(songs)
+        self._write_checkpoint()
+
+    async def run(
+        self,
+        songs: List[Tuple[str, str]],
+        workers: int,
+        progress: Callable[[int, int, int], Awaitable[None]],
+    ) -> Tuple[int, int]:
+        """backfill the titles of songs, as listed by ``pending``.
+
+        Returns: the number of songs tried and failed
+        """
+        try:
+            done, failed = await run_with_progress(
+                songs, workers, self._backfill, progress
+            )
+        finally:
+            # keep what was fetched, even if interrupted
+            await self.commit()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        logger.info(
+            f"backfilled {self.committed} titles, {failed} of {done} songs failed"
+        )
+        return done, failed
+
+
+def expand_playlist(url: str, max_tracks: int) -> List[str]:
+    """list the urls of the first max_tracks entries of a playlist, without
+    downloading or resolving the entries themselves. blocks, so run it in
+    an executor.
+    """
+    opts = {
+        "extract_flat": "in_playlist",
+        "playlistend": max_tracks,
+        "quiet": True,
+        "no_warnings": True,
+    }
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        logger.error(f"unable to expand playlist '{url}': {e}")
+        return []
+    if info is None:
+        return []
+    # a url to a single video expands to just that video
+    entries = info.get("entries", None) or [info]
+    urls = []
+    for entry in entries:
+        if entry is None:
+            continue
+        entry_url = entry.get("webpage_url", None) or entry.get("url", None)
+        if entry_url is None and entry.get("id", None) is not None:
+            entry_url = f"https://www.youtube.com/watch?v={entry['id']}"
+        if entry_url is not None:
+            urls.append(entry_url)
+    return urls[:max_tracks]
+
+
+class SongStream(NamedTuple):
+    # direct url of a song's audio, and the http headers it must be fetched with
+    url: str
+    headers: Dict[str, str]
+
+    def before_options(self) -> str:
+        """ffmpeg input options for reading the stream"""
+        if not self.headers:
+            return STREAM_BEFORE_OPTIONS
+        headers = "".join(f"{key}: {value}\r\n" for key, value in self.headers.items())
+        return f"{STREAM_BEFORE_OPTIONS} -headers {shlex.quote(headers)}"
+
+
+def resolve_stream(url: str) -> Optional[SongStream]:
+    """look up the stream of a song's best audio, without downloading it.
+    blocks, so run it in an executor.
+    """
+    opts = {
+        "format": "bestaudio/best",
+        "noplaylist": True,
+        "quiet": True,
+        "no_warnings": True,
+    }
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        logger.error(f"unable to resolve a stream for '{url}': {e}")
+        return None
+    if info is None or not info.get("url", None):
+        return None
+    return SongStream(info["url"], info.get("http_headers", None) or {})
+
+
+class DownloadsIndex:
+    """in-memory index from song id to its downloaded file path (excluding the
+    song format extension), so finding a song on disk never lists the downloads
+    folder. the folder is scanned once up front, and ``rescan`` reconciles the
+    index by re-listing only the directories whose mtime has changed.
+    """
+
+    def __init__(self, folder: str, song_format: str):
+        self.folder = folder
+        self.song_format = song_format
+        self.paths: Dict[str, str] = {}
+        # directory -> mtime when it was last listed
+        self.dir_mtimes: Dict[str, int] = {}
+        # directory -> ids of the songs listed in it
+        self.dir_entries: Dict[str, set] = {}
+
+    def scan(self) -> int:
+        """index the whole downloads folder from scratch.
+
+        Returns (int): the number of songs found
+        """
+        self.paths = {}
+        self.dir_mtimes = {}
+        self.dir_entries = {}
+        self._scan_dir(self.folder)
+        logger.info(f"indexed {len(self.paths)} songs in '{self.folder}'")
+        return len(self.paths)
+
+    def _scan_dir(self, path: str) -> None:
+        """list one directory, indexing its songs and descending into new
+        subdirectories, which hold songs whose ids contain a '/'.
+        """
+        extension = f".{self.song_format}"
+        for id in self.dir_entries.pop(path, ()):
+            self.paths.pop(id, None)
+        entries = set()
+        subdirs = []
+        with os.scandir(path) as it:
+            self.dir_mtimes[path] = os.stat(path).st_mtime_ns
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(extension):
+                    path_no_format = entry.path[: -len(extension)]
+                    id = os.path.relpath(path_no_format, self.folder).replace(
+                        os.sep, "/"
+                    )
+                    self.paths[id] = path_no_format
+                    entries.add(id)
+        self.dir_entries[path] = entries
+        for subdir in subdirs:
+            if subdir not in self.dir_mtimes:
+                self._scan_dir(subdir)
+
+    def rescan(self) -> int:
+        """re-list directories that changed since they were last listed,
+        and forget directories that no longer exist.
+
+        Returns (int): the number of directories re-listed
+        """
+        relisted = 0
+        for path, mtime in list(self.dir_mtimes.items()):
+            try:
+                current = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                for id in self.dir_entries.pop(path, ()):
+                    self.paths.pop(id, None)
+                del self.dir_mtimes[path]
+                continue
+            if current != mtime:
+                self._scan_dir(path)
+                relisted += 1
+        logger.info(
+            f"rescanned {relisted} changed directories in '{self.folder}', {len(self.paths)} songs indexed"
+        )
+        return relisted
+
+    def get(self, id: str) -> Optional[str]:
+        return self.paths.get(id, None)
+
+    def add(self, id: str, path_no_format: str) -> None:
+        self.paths[id] = path_no_format
+        directory = os.path.dirname(path_no_format)
+        self.dir_entries.setdefault(directory, set()).add(id)
+
+    def remove(self, id: str) -> None:
+        path_no_format = self.paths.pop(id, None)
+        if path_no_format is not None:
+            self.dir_entries.get(os.path.dirname(path_no_format), set()).discard(id)
+
+
+async def run_with_progress(
+    items: List,
+    workers: int,
+    fn: Callable[[Any], Awaitable[Any]],
+    progress: Callable[[int, int, int], Awaitable[None]],
+) -> Tuple[int, int]:
+    """await fn on each item in order, at most workers at a time. an item
+    fails if fn returns a falsy value. progress is awaited with the number
+    of items done and failed so far, and the total, at most once every
+    PROGRESS_INTERVAL seconds and once at the end.
+
+    Returns: the number of items done and failed
+    """
+    pending = collections.deque(items)
+    done, failed = 0, 0
+    last_report = time.monotonic()
+
+    async def report():
+        try:
+            await progress(done, failed, len(items))
+        except Exception as e:
+            logger.error(f"unable to report progress: {e}")
+
+    async def worker():
+        nonlocal done, failed, last_report
+        while pending:
+            if not await fn(pending.popleft()):
+                failed += 1
+            done += 1
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await report()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    await report()
+    return done, failed
+
+
+class SongQueue:
+    """queue of song urls, with O(1) removal from either end and cached
+    display labels for rendering. labels are resolved through describe,
+    which returns None while a song's title is still unknown, in which
+    case the url is shown and the lookup retried on the next render.
+    """
+
+    def __init__(self, describe: Callable[[str], Optional[str]]):
+        self.describe = describe
+        self.entries: collections.deque = collections.deque()
+        # url -> number of times it is queued, for O(1) membership checks
+        self.counts: collections.Counter = collections.Counter()
+        self.labels: Dict[str, str] = {}
+
+    def append(self, url: str) -> None:
+        self.entries.append(url)
+        self.counts[url] += 1
+
+    def extend(self, urls: List[str]) -> None:
+        self.entries.extend(urls)
+        self.counts.update(urls)
+
+    def appendleft(self, url: str) -> None:
+        self.entries.appendleft(url)
+        self.counts[url] += 1
+
+    def popleft(self) -> Optional[str]:
+        if not self.entries:
+            return None
+        url = self.entries.popleft()
+        self.counts[url] -= 1
+        if self.counts[url] == 0:
+            del self.counts[url]
+            self.labels.pop(url, None)
+        return url
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.counts.clear()
+        self.labels.clear()
+
+    def head(self, count: int) -> List[str]:
+        return list(itertools.islice(self.entries, count))
+
+    def label(self, url: str) -> str:
+        label = self.labels.get(url, None)
+        if label is None:
+            title = self.describe(url)
+            if title is None:
+                return url[:QUEUE_LABEL_MAX_CHARS]
+            label = self.labels[url] = title[:QUEUE_LABEL_MAX_CHARS]
+        return label
+
+    def _render(self, start: int, stop: int) -> str:
+        return "".join(
+            f"{i}. {self.label(url)}\n"
+            for i, url in enumerate(
+                itertools.islice(self.entries, start, stop), start=start
+            )
+        )
+
+    def render_page(
+        self, page: int, page_size: int = QUEUE_PAGE_SIZE
+    ) -> Tuple[str, int, int]:
+        """render one page of the queue. page is 1-based and clamped to the
+        pages available.
+
+        Returns: the rendered entries, the page shown and the number of pages
+        """
+        pages = max(1, -(-len(self.entries) // page_size))
+        page = min(max(page, 1), pages)
+        start = (page - 1) * page_size
+        return self._render(start, start + page_size), page, pages
+
+    def render_tail(self, count: int = QUEUE_TAIL_SIZE) -> str:
+        """render the last count entries of the queue"""
+        start = max(0, len(self.entries) - count)
+        return self._render(start, len(self.entries))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.counts
+
+
+class GuildPlayer:
+    """playback state for a single guild. every guild gets its own queue,
+    lock, prefetches and voice client, so busy guilds never contend with
+    one another. players are created on first use and reaped once idle.
+
+    tracks are started by a scheduler task running on the event loop. the
+    voice client's ``after`` callback, which runs on discord's audio thread,
+    only wakes the scheduler, which then resolves, downloads and starts the
+    next track in the queue.
+    """
+
+    def __init__(self, songbird: "Songbird", guild_id: Optional[int]):
+        self.songbird = songbird
+        self.guild_id = guild_id
+        self.queue_lock = asyncio.Lock()
+        self.queue = SongQueue(songbird.describe_song)
+        # url -> background get_song task for upcoming queue entries
+        self.prefetches: Dict[str, asyncio.Task] = {}
+        self.voice_client = None
+        # context of the latest play command, used for playback messages
+        self.ctx = None
+        self.now_playing: Optional[str] = None
+        self.source: Optional[PlaybackSource] = None
+        # hands a streamed track over to its download, see _follow_stream
+        self.stream_task: Optional[asyncio.Task] = None
+        self.volume = 1.0
+        self.wakeup = asyncio.Event()
+        self.scheduler: Optional[asyncio.Task] = None
+        # background downloads of playlists queued with '/play_playlist'
+        self.playlist_tasks: Set[asyncio.Task] = set()
+        self.track_ended_at: Optional[float] = None
+        self.skip_requested_at: Optional[float] = None
+        self.last_active = time.monotonic()
+
+    def touch(self) -> None:
+        self.last_active = time.monotonic()
+
+    def is_idle(self, idle_timeout: float) -> bool:
+        """True if the player has nothing to do and hasn't been used for idle_timeout seconds."""
+        if self.voice_client is not None and self.voice_client.is_connected():
+            return False
+        if self.queue or self.playlist_tasks:
+            return False
+        if any(not task.done() for task in self.prefetches.values()):
+            return False
+        return time.monotonic() - self.last_active >= idle_timeout
+
+    def close(self) -> None:
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+        for task in self.playlist_tasks:
+            task.cancel()
+        if self.stream_task is not None:
+            self.stream_task.cancel()
+        for task in self.prefetches.values():
+            task.cancel()
+        self.prefetches.clear()
+
+    def schedule_prefetch(self) -> None:
+        """download the next few queued songs in the background while the
+        current one plays, and cancel prefetches for songs no longer queued.
+        a download already handed to yt-dlp runs to completion, but cancelling
+        one still waiting for a download slot frees that slot.
+        must be called on the event loop.
+        """
+        for url, task in list(self.prefetches.items()):
+            if url not in self.queue:
+                task.cancel()
+                del self.prefetches[url]
+        for i, url in enumerate(self.queue.head(self.songbird.prefetch_count)):
+            priority = DownloadPriority.NEXT_UP if i == 0 else DownloadPriority.PREFETCH
+            if url in self.prefetches:
+                # songs move up as the queue advances
+                self.songbird.bump_download(url, priority)
+            else:
+                logger.info(f"guild {self.guild_id}: prefetching '{url}'")
+                self.prefetches[url] = asyncio.create_task(
+                    self.songbird.get_song(url, priority)
+                )
+
+    async def resolve_song(self, url: str) -> Tuple[Optional[str], bool]:
+        """get a song, taking over its prefetch if one was started.
+
+        Returns: the file-path to the song, and whether it was prefetched
+        """
+        task = self.prefetches.pop(url, None)
+        if task is not None and not task.cancelled():
+            self.songbird.bump_download(url, DownloadPriority.NOW_PLAYING)
+            return await task, True
+        return await self.songbird.get_song(url, DownloadPriority.NOW_PLAYING), False
+
+    def ensure_scheduler(self) -> None:
+        if self.scheduler is None or self.scheduler.done():
+            self.scheduler = asyncio.create_task(self.run())
+
+    def _on_track_end(self, error: Optional[Exception]) -> None:
+        """voice client ``after`` callback, run on discord's audio thread."""
+        self.songbird.bot.loop.call_soon_threadsafe(self._track_ended, error)
+
+    def _track_ended(self, error: Optional[Exception]) -> None:
+        if error:
+            logger.error(f"guild {self.guild_id}: playback error: {error}")
+        self.track_ended_at = time.perf_counter()
+        self.wakeup.set()
+
+    async def run(self) -> None:
+        """scheduler loop: whenever woken and nothing is playing, start the
+        next song in the queue.
+        """
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                await self._advance()
+            except Exception as e:
+                logger.exception(f"guild {self.guild_id}: error in scheduler: {e}")
+
+    async def _advance(self) -> None:
+        vc = self.voice_client
+        if vc is None or not vc.is_connected() or vc.is_playing() or vc.is_paused():
+            return
+        async with self.queue_lock:
+            url = self.queue.popleft()
+        if url is None:
+            if self.now_playing is not None:
+                self.now_playing = None
+                await self.ctx.followup.send(
+                    f"No songs left in queue. Add songs with '/play', providing a url!"
+                )
+            return
+
+        # set before resolving, so the song can't be evicted before it plays
+        self.now_playing = url
+        download = asyncio.create_task(self.resolve_song(url))
+        stream = None
+        if self.songbird.stream_uncached and await self.songbird.needs_download(url):
+            stream = await self.songbird.resolve_stream(url)
+        if stream is not None and not download.done():
+            # play the stream until the download finishes, rather than waiting on it
+            logger.info(f"guild {self.guild_id}: streaming '{url}' while it downloads")
+            self.source = self.create_stream_source(
+                stream, self.songbird.song_gain(url)
+            )
+            self.stream_task = asyncio.create_task(
+                self._follow_stream(self.source, download)
+            )
+            prefetched = False
+        else:
+            song_path, prefetched = await download
+            if not song_path:
+                msg = f"An error occured while trying to obtain a song for url '{url}'."
+                logger.error(msg)
+                # move on to the next song rather than stalling the queue
+                self.wakeup.set()
+                return await self.ctx.followup.send(msg)
+            self.source = self.create_source(song_path, self.songbird.song_gain(url))
+        vc.play(self.source, after=self._on_track_end)
+        started_at = time.perf_counter()
+        if self.track_ended_at is not None:
+            gap = started_at - self.track_ended_at
+            self.songbird.gap_stats[
+                "prefetched" if prefetched else "not_prefetched"
+            ].record(gap)
+            logger.info(
+                f"guild {self.guild_id}: gap between tracks: {gap * 1000:.1f}ms (prefetched={prefetched})"
+            )
+        if self.skip_requested_at is not None:
+            self.songbird.skip_stats.record(started_at - self.skip_requested_at)
+        self.track_ended_at = None
+        self.skip_requested_at = None
+        self.schedule_prefetch()
+        await self.songbird.record_play(url)
+        await self.ctx.followup.send(f"Playing: {url}.")
+
+    def create_source(self, song_path: str, gain: float = 1.0) -> PlaybackSource:
+        return PlaybackSource(song_path, self._open_source(song_path, gain=gain), gain)
+
+    def create_stream_source(
+        self, stream: SongStream, gain: float = 1.0
+    ) -> PlaybackSource:
+        source = self._open_source(
+            stream.url, gain=gain, before_options=stream.before_options()
+        )
+        return PlaybackSource(stream.url, source, gain, streaming=True)
+
+    async def _follow_stream(
+        self, source: PlaybackSource, download: asyncio.Task
+    ) -> None:
+        """hand a streamed track over to its downloaded file once ready. a
+        stream that stalled or ran out meanwhile is paused across the switch,
+        so the voice client doesn't rush the frames it missed to catch up.
+        """
+        vc = self.voice_client
+        frames, progressed_at = source.frames, time.monotonic()
+        stalled = False
+        while not download.done():
+            await asyncio.wait({download}, timeout=STREAM_CHECK_INTERVAL)
+            if not self._is_streaming(source):
+                # release a read blocked on the stream
+                source.cleanup()
+                return
+            if source.frames != frames or vc.is_paused():
+                frames, progressed_at = source.frames, time.monotonic()
+                stalled = False
+            elif not stalled and (
+                source.waiting
+                or time.monotonic() - progressed_at >= STREAM_STALL_TIMEOUT
+            ):
+                stalled = True
+                logger.warning(
+                    f"guild {self.guild_id}: stream stalled at {source.position:.2f}s, waiting on its download"
+                )
+        if not self._is_streaming(source):
+            source.cleanup()
+            return
+        try:
+            song_path, _ = download.result()
+        except Exception as e:
+            logger.error(
+                f"guild {self.guild_id}: download of a streamed song failed: {e}"
+            )
+            song_path = None
+        if not song_path:
+            source.hand_over(source.song_path, None)
+            if stalled:
+                # nothing left to play, so end the track rather than wait on it
+                source.cleanup()
+            return
+
+        stalled = stalled or source.waiting
+        pause = stalled and vc.is_playing()
+        if pause:
+            vc.pause()
+        logger.info(
+            f"guild {self.guild_id}: handing stream over to '{song_path}' at {source.position:.2f}s"
+        )
+        source.hand_over(
+            song_path,
+            self._open_source(song_path, source.position, source.gain),
+            interrupt=stalled,
+        )
+        if pause:
+            # resuming restarts the voice client's frame clock
+            vc.resume()
+
+    def _is_streaming(self, source: PlaybackSource) -> bool:
+        """True while source is still the track playing from its stream"""
+        return (
+            self.source is source
+            and source.streaming
+            and self.voice_client.is_connected()
+        )
+
+    def _open_source(
+        self,
+        song_path: str,
+        position: float = 0.0,
+        gain: float = 1.0,
+        before_options: str = "",
+    ) -> AudioSource:
+        """open song_path for playback from position seconds in. at full
+        volume ffmpeg hands over opus packets, so nothing is decoded or
+        encoded in python. unscaled opus songs are copied as stored, and a
+        loudness gain is applied by ffmpeg as it encodes. otherwise the song
+        is decoded to pcm and scaled by the volume and gain.
+        """
+        if position:
+            before_options = f"{before_options} -ss {position:.3f}".strip()
+        before_options = before_options or None
+        if self.volume == 1.0 and gain == 1.0:
+            codec = "copy" if song_path.endswith(f".{SongFormats.OPUS}") else None
+            return FFmpegOpusAudio(
+                song_path, codec=codec, before_options=before_options
+            )
+        if self.volume == 1.0:
+            return FFmpegOpusAudio(
+                song_path,
+                before_options=before_options,
+                options=f"-filter:a volume={gain:.4f}",
+            )
+        return PCMVolumeTransformer(
+            FFmpegPCMAudio(song_path, before_options=before_options),
+            volume=self.volume * gain,
+        )
+
+    def set_volume(self, volume: float) -> None:
+        """change the volume, switching the playing track between the opus
+        and pcm paths at its current position if needed.
+        """
+        self.volume = volume
+        vc = self.voice_client
+        source = self.source
+        if vc is None or source is None or not (vc.is_playing() or vc.is_paused()):
+            return
+        if volume == 1.0:
+            if source.is_opus():
+                return
+        elif isinstance(source.source, PCMVolumeTransformer):
+            source.source.volume = volume * source.gain
+            return
+        elif not vc.encoder:
+            # the voice client only creates an encoder for tracks starting on pcm
+            vc.encoder = opus.Encoder()
+        if source.streaming:
+            # a stream can't be reopened at a position, so the volume is
+            # picked up when its downloaded file takes over
+            return
+        logger.info(
+            f"guild {self.guild_id}: reopening track at {source.position:.2f}s for volume {volume}"
+        )
+        source.replace(
+            self._open_source(source.song_path, source.position, source.gain)
+        )
+
+    def skip(self) -> None:
+        """stop the current track; the scheduler then starts the next one."""
+        self.skip_requested_at = time.perf_counter()
+        if self.source is not None and self.source.streaming:
+            # the player can't stop while a read is blocked on a stalled stream
+            self.source.cleanup()
+        self.voice_client.stop()
+
+    async def enqueue(self, response_func, url: str = ""):
+        if url != "":
+            async with self.queue_lock:
+                self.queue.append(url)
+                self.schedule_prefetch()
+            msg = f"added '{url}' to queue.. queue length is '{len(self.queue)}'"
+            logger.info(msg)
+            return await response_func(
+                embed=Embed(
+                    title=f"Added '{self.queue.label(url)}' to queue:\n",
+                    description=self.queue.render_tail(),
+                ).set_footer(text=f"{len(self.queue)} songs queued")
+            )
+
+    async def download_playlist(
+        self,
+        urls: List[str],
+        workers: int,
+        progress: Callable[[int, int, int], Awaitable[None]],
+    ) -> Tuple[int, int]:
+        """download a playlist's songs in queue order through a pool of at
+        most workers concurrent downloads. songs removed from the queue
+        before their turn are skipped. see ``run_with_progress``.
+
+        Returns: the number of songs done and failed
+        """
+
+        async def download(url: str):
+            # the scheduler downloads songs it has already taken off the queue
+            if url not in self.queue:
+                return True
+            return await self.songbird.get_song(url, DownloadPriority.BACKFILL)
+
+        return await run_with_progress(urls, workers, download, progress)
+
+    async def play_playlist(self, ctx, url: str):
+        """queue every song in a playlist, start playback if nothing is
+        playing, and download the songs in the background.
+        """
+        if ctx.voice_client is None and not ctx.author.voice:  # pyright: ignore
+            await ctx.respond("You must be connected to a voice channel to use 'play'.")
+            raise commands.CommandError("Author not connected to a voice channel.")
+        await ctx.defer()
+        urls = await asyncio.get_running_loop().run_in_executor(
+            None, expand_playlist, url, self.songbird.playlist_max_tracks
+        )
+        if not urls:
+            return await ctx.followup.send(f"Couldn't find any songs in '{url}'.")
+        if ctx.voice_client is None:
+            await ctx.author.voice.channel.connect()  # pyright: ignore
+        self.voice_client = ctx.voice_client
+        self.ctx = ctx
+        self.ensure_scheduler()
+        async with self.queue_lock:
+            self.queue.extend(urls)
+            self.schedule_prefetch()
+        self.wakeup.set()
+        logger.info(f"guild {self.guild_id}: queued {len(urls)} songs from '{url}'")
+
+        message = await ctx.followup.send(
+            f"Queued {len(urls)} songs from the playlist, downloading.."
+        )
+
+        async def progress(done: int, failed: int, total: int):
+            status = f"Downloaded {done - failed}/{total} songs from the playlist"
+            if failed:
+                status += f" ({failed} failed)"
+            await message.edit(content=status + ("." if done == total else ".."))
+
+        task = asyncio.create_task(
+            self.download_playlist(
+                urls, self.songbird.playlist_download_workers, progress
+            )
+        )
+        self.playlist_tasks.add(task)
+        task.add_done_callback(self.playlist_tasks.discard)
+
+    def is_busy(self) -> bool:
+        """True if a track is playing, paused, or still being resolved."""
+        vc = self.voice_client
+        if vc is not None and (vc.is_playing() or vc.is_paused()):
+            return True
+        # set by the scheduler from resolving a track until the queue runs dry
+        return self.now_playing is not None
+
+    async def play(self, ctx, urls: List[str]):
+        """routes play command to various tasks. urls start playing in the
+        order given if nothing is playing, otherwise they are queued.
+        """
+        if ctx.voice_client is None:
+            if not ctx.author.voice:  # pyright: ignore
+                await ctx.respond(
+                    "You must be connected to a voice channel to use 'play'."
+                )
+                raise commands.CommandError("Author not connected to a voice channel.")
+            if not ctx.response.is_done():
+                await ctx.defer()
+            await ctx.author.voice.channel.connect()  # pyright: ignore
+        else:
+            self.voice_client = ctx.voice_client
+            if urls and self.is_busy():
+                for url in urls:
+                    await self.enqueue(ctx.respond, url)
+                # in case the scheduler went idle since; a playing or paused
+                # track is left alone
+                self.ctx = ctx
+                self.ensure_scheduler()
+                self.wakeup.set()
+                return
+            if not ctx.response.is_done():
+                await ctx.defer()
+        self.voice_client = ctx.voice_client
+        self.ctx = ctx
+        self.ensure_scheduler()
+        async with self.queue_lock:
+            # check if song is in queue if no url provided
+            if not urls:
+                if len(self.queue) == 0:
+                    msg = f"no songs in queue. please use 'play', providing a url to add one"
+                    logger.info(msg)
+                    return await ctx.respond(msg)
+            else:
+                # nothing is playing, so the requested songs go first
+                for url in reversed(urls):
+                    self.queue.appendleft(url)
+        # the scheduler answers the deferred interaction once the song starts
+        self.wakeup.set()
+
+
 class Songbird(commands.Cog):
     def __init__(self, config: config.PigBotSettings, bot: Bot) -> None:
         logger.info(f"initializing songbird api")
         self.bot = bot
-        self.queue_lock = asyncio.Lock()
-        self.queue = []
+        # guild id -> player, created lazily and reaped once idle
+        self.players: Dict[Optional[int], GuildPlayer] = {}
+        self.player_idle_timeout = config.pigbot_songbird_player_idle_timeout
         self.downloads_folder = os.path.join(sys.path[0], "downloads")
         self.config = config
-        self.song_format = "mp3"
+        self.song_format = SongFormats(config.pigbot_songbird_song_format)
         if not os.path.exists(self.downloads_folder):
             os.mkdir(self.downloads_folder)
         logger.info(
             f"songbird api initialized: downloads will be saved in '{self.downloads_folder}'"
         )
         self.meta_db = MetaDbManager(
-            path=os.path.join(sys.path[0], "downloads", "metadb.json")
+            path=os.path.join(sys.path[0], "downloads", "metadb.json"),
+            backend=config.pigbot_songbird_metadb_backend,
+            journal_max_bytes=config.pigbot_songbird_metadb_journal_max_bytes,
+            autocomplete_cache_size=config.pigbot_songbird_autocomplete_cache_size,
+            substring_index=config.pigbot_songbird_search_mode == SearchModes.SUBSTRING,
+            fast_load=config.pigbot_songbird_metadb_fast_load,
+            snapshot_path=(
+                os.path.join(sys.path[0], "downloads", "metadb.titles")
+                if config.pigbot_songbird_title_snapshot
+                else None
+            ),
         )
         self.meta_db_lock = asyncio.Lock()
+        self.downloads = DownloadsIndex(self.downloads_folder, self.song_format)
+        self.downloads.scan()
+        self.titles = TitleFetcher(
+            concurrency=config.pigbot_songbird_title_fetch_concurrency,
+            timeout=config.pigbot_songbird_title_fetch_timeout,
+            rates=config.pigbot_songbird_title_fetch_rates,
+        )
+        self.title_backfill: Optional[asyncio.Task] = None
+        # runs yt-dlp downloads for every guild, most urgent first
+        # with a thread always left for the song being waited on
+        self.download_pool = workpool.WorkPool(
+            config.pigbot_songbird_max_concurrent_downloads,
+            name="songbird-download",
+            urgent=DownloadPriority.NEXT_UP,
+        )
+        # song id -> most urgent priority requested for its in-flight download
+        self.download_priorities: Dict[str, DownloadPriority] = {}
+        self.prefetch_count = config.pigbot_songbird_prefetch_count
+        # play songs that must be downloaded from their stream meanwhile
+        self.stream_uncached = config.pigbot_songbird_stream_uncached
+        self.playlist_max_tracks = config.pigbot_songbird_playlist_max_tracks
+        # kept below max_concurrent_downloads so one playlist can't take every slot
+        self.playlist_download_workers = max(
+            1,
+            min(
+                config.pigbot_songbird_playlist_download_workers,
+                config.pigbot_songbird_max_concurrent_downloads - 1,
+            ),
+        )
+        # song id -> in-flight download, shared by concurrent get_song calls
+        self.song_flights = singleflight.SingleFlight()
+        # silence between one track ending and the next starting
+        self.gap_stats = {
+            "prefetched": metrics.LatencyStats(),
+            "not_prefetched": metrics.LatencyStats(),
+        }
+        # time from a skip request until the next track starts
+        self.skip_stats = metrics.LatencyStats()
+        # disk budget for downloaded songs, unlimited if not positive
+        self.cache_max_bytes = config.pigbot_songbird_cache_max_bytes
+        self.cache_max_songs = config.pigbot_songbird_cache_max_songs
+        self.cache_eviction_policy = EvictionPolicies(
+            config.pigbot_songbird_cache_eviction_policy
+        )
+        self.evicted_songs = 0
+        self.evicted_bytes = 0
+        # each measurement waits on an ffmpeg subprocess, decoding outside
+        # the interpreter, so threads measure songs as well as processes
+        self.loudness_normalization = config.pigbot_songbird_loudness_normalization
+        self.loudness_target = config.pigbot_songbird_loudness_target
+        self.loudness_workers = max(1, config.pigbot_songbird_loudness_workers)
+        self.loudness_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.loudness_workers, thread_name_prefix="songbird-loudness"
+        )
+        self.loudness_tasks: Set[asyncio.Task] = set()
+        self.loudness_backfill: Optional[asyncio.Task] = None
+        self.reap_idle_players.start()
+        self.evict_songs.start()
+        self.write_title_snapshot.start()
+        self.flush_plays.start()
+
+    def cog_unload(self):
+        self.reap_idle_players.cancel()
+        self.evict_songs.cancel()
+        self.write_title_snapshot.cancel()
+        self.flush_plays.cancel()
+        for player in self.players.values():
+            player.close()
+        self.meta_db.close()
+        self.download_pool.shutdown()
+        for task in self.loudness_tasks:
+            task.cancel()
+        if self.loudness_backfill is not None:
+            self.loudness_backfill.cancel()
+        if self.title_backfill is not None:
+            self.title_backfill.cancel()
+        self.loudness_pool.shutdown(wait=False, cancel_futures=True)
+        self.bot.loop.create_task(self.titles.close())
+
+    def describe_song(self, url: str) -> Optional[str]:
+        """the title of a downloaded song, or None if it is not known yet."""
+        meta_fetcher = self._get_meta_fetcher(url)
+        if meta_fetcher is None:
+            return None
+        song_meta = self.meta_db.find_song_meta(meta_fetcher.get_video_id())
+        if song_meta is None:
+            return None
+        return song_meta.title
+
+    def get_player(self, ctx) -> GuildPlayer:
+        """get the player for the guild ctx was invoked in, creating it if needed."""
+        player = self.players.get(ctx.guild_id, None)
+        if player is None:
+            logger.info(f"creating player for guild {ctx.guild_id}")
+            player = self.players[ctx.guild_id] = GuildPlayer(self, ctx.guild_id)
+        player.touch()
+        return player
+
+    @tasks.loop(seconds=PLAYER_REAP_INTERVAL)
+    async def reap_idle_players(self):
+        for guild_id, player in list(self.players.items()):
+            if player.is_idle(self.player_idle_timeout):
+                logger.info(f"reaping idle player for guild {guild_id}")
+                player.close()
+                del self.players[guild_id]
+
+    def _protected_song_ids(self) -> Set[str]:
+        """ids of songs that are playing, queued or being downloaded."""
+        urls = set()
+        for player in self.players.values():
+            urls.update(player.queue)
+            urls.update(player.prefetches)
+            if player.now_playing is not None:
+                urls.add(player.now_playing)
+        ids = set(self.song_flights.inflight)
+        for url in urls:
+            meta_fetcher = self._get_meta_fetcher(url)
+            if meta_fetcher is not None:
+                ids.add(meta_fetcher.get_video_id())
+        return ids
+
+    @tasks.loop(seconds=CACHE_EVICTION_INTERVAL)
+    async def evict_songs(self):
+        """evict downloaded songs until the downloads folder fits its budget."""
+        if self.cache_max_bytes <= 0 and self.cache_max_songs <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        async with self.meta_db_lock:
+            # eviction ranks songs by their stored plays
+            self.meta_db.flush_plays()
+            items = list(self.meta_db.storage.items())
+        songs = await loop.run_in_executor(None, measure_songs, items)
+        sizes = {song.id: song.size for song in songs}
+        removed = []
+        # planned and applied without yielding, so nothing can be queued in between
+        async with self.meta_db_lock:
+            for id in plan_evictions(
+                songs,
+                self._protected_song_ids(),
+                self.cache_max_bytes,
+                self.cache_max_songs,
+                self.cache_eviction_policy,
+            ):
+                song_meta = self.meta_db.remove_song_meta(id)
+                if song_meta is None:
+                    continue
+                self.downloads.remove(id)
+                removed.append(song_meta.file_path)
+                self.evicted_songs += 1
+                self.evicted_bytes += sizes[id]
+        if removed:
+            await loop.run_in_executor(None, remove_files, removed)
+            logger.info(f"evicted {len(removed)} songs from the downloads cache")
+
+    @tasks.loop(seconds=TITLE_SNAPSHOT_INTERVAL)
+    async def write_title_snapshot(self):
+        """rewrite the title snapshot once the title index has changed."""
+        async with self.meta_db_lock:
+            if not self.meta_db.snapshot_stale():
+                return
+            generation, write = self.meta_db.prepare_snapshot()
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, write):
+            return
+        async with self.meta_db_lock:
+            self.meta_db.install_snapshot(generation)
 
-    def render_queue(self) -> str:
-        """render the queue as a formatted str"""
-        if len(self.queue) == 0:
-            return ""
-        message = ""
-        for i, item in enumerate(self.queue):
-            message += f"{i}. {item}\n"
-
-        return message
+    @tasks.loop(seconds=PLAY_FLUSH_INTERVAL)
+    async def flush_plays(self):
+        """write the plays counted in memory to the metadb."""
+        async with self.meta_db_lock:
+            flushed = self.meta_db.flush_plays()
+        if flushed:
+            logger.debug(f"flushed the plays of {flushed} songs")
 
     @slash_command(description="resets the song queue")
     async def reset(self, ctx):
-        async with self.queue_lock:
-            self.queue.clear()
+        player = self.get_player(ctx)
+        async with player.queue_lock:
+            player.queue.clear()
+            player.schedule_prefetch()
         await ctx.respond(f"reset queue successfully")
 
     def _find_song(self, watch_id) -> Optional[str]:
         """finds song matching the watch_id on disk, returning the file path.
         If no song is found, return None
         """
-        songs = glob.glob(os.path.join(self.downloads_folder, f"*.{self.song_format}"))
-        for song in songs:
-            if watch_id in song:
-                logger.info(f"watch_id={watch_id} found on disk: {song}")
-                return song.replace(f".{self.song_format}", "")
+        song = self.downloads.get(watch_id)
+        if song:
+            logger.info(f"watch_id={watch_id} found on disk: {song}")
+        return song
+
+    @slash_command(description="re-sync songbird's index of downloaded songs with disk")
+    async def rescan_downloads(self, ctx):
+        logger.info(f"received rescan_downloads command")
+        await ctx.defer()
+        loop = self.bot.loop or asyncio.get_event_loop()
+        relisted = await loop.run_in_executor(None, self.downloads.rescan)
+        await ctx.followup.send(
+            f"rescanned {relisted} changed folders, {len(self.downloads.paths)} songs on disk"
+        )
+
+    def song_gain(self, url: str) -> float:
+        """the loudness normalization gain to play a song with."""
+        if not self.loudness_normalization:
+            return 1.0
+        meta_fetcher = self._get_meta_fetcher(url)
+        if meta_fetcher is None:
+            return 1.0
+        song_meta = self.meta_db.find_song_meta(meta_fetcher.get_video_id())
+        if song_meta is None or song_meta.gain is None:
+            return 1.0
+        if abs(20 * math.log10(song_meta.gain)) < GAIN_TOLERANCE_DB:
+            # close enough to leave opus songs on the copy path
+            return 1.0
+        return song_meta.gain
+
+    def _schedule_loudness(self, id: str, file_path: str) -> None:
+        task = asyncio.create_task(self.analyze_loudness(id, file_path))
+        self.loudness_tasks.add(task)
+        task.add_done_callback(self.loudness_tasks.discard)
+
+    async def analyze_loudness(self, id: str, file_path: str) -> bool:
+        """measure a song's loudness on the loudness pool and store it, with
+        the gain normalizing it, in the song's metadata.
+        """
+        loop = asyncio.get_running_loop()
+        lufs = await loop.run_in_executor(
+            self.loudness_pool, loudness.measure_integrated_loudness, file_path
+        )
+        if lufs is None:
+            return False
+        async with self.meta_db_lock:
+            # read again, as the song may have been played or evicted meanwhile
+            song_meta = self.meta_db.get_song_meta(id)
+            if song_meta is None:
+                return False
+            song_meta.lufs = lufs
+            song_meta.gain = loudness.gain_for(lufs, self.loudness_target)
+            logger.info(
+                f"song '{id}' measured at {lufs} LUFS, gain {song_meta.gain:.3f}"
+            )
+            return self.meta_db.add_song_meta(id, song_meta)
+
+    @slash_command(description="measure the loudness of songs that haven't been yet")
+    # a scan runs ffmpeg over the whole library
+    @default_permissions(administrator=True)
+    async def normalize_songs(self, ctx):
+        logger.info(f"received normalize_songs command")
+        if self.loudness_backfill is not None and not self.loudness_backfill.done():
+            return await ctx.respond("songs are already being normalized.")
+        await ctx.defer()
+        async with self.meta_db_lock:
+            pending = [
+                (id, item["file_path"])
+                for id, item in self.meta_db.storage.items()
+                if item.get("lufs") is None
+            ]
+        message = await ctx.followup.send(
+            f"Measuring the loudness of {len(pending)} songs.."
+        )
+
+        async def progress(done: int, failed: int, total: int):
+            status = f"Measured the loudness of {done - failed}/{total} songs"
+            if failed:
+                status += f" ({failed} failed)"
+            await message.edit(content=status + ("." if done == total else ".."))
+
+        self.loudness_backfill = asyncio.create_task(
+            run_with_progress(
+                pending,
+                self.loudness_workers,
+                lambda song: self.analyze_loudness(*song),
+                progress,
+            )
+        )
+
+    @slash_command(description="fetch the titles of songs saved without one")
+    # a backfill spends the title fetch rate limits '/play' relies on
+    @default_permissions(administrator=True)
+    @option(
+        "retry_failed",
+        type=bool,
+        description="also retry songs whose title couldn't be fetched by an interrupted backfill",
+    )
+    async def backfill_titles(self, ctx, retry_failed: bool = False):
+        logger.info(f"received backfill_titles command: retry_failed={retry_failed}")
+        if self.title_backfill is not None and not self.title_backfill.done():
+            return await ctx.respond("titles are already being backfilled.")
+        await ctx.defer()
+        backfill = TitleBackfill(
+            self.meta_db,
+            self.meta_db_lock,
+            self.titles,
+            os.path.join(self.downloads_folder, "metadb.backfill.json"),
+            batch_size=self.config.pigbot_songbird_title_backfill_batch_size,
+        )
+        pending = await backfill.pending(retry_failed)
+        message = await ctx.followup.send(
+            f"Fetching the titles of {len(pending)} songs.."
+        )
+
+        async def progress(done: int, failed: int, total: int):
+            status = f"Fetched the titles of {done - failed}/{total} songs"
+            if failed:
+                status += f" ({failed} failed)"
+            await message.edit(content=status + ("." if done == total else ".."))
+
+        self.title_backfill = asyncio.create_task(
+            backfill.run(pending, self.titles.concurrency, progress)
+        )
+
+    def _get_meta_fetcher(self, url: str) -> Optional[SongMetaFetcher]:
+        return get_meta_fetcher(url)
 
-    async def get_song(self, url: str) -> Optional[str]:
+    def _request_priority(self, id: str, priority: DownloadPriority) -> None:
+        current = self.download_priorities.get(id, None)
+        if current is None or priority < current:
+            self.download_priorities[id] = priority
+            self.download_pool.bump(id, priority)
+
+    def bump_download(self, url: str, priority: DownloadPriority) -> None:
+        """raise the priority of a song's download if it is in flight."""
+        meta_fetcher = self._get_meta_fetcher(url)
+        if meta_fetcher is None:
+            return
+        id = meta_fetcher.get_video_id()
+        if id in self.song_flights.inflight:
+            self._request_priority(id, priority)
+
+    async def record_play(self, url: str) -> None:
+        meta_fetcher = self._get_meta_fetcher(url)
+        if meta_fetcher is None:
+            return
+        async with self.meta_db_lock:
+            self.meta_db.record_play(meta_fetcher.get_video_id())
+
+    async def needs_download(self, url: str) -> bool:
+        """True if url is a song not downloaded yet."""
+        meta_fetcher = self._get_meta_fetcher(url)
+        if meta_fetcher is None:
+            return False
+        id = meta_fetcher.get_video_id()
+        async with self.meta_db_lock:
+            return self.meta_db.find_song_meta(id) is None
+
+    async def resolve_stream(self, url: str) -> Optional[SongStream]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, resolve_stream, url)
+
+    async def get_song(
+        self, url: str, priority: DownloadPriority = DownloadPriority.NOW_PLAYING
+    ) -> Optional[str]:
         """downloads a song from youtube if not on disk,
         otherwise returns song from disk
 
         Args:
             url (str): the url to download
-            song_path (str): the name of the file to save the download to, excluding extension
+            priority (DownloadPriority): how urgently the song is needed,
+                if it must be downloaded
 
         Returns:
             the file-path to the song, otherwise None if error occured.
         """
-        if SongMetaProviders.YOUTUBE.value in url:
-            url = url.split("&list")[0]
-            meta_fetcher = YoutubeMetaFetcher(url)
-        elif SongMetaProviders.VIMEO.value in url:
-            meta_fetcher = VimeoMetaFetcher(url)
-        elif SongMetaProviders.SOUNDCLOUD.value in url:
-            meta_fetcher = SoundcloudMetaFetcher(url)
-        else:
-            logger.error(
-                f"unsupported url {url} not one of expected providers {list(SongMetaProviders)}"
-            )
+        meta_fetcher = self._get_meta_fetcher(url)
+        if meta_fetcher is None:
             return None
+        url = meta_fetcher.url
 
         id = meta_fetcher.get_video_id()
-        song_path = os.path.join(self.downloads_folder, id)
         # query metadata db
         async with self.meta_db_lock:
-            song_meta = self.meta_db.get_song_meta(id)
+            song_meta = self.meta_db.find_song_meta(id)
 
         if song_meta:
             return song_meta.file_path
 
-        # allow concurrent downloads
-        # since songbird is blocking
-        loop = self.bot.loop or asyncio.get_event_loop()
-        result_path = await loop.run_in_executor(
-            None,
-            lambda: youtube.run_download(
-                url=url, file_path_no_format=song_path, file_format=self.song_format
-            ),
+        # concurrent requests for the same song share a single download,
+        # which runs at the most urgent priority any of them asked for
+        self._request_priority(id, priority)
+        return await self.song_flights.do(
+            id, lambda: self._fetch_song(url, id, meta_fetcher)
         )
-        if not result_path:
-            return None
+
+    async def _fetch_song(
+        self, url: str, id: str, meta_fetcher: SongMetaFetcher
+    ) -> Optional[str]:
+        """download a song and record its metadata. called at most once at a
+        time per id, through ``song_flights``.
+        """
+        try:
+            return await self._download_song(url, id, meta_fetcher)
+        finally:
+            self.download_priorities.pop(id, None)
+
+    async def _download_song(
+        self, url: str, id: str, meta_fetcher: SongMetaFetcher
+    ) -> Optional[str]:
+        # a download for this id may have completed since the caller checked
+        async with self.meta_db_lock:
+            song_meta = self.meta_db.find_song_meta(id)
+        if song_meta:
+            return song_meta.file_path
+
+        song_path = os.path.join(self.downloads_folder, id)
+        # fetch the title alongside the download, without holding the db lock
+        title_task = asyncio.create_task(self.titles.fetch(meta_fetcher))
+        found_path = self._find_song(id)
+        if found_path:
+            # on disk without metadata, e.g. after the metadb was lost
+            result_path = f"{found_path}.{self.song_format}"
+        else:
+            # songbird is blocking, so downloads run on the download pool
+            try:
+                result_path = await self.download_pool.submit(
+                    id,
+                    lambda: youtube.run_download(
+                        url=url,
+                        file_path_no_format=song_path,
+                        file_format=self.song_format,
+                    ),
+                    self.download_priorities.get(id, DownloadPriority.NOW_PLAYING),
+                )
+            except BaseException:
+                title_task.cancel()
+                raise
+            if not result_path:
+                title_task.cancel()
+                return None
+            self.downloads.add(id, song_path)
+        title = await title_task
         # add song meta to db
         async with self.meta_db_lock:
             success = self.meta_db.add_song_meta(
                 id=id,
-                song_meta=SongMeta(
-                    url=url, title=meta_fetcher.get_video_title(), file_path=result_path
-                ),
+                song_meta=SongMeta(url=url, title=title, file_path=result_path),
             )
             if not success:
                 return None
+        if self.loudness_normalization:
+            self._schedule_loudness(id, result_path)
         return result_path
 
-    def _play_next(self, ctx):
-        """synchronous callback for playing next songs in queue."""
-        loop = self.bot.loop or asyncio.get_event_loop()
-        vc = get(self.bot.voice_clients, guild=ctx.guild)
-        if len(self.queue) == 0:
-            return asyncio.run_coroutine_threadsafe(
-                ctx.followup.send(
-                    f"No songs left in queue. Add songs with '/play', providing a url!"
-                ),
-                loop,
-            )
-
-        url = self.queue.pop(0)
-        fut = asyncio.run_coroutine_threadsafe(self.get_song(url), loop)
-        song_path = fut.result()
-        if not song_path:
-            msg = f"An error occured while trying to obtain a song for url '{url}'."
-            logger.error(msg)
-            return asyncio.run_coroutine_threadsafe(ctx.followup.send(msg), loop)
-        # assert before playing that another song isn't playing.
-        if ctx.voice_client.is_playing():
-            asyncio.run_coroutine_threadsafe(self.enqueue(ctx.followup.send, url), loop)
-        source = PCMVolumeTransformer(FFmpegPCMAudio(song_path))
-        ctx.voice_client.play(source, after=lambda e: self._play_next(ctx))
-        asyncio.run_coroutine_threadsafe(
-            ctx.followup.send(f"Playing: {url}."),
-            loop,
-        )
-
-    async def enqueue(self, response_func, url: str = ""):
-        if url != "":
-            async with self.queue_lock:
-                self.queue.append(url)
-            msg = f"added '{url}' to queue.. queue length is '{len(self.queue)}'"
-            logger.info(msg)
-            return await response_func(
-                embed=Embed(
-                    title=f"Added '{url}' to queue:\n", description=self.render_queue()
-                )
-            )
-
-    async def _play(self, ctx, url: str = ""):
-        """routes play command to various tasks."""
-        if ctx.voice_client is None:
-            if not ctx.author.voice:  # pyright: ignore
-                await ctx.respond(
-                    "You must be connected to a voice channel to use 'play'."
-                )
-                raise commands.CommandError("Author not connected to a voice channel.")
-            await ctx.defer()
-            await ctx.author.voice.channel.connect()  # pyright: ignore
-        elif ctx.voice_client.is_playing():  # pyright: ignore
-            await self.enqueue(ctx.respond, url)
-            return
-        else:
-            await ctx.defer()
-        # check if song is in queue if no url provided
-        if url == "":
-            if len(self.queue) == 0:
-                msg = (
-                    f"no songs in queue. please use 'play', providing a url to add one"
-                )
-                logger.info(msg)
-                return await ctx.respond(msg)
-            async with self.queue_lock:
-                url = self.queue.pop(0)
-
-        song_path = await self.get_song(url)
-        if not song_path:
-            msg = f"An error occured while trying to obtain a song for url '{url}'."
-            logger.error(msg)
-            return await ctx.respond(msg)
-
-        # assert before playing that another song isn't playing.
-        if ctx.voice_client.is_playing():
-            return await self.enqueue(ctx.followup.send, url)
-        source = PCMVolumeTransformer(FFmpegPCMAudio(song_path))
-        ctx.voice_client.play(source, after=lambda e: self._play_next(ctx))
-        await ctx.followup.send(f"Playing: {url}.")
-
     @slash_command(description="play a song. add's song to queue if already playing")
     @option(
         "url",
@@ -428,10 +2568,13 @@ class Songbird(commands.Cog):
     @option("search", type=str, autocomplete=_get_url_from_title)
     async def play(self, ctx, url: str = "", search: str = ""):
         logger.info(f"received play command: url='{url}', search='{search}'")
-        if url != "":
-            await self._play(ctx, url)
-        if search != "":
-            await self._play(ctx, search)
+        await self.get_player(ctx).play(ctx, [u for u in (url, search) if u != ""])
+
+    @slash_command(description="queue every song in a playlist")
+    @option("url", type=str, description="url of a youtube playlist")
+    async def play_playlist(self, ctx, url: str):
+        logger.info(f"received play_playlist command: url='{url}'")
+        await self.get_player(ctx).play_playlist(ctx, url)
 
     @slash_command(description="skip current song.")
     async def next(self, ctx):
@@ -441,7 +2584,9 @@ class Songbird(commands.Cog):
         if ctx.voice_client.is_playing():
             logger.info(f"stopping current song")
             await ctx.respond("skipping current song!")
-            return ctx.voice_client.stop()
+            player = self.get_player(ctx)
+            player.voice_client = ctx.voice_client
+            return player.skip()
         else:
             return await ctx.respond(
                 "Uh-uh-uh.. I can't skip a song if there isn't one playing"
@@ -494,16 +2639,50 @@ class Songbird(commands.Cog):
             return await ctx.respond("I am not connected to a voice channel..")
 
         await ctx.defer()
-        ctx.voice_client.source.volume = volume / 100  # pyright: ignore
+        player = self.get_player(ctx)
+        player.voice_client = ctx.voice_client
+        player.set_volume(volume / 100)
         await ctx.followup.send(f"Changed volume to {volume}%")
 
+    @slash_command(description="show songbird cache and player statistics")
+    async def songbird_stats(self, ctx):
+        logger.info(f"received songbird_stats command")
+        async with self.meta_db_lock:
+            stats = self.meta_db.stats()
+        stats["downloads_started"] = self.song_flights.started
+        stats["downloads_coalesced"] = self.song_flights.coalesced
+        for k, v in self.download_pool.stats().items():
+            stats[f"download_pool_{k}"] = v
+        for k, v in providers.ids.stats().items():
+            stats[f"provider_cache_{k}"] = v
+        stats["players"] = len(self.players)
+        stats["evicted_songs"] = self.evicted_songs
+        stats["evicted_bytes"] = self.evicted_bytes
+        stats["prefetches_in_flight"] = sum(
+            not task.done()
+            for player in self.players.values()
+            for task in player.prefetches.values()
+        )
+        for kind, gap_stats in self.gap_stats.items():
+            for k, v in gap_stats.summary().items():
+                stats[f"gap_{kind}_{k}"] = v
+        for k, v in self.skip_stats.summary().items():
+            stats[f"skip_{k}"] = v
+        description = "\n".join(f"{k}: {v}" for k, v in stats.items())
+        await ctx.respond(embed=Embed(title="Songbird stats", description=description))
+
     @slash_command(description="List the contents of the queue")
-    async def list(self, ctx):
+    @option("page", type=int, description="page of the queue to show, starting at 1")
+    async def list(self, ctx, page: int = 1):
         """list the contents of the queue"""
-        async with self.queue_lock:
-            if len(self.queue) > 0:
-                msg = f"View the queue contents below: \n\n{self.render_queue()}"
-            else:
-                msg = f"Queue is empty"
-
-            await ctx.respond(msg)
+        player = self.get_player(ctx)
+        async with player.queue_lock:
+            if len(player.queue) == 0:
+                return await ctx.respond(f"Queue is empty")
+            description, page, pages = player.queue.render_page(page)
+
+        await ctx.respond(
+            embed=Embed(
+                title="View the queue contents below:", description=description
+            ).set_footer(text=f"page {page} of {pages} ({len(player.queue)} songs)")
+        )
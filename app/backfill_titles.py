@@ -0,0 +1,77 @@
+"""fetch the titles of songs saved to the songbird metadb without one.
+
+the same job as the /backfill_titles command, for use while the bot is
+stopped, as both would otherwise write to the metadb at once.
+"""
+
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import sys
+
+from api.songbird import MetaDbManager, TitleBackfill, TitleFetcher
+from models import config
+from util import logutil
+
+logger = logging.getLogger(__name__)
+
+
+async def backfill(pigbot_config: config.PigBotSettings, retry_failed: bool) -> int:
+    downloads_folder = os.path.join(sys.path[0], "downloads")
+    meta_db = MetaDbManager(
+        path=os.path.join(downloads_folder, "metadb.json"),
+        backend=pigbot_config.pigbot_songbird_metadb_backend,
+        journal_max_bytes=pigbot_config.pigbot_songbird_metadb_journal_max_bytes,
+        fast_load=pigbot_config.pigbot_songbird_metadb_fast_load,
+    )
+    titles = TitleFetcher(
+        concurrency=pigbot_config.pigbot_songbird_title_fetch_concurrency,
+        timeout=pigbot_config.pigbot_songbird_title_fetch_timeout,
+        rates=pigbot_config.pigbot_songbird_title_fetch_rates,
+    )
+    job = TitleBackfill(
+        meta_db,
+        asyncio.Lock(),
+        titles,
+        os.path.join(downloads_folder, "metadb.backfill.json"),
+        batch_size=pigbot_config.pigbot_songbird_title_backfill_batch_size,
+    )
+
+    async def progress(done: int, failed: int, total: int):
+        logger.info(
+            f"fetched the titles of {done - failed}/{total} songs ({failed} failed)"
+        )
+
+    try:
+        pending = await job.pending(retry_failed)
+        logger.info(f"fetching the titles of {len(pending)} songs")
+        _, failed = await job.run(pending, titles.concurrency, progress)
+        return 1 if failed else 0
+    finally:
+        await titles.close()
+        meta_db.wait_for_compaction()
+        meta_db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="also retry songs whose title couldn't be fetched by an interrupted backfill",
+    )
+    args = parser.parse_args()
+    logutil.set_logger_config_globally(
+        datetime.datetime.now().strftime("YYYY_mm_dd_HH:MM:SS")
+    )
+    try:
+        sys.exit(asyncio.run(backfill(config.PigBotSettings(), args.retry_failed)))
+    except KeyboardInterrupt:
+        logger.info("interrupted, run again to resume")
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
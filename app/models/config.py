@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 import os, sys
 
@@ -32,6 +32,56 @@ class PigBotSettings(BaseSettings):
     pigbot_dalle_max_number_of_images: int = 4
     # songbird setting
     pigbot_songbird_enable: bool = True
+    # format songs are downloaded in, one of "mp3" or "opus"
+    pigbot_songbird_song_format: str = "mp3"
+    # metadb storage backend, one of "json" or "sqlite". sqlite searches titles
+    # in the database rather than loading them at startup
+    pigbot_songbird_metadb_backend: str = "json"
+    # skip validating metadb records at startup, validating each on first use
+    pigbot_songbird_metadb_fast_load: bool = True
+    # size in bytes past which the metadb journal is compacted into a snapshot
+    pigbot_songbird_metadb_journal_max_bytes: int = 1048576
+    # keep a memory mapped snapshot of the title index instead of rebuilding it at startup
+    pigbot_songbird_title_snapshot: bool = True
+    # number of song search prefixes to cache autocomplete results for
+    pigbot_songbird_autocomplete_cache_size: int = 1024
+    # how /play search matches titles, one of "prefix" or "substring"
+    pigbot_songbird_search_mode: str = "prefix"
+    # cap and timeout (seconds) for fetching song titles from their pages
+    pigbot_songbird_title_fetch_concurrency: int = 4
+    pigbot_songbird_title_fetch_timeout: float = 10.0
+    # title fetches per second allowed to each provider, as json, e.g. {"youtube": 2.0}
+    pigbot_songbird_title_fetch_rates: Dict[str, float] = {
+        "youtube": 2.0,
+        "vimeo": 1.0,
+        "soundcloud": 1.0,
+    }
+    # titles fetched by /backfill_titles committed to the metadb at once
+    pigbot_songbird_title_backfill_batch_size: int = 50
+    # number of upcoming queue entries to download while a song plays
+    pigbot_songbird_prefetch_count: int = 2
+    # play a song that isn't downloaded yet from its stream while it downloads.
+    # off by default: the song is fetched twice, and resolving the stream
+    # first delays the start of playback by a yt-dlp round trip
+    pigbot_songbird_stream_uncached: bool = False
+    pigbot_songbird_max_concurrent_downloads: int = 3
+    # most songs queued from one playlist, and downloads each playlist may run at once
+    pigbot_songbird_playlist_max_tracks: int = 100
+    pigbot_songbird_playlist_download_workers: int = 2
+    # disk budget for downloaded songs in bytes and in songs, unlimited if 0,
+    # and whether to evict the least recently ("lru") or frequently ("lfu") played
+    pigbot_songbird_cache_max_bytes: int = 0
+    pigbot_songbird_cache_max_songs: int = 0
+    pigbot_songbird_cache_eviction_policy: str = "lru"
+    # whether to play songs at a common loudness, the loudness in LUFS,
+    # and how many songs may be measured at once. off by default: a song
+    # needing a gain is re-encoded by ffmpeg as it plays, rather than its
+    # opus packets being copied as stored
+    pigbot_songbird_loudness_normalization: bool = False
+    pigbot_songbird_loudness_target: float = -14.0
+    pigbot_songbird_loudness_workers: int = 2
+    # seconds a guild's player may sit idle before it is discarded
+    pigbot_songbird_player_idle_timeout: int = 600
 
     class Config:
         config_path = os.path.join(
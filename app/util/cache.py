@@ -0,0 +1,58 @@
+from typing import Any, Dict, Hashable, Optional
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """bounded mapping that evicts the least recently used entry once full.
+    lookups through ``get`` are counted as hits or misses.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self.entries.get(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """look up key without touching its recency or the counters."""
+        return self.entries.get(key, None)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        return self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,49 @@
+from typing import Optional
+import logging
+import re
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# loudness songs are normalized to, in LUFS, as used by most streaming services
+TARGET_LUFS = -14.0
+# most a song is boosted by, in dB, so quiet songs aren't amplified into clipping
+MAX_GAIN_DB = 6.0
+# seconds before measuring a single song is abandoned
+MEASURE_TIMEOUT = 300
+
+INTEGRATED_LOUDNESS = re.compile(r"I:\s+(-?\d+(?:\.\d+)?) LUFS")
+
+
+def measure_integrated_loudness(
+    path: str, executable: str = "ffmpeg", timeout: float = MEASURE_TIMEOUT
+) -> Optional[float]:
+    """measure the integrated loudness of the audio file at path with
+    ffmpeg's EBU R128 filter. decodes the whole file, so run it in an
+    executor, preferably a process pool.
+
+    Returns: the loudness in LUFS, or None if it could not be measured
+    """
+    args = [executable, "-hide_banner", "-nostats", "-i", path]
+    args += ["-map", "0:a:0", "-filter:a", "ebur128", "-f", "null", "-"]
+    try:
+        result = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.error(f"unable to measure loudness of '{path}': {e}")
+        return None
+    # the summary printed once decoding finishes holds the final value
+    matches = INTEGRATED_LOUDNESS.findall(result.stderr)
+    if result.returncode != 0 or not matches:
+        logger.error(
+            f"unable to measure loudness of '{path}': ffmpeg exited with {result.returncode}"
+        )
+        return None
+    return float(matches[-1])
+
+
+def gain_for(
+    lufs: float, target: float = TARGET_LUFS, max_gain_db: float = MAX_GAIN_DB
+) -> float:
+    """the linear amplitude scale bringing a song at lufs to target."""
+    gain_db = min(target - lufs, max_gain_db)
+    return 10 ** (gain_db / 20)
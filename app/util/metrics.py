@@ -0,0 +1,41 @@
+from typing import Dict
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """running summary of latency samples in seconds. count, mean and max
+    cover every sample, while percentiles cover the most recent ``window``.
+    """
+
+    def __init__(self, window: int = 256):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        """the q-th percentile (0-100) of the recent samples, or 0 if there are none."""
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, float]:
+        mean = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "mean_ms": round(mean * 1000, 1),
+            "p50_ms": round(self.percentile(50) * 1000, 1),
+            "p95_ms": round(self.percentile(95) * 1000, 1),
+            "max_ms": round(self.max * 1000, 1),
+        }
@@ -0,0 +1,165 @@
+from typing import Dict, List, Set, Tuple
+import array
+import bisect
+import heapq
+import itertools
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# most documents examined per query. a query made only of very common n-grams
+# (or shorter than n) is ranked among the first documents holding them, which
+# keeps lookups bounded at the cost of ranking a sample of a huge match set
+CANDIDATE_LIMIT = 2000
+# fraction of a query's n-grams a document must share to be a fuzzy match
+FUZZY_MIN_OVERLAP = 0.5
+
+
+class NgramIndex:
+    """inverted index from character n-grams to the keys containing them,
+    for ranked substring and fuzzy lookups. matching is case-insensitive.
+
+    each distinct key is a document with a list of terminators, mirroring
+    ``util.trie.Trie``. postings are compact arrays of document numbers,
+    appended in increasing order as keys are inserted. a key left with no
+    terminators is retired, its document and postings entries dropped.
+    """
+
+    def __init__(self, n: int = 3):
+        self.n = n
+        self.postings: Dict[str, array.array] = {}
+        # document number -> (key, casefolded key, terminators)
+        self.docs: Dict[int, Tuple[str, str, List[str]]] = {}
+        self.doc_numbers: Dict[str, int] = {}
+        # numbers are never reused, keeping every posting sorted
+        self.next_doc = 0
+
+    def grams(self, text: str) -> Set[str]:
+        return {text[i : i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def insert(self, key: str, terminator: str) -> None:
+        doc = self.doc_numbers.get(key, None)
+        if doc is not None:
+            self.docs[doc][2].append(terminator)
+            return
+        doc = self.next_doc
+        self.next_doc += 1
+        folded = key.casefold()
+        self.docs[doc] = (key, folded, [terminator])
+        self.doc_numbers[key] = doc
+        for gram in self.grams(folded):
+            posting = self.postings.get(gram, None)
+            if posting is None:
+                posting = self.postings[gram] = array.array("I")
+            posting.append(doc)
+
+    def remove(self, key: str, terminator: str) -> bool:
+        """remove one terminator from key, retiring its document once it has
+        none left.
+
+        Returns: True if the terminator was found and removed
+        """
+        doc = self.doc_numbers.get(key, None)
+        if doc is None or terminator not in self.docs[doc][2]:
+            return False
+        self.docs[doc][2].remove(terminator)
+        if not self.docs[doc][2]:
+            # a later insert of the same key starts a fresh document
+            del self.doc_numbers[key]
+            _, folded, _ = self.docs.pop(doc)
+            for gram in self.grams(folded):
+                posting = self.postings[gram]
+                del posting[bisect.bisect_left(posting, doc)]
+                if not posting:
+                    del self.postings[gram]
+        return True
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, List[str]]]:
+        """find up to limit keys matching query, best first. keys containing
+        query as a substring rank above fuzzy matches, and among those earlier
+        and word-initial occurrences and shorter keys rank first.
+
+        Returns: each matching key with its terminators
+        """
+        folded = query.casefold()
+        if not folded or limit <= 0:
+            return []
+        if len(folded) < self.n:
+            return self._search_short(folded, limit)
+
+        grams = self.grams(folded)
+        # rarest n-grams first, so every step touches as few documents as possible
+        ranked_grams = sorted(grams, key=lambda g: len(self.postings.get(g, ())))
+        rarest = self.postings.get(ranked_grams[0], None)
+        exact = []
+        if rarest is not None:
+            exact = [
+                doc
+                for doc in itertools.islice(rarest, CANDIDATE_LIMIT)
+                if folded in self.docs[doc][1]
+            ]
+        results = self._rank_substring(exact, folded, limit)
+        if len(results) >= limit:
+            return results
+        exclude = set(exact)
+        results.extend(
+            self._search_fuzzy(folded, ranked_grams, limit - len(results), exclude)
+        )
+        return results
+
+    def _rank_substring(
+        self, docs: List[int], folded: str, limit: int
+    ) -> List[Tuple[str, List[str]]]:
+        def rank(doc: int) -> Tuple[int, int, int]:
+            text = self.docs[doc][1]
+            position = text.find(folded)
+            at_word_start = position == 0 or not text[position - 1].isalnum()
+            return (0 if at_word_start else 1, position, len(text))
+
+        return [
+            (self.docs[doc][0], self.docs[doc][2])
+            for doc in heapq.nsmallest(limit, docs, key=rank)
+        ]
+
+    def _search_fuzzy(
+        self, folded: str, ranked_grams: List[str], limit: int, exclude: Set[int]
+    ) -> List[Tuple[str, List[str]]]:
+        """rank documents by the share of the query's n-grams they contain.
+        a document holding at least ``required`` of the query's g n-grams
+        must appear in one of the g - required + 1 rarest postings, so only
+        those are scanned for candidates.
+        """
+        required = max(1, math.ceil(len(ranked_grams) * FUZZY_MIN_OVERLAP))
+        candidates = set()
+        for gram in ranked_grams[: len(ranked_grams) - required + 1]:
+            candidates.update(
+                itertools.islice(self.postings.get(gram, ()), CANDIDATE_LIMIT)
+            )
+            candidates -= exclude
+            if len(candidates) >= CANDIDATE_LIMIT:
+                candidates = set(itertools.islice(candidates, CANDIDATE_LIMIT))
+                break
+
+        scored = []
+        for doc in candidates:
+            text = self.docs[doc][1]
+            overlap = sum(1 for gram in ranked_grams if gram in text)
+            if overlap >= required:
+                scored.append((-overlap, len(text), doc))
+        return [
+            (self.docs[doc][0], self.docs[doc][2])
+            for _, _, doc in heapq.nsmallest(limit, scored)
+        ]
+
+    def _search_short(self, folded: str, limit: int) -> List[Tuple[str, List[str]]]:
+        candidates = set()
+        for gram, posting in self.postings.items():
+            if folded in gram:
+                candidates.update(itertools.islice(posting, CANDIDATE_LIMIT))
+                if len(candidates) >= CANDIDATE_LIMIT:
+                    break
+        return self._rank_substring(list(candidates), folded, limit)
+
+    def __len__(self) -> int:
+        return len(self.doc_numbers)
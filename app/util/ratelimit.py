@@ -0,0 +1,33 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """rate limiter allowing ``rate`` acquisitions per second on average,
+    and bursts of up to ``burst`` at once after a quiet spell.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.waited = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """wait until a token is free, then take it. waiters are served in
+        the order they arrive, as each reserves its token up front.
+        """
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            delay = -self.tokens / self.rate
+            self.waited += delay
+            await asyncio.sleep(delay)
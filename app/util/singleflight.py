@@ -0,0 +1,51 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """coalesces concurrent calls that share a key onto one execution.
+    the first caller for a key starts the work, and callers arriving while
+    it is in flight await the same result. the work is only cancelled once
+    every caller waiting on it has been cancelled.
+    """
+
+    def __init__(self):
+        self.inflight: Dict[Hashable, asyncio.Task] = {}
+        self.waiters: Dict[Hashable, int] = {}
+        # number of calls that started work, and that joined work in flight
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.inflight.get(key, None)
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(fn())
+            self.inflight[key] = task
+            self.waiters[key] = 0
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.coalesced += 1
+            logger.debug(f"joining in-flight call for '{key}'")
+
+        self.waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self.waiters.get(key) == 1:
+                task.cancel()
+            raise
+        finally:
+            if self.inflight.get(key) is task:
+                self.waiters[key] -= 1
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+            del self.waiters[key]
+
+    def __len__(self) -> int:
+        return len(self.inflight)
@@ -0,0 +1,473 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import abc
+import enum
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# journal size past which it is folded into the json snapshot
+JOURNAL_MAX_BYTES = 1024 * 1024
+
+
+class MetaStorageBackends(enum.StrEnum):
+    JSON = "json"
+    SQLITE = "sqlite"
+
+
+class MetaStorage(abc.ABC):
+    """key-value storage for song metadata records, keyed by song id.
+    records are plain dicts; validation is left to the caller.
+    """
+
+    @abc.abstractmethod
+    def load(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get(self, id: str) -> Optional[dict]:
+        pass
+
+    @abc.abstractmethod
+    def put(self, id: str, item: dict) -> None:
+        """persist a record, raising on failure."""
+        pass
+
+    def put_many(self, items: List[Tuple[str, dict]]) -> None:
+        """persist several records at once, raising on failure."""
+        for id, item in items:
+            self.put(id, item)
+
+    @abc.abstractmethod
+    def delete(self, id: str) -> None:
+        """remove a record if it exists, raising on failure."""
+        pass
+
+    @abc.abstractmethod
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        pass
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    def played(self) -> Iterator[Tuple[str, int, Optional[float]]]:
+        """yield (id, play count, last played) of every played song."""
+        for id, item in self.items():
+            play_count = item.get("play_count", None)
+            if play_count:
+                yield id, play_count, item.get("last_played", None)
+
+    def title_index(self) -> Optional["TitleIndex"]:
+        """a live view of the song titles, if they can be searched in
+        storage rather than loaded into memory.
+        """
+        return None
+
+    def flush(self) -> None:
+        """make all records durable in their most compact form."""
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class JsonJournalStorage(MetaStorage):
+    """records held in memory, persisted as a json snapshot plus an append-only journal.
+
+    every ``put`` appends a single record to the journal, so the cost of a
+    write is independent of the library size. ``load`` replays the journal
+    on top of the snapshot, and once the journal grows past ``journal_max_bytes``
+    it is folded into a fresh snapshot on a background thread.
+    """
+
+    def __init__(self, path: str, journal_max_bytes: int = JOURNAL_MAX_BYTES):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        # journal being folded into the snapshot by an in-progress compaction
+        self.compacting_journal_path = f"{path}.journal.compacting"
+        self.journal_max_bytes = journal_max_bytes
+        self.db: Dict[str, dict] = {}
+        self._journal = None
+        # guards the journal file handle, which is shared with compaction
+        self._journal_lock = threading.Lock()
+        self._compaction_thread: Optional[threading.Thread] = None
+
+        if not os.path.exists(path):
+            self._write_snapshot({})
+
+    def _write_snapshot(self, db: Dict[str, dict]) -> None:
+        """atomically replace the snapshot with the contents of db.
+        the snapshot is written to a temporary file and renamed over the
+        old one, so a crash mid-write leaves the previous snapshot intact.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(db, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _replay_journal(self, path: str) -> int:
+        """apply each record of the journal at path to the in-memory db.
+        a trailing record without a newline is the remnant of a crash during
+        an append, and is truncated away so later appends start on a clean line.
+
+        Returns (int): the number of records replayed
+        """
+        if not os.path.exists(path):
+            return 0
+        replayed = 0
+        good_offset = 0
+        with open(path, "rb+") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    logger.warning(
+                        f"discarding partially written record at offset {good_offset} of journal '{path}'"
+                    )
+                    f.truncate(good_offset)
+                    break
+                good_offset += len(line)
+                try:
+                    record = json.loads(line)
+                    if record.get("deleted", False):
+                        self.db.pop(record["id"], None)
+                    else:
+                        self.db[record["id"]] = record["meta"]
+                    replayed += 1
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    logger.error(f"skipping corrupt record in journal '{path}': {e}")
+        return replayed
+
+    def _open_journal(self) -> None:
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def load(self) -> None:
+        self.wait_for_compaction()
+        with open(self.path, "r") as f:
+            self.db = json.load(f)
+            logger.info(f"loaded meta db '{self.path}'")
+
+        # a leftover compacting journal means we crashed mid-compaction,
+        # so its records may not have made it into the snapshot.
+        interrupted_compaction = os.path.exists(self.compacting_journal_path)
+        replayed = self._replay_journal(self.compacting_journal_path)
+        replayed += self._replay_journal(self.journal_path)
+        logger.info(f"replayed {replayed} journal records onto meta db")
+        self._open_journal()
+        if interrupted_compaction:
+            self.flush()
+
+    def get(self, id: str) -> Optional[dict]:
+        return self.db.get(id, None)
+
+    def _append(self, *records: dict) -> int:
+        """durably append records to the journal, with a single fsync.
+
+        Returns (int): the size of the journal afterwards
+        """
+        with self._journal_lock:
+            self._journal.write("".join(json.dumps(r) + "\n" for r in records))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            return self._journal.tell()
+
+    def put(self, id: str, item: dict) -> None:
+        self.put_many([(id, item)])
+
+    def put_many(self, items: List[Tuple[str, dict]]) -> None:
+        if not items:
+            return
+        journal_size = self._append(*({"id": id, "meta": item} for id, item in items))
+        for id, item in items:
+            self.db[id] = item
+        # the db must be up to date before compaction snapshots it
+        if journal_size >= self.journal_max_bytes:
+            self.compact()
+
+    def delete(self, id: str) -> None:
+        if id not in self.db:
+            return
+        # a tombstone, dropped from the snapshot at the next compaction
+        journal_size = self._append({"id": id, "deleted": True})
+        del self.db[id]
+        if journal_size >= self.journal_max_bytes:
+            self.compact()
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        return iter(self.db.items())
+
+    def __len__(self) -> int:
+        return len(self.db)
+
+    def flush(self) -> None:
+        """synchronously fold the journal into a fresh snapshot of the db."""
+        self.wait_for_compaction()
+        with self._journal_lock:
+            self._write_snapshot(self.db)
+            if self._journal is not None:
+                self._journal.truncate(0)
+            if os.path.exists(self.compacting_journal_path):
+                os.remove(self.compacting_journal_path)
+        logger.info(f"wrote meta db '{self.path}'")
+
+    def compact(self) -> bool:
+        """fold the journal into a new snapshot on a background thread.
+        the live journal is rotated out first, so appends made while the
+        snapshot is being written land in a fresh journal and are never lost.
+        a journal left behind by a failed compaction is folded in too.
+
+        Returns (bool): True if a compaction was started
+        """
+        if self._compaction_thread and self._compaction_thread.is_alive():
+            return False
+        with self._journal_lock:
+            self._journal.close()
+            if os.path.exists(self.compacting_journal_path):
+                # its records never made it into a snapshot, so the live
+                # journal is appended to it rather than replacing it
+                with (
+                    open(self.journal_path, "rb") as src,
+                    open(self.compacting_journal_path, "ab") as dst,
+                ):
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.compacting_journal_path)
+            self._open_journal()
+        # records are replaced rather than mutated, so a shallow copy is
+        # a consistent view of the db for the snapshot.
+        self._compaction_thread = threading.Thread(
+            target=self._compact, args=(dict(self.db),), daemon=True
+        )
+        self._compaction_thread.start()
+        return True
+
+    def _compact(self, db: Dict[str, dict]) -> None:
+        start = time.perf_counter()
+        try:
+            self._write_snapshot(db)
+            os.remove(self.compacting_journal_path)
+            logger.info(
+                f"compacted meta db '{self.path}' with {len(db)} songs in {time.perf_counter() - start:.3f}s"
+            )
+        except Exception as e:
+            logger.exception(f"error while compacting meta db '{self.path}': {e}")
+
+    def wait_for_compaction(self) -> None:
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+            self._compaction_thread = None
+
+    def close(self) -> None:
+        """wait for any compaction, then close the journal."""
+        self.wait_for_compaction()
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+class SqliteStorage(MetaStorage):
+    """records stored in a sqlite database in WAL mode.
+    nothing is held in memory, and lookups by id or title are indexed.
+    if the database does not exist yet and a json metadb is found at
+    ``migrate_from``, its records are imported once and the json files are
+    renamed with a ``.migrated`` suffix.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS songs (
+        id TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        title TEXT,
+        meta TEXT NOT NULL
+    );
+    DROP INDEX IF EXISTS songs_url;
+    CREATE INDEX IF NOT EXISTS songs_title ON songs (title);
+    """
+
+    def __init__(self, path: str, migrate_from: Optional[str] = None):
+        self.path = path
+        self.migrate_from = migrate_from
+        self.conn: Optional[sqlite3.Connection] = None
+        # the connection is shared with work running in executor threads
+        self._conn_lock = threading.Lock()
+
+    def load(self) -> None:
+        is_new = not os.path.exists(self.path)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn_lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(self.SCHEMA)
+        logger.info(f"opened meta db '{self.path}'")
+        if is_new and self.migrate_from and os.path.exists(self.migrate_from):
+            self.migrate(self.migrate_from)
+
+    def migrate(self, json_path: str) -> int:
+        """import every record of the json metadb at json_path.
+
+        Returns (int): the number of records imported
+        """
+        start = time.perf_counter()
+        source = JsonJournalStorage(json_path)
+        source.load()
+        rows = [self._row(id, item) for id, item in source.items()]
+        source.close()
+        with self._conn_lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO songs (id, url, title, meta) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        for path in (json_path, source.journal_path):
+            if os.path.exists(path):
+                os.replace(path, f"{path}.migrated")
+        logger.info(
+            f"migrated {len(rows)} songs from '{json_path}' to '{self.path}' in {time.perf_counter() - start:.3f}s"
+        )
+        return len(rows)
+
+    @staticmethod
+    def _row(id: str, item: dict) -> Tuple[str, str, Optional[str], str]:
+        # the title column is searched by prefix, so holds titles normalized
+        # the way searches are, and no empty ones
+        title = item.get("title")
+        if not isinstance(title, str) or not title:
+            title = None
+        else:
+            title = unicodedata.normalize("NFC", title)
+        return (id, item["url"], title, json.dumps(item))
+
+    def get(self, id: str) -> Optional[dict]:
+        with self._conn_lock:
+            row = self.conn.execute(
+                "SELECT meta FROM songs WHERE id = ?", (id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, id: str, item: dict) -> None:
+        self.put_many([(id, item)])
+
+    def put_many(self, items: List[Tuple[str, dict]]) -> None:
+        # committed as one transaction
+        with self._conn_lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO songs (id, url, title, meta) VALUES (?, ?, ?, ?)",
+                [self._row(id, item) for id, item in items],
+            )
+
+    def delete(self, id: str) -> None:
+        with self._conn_lock, self.conn:
+            self.conn.execute("DELETE FROM songs WHERE id = ?", (id,))
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        # a dedicated cursor streams rows rather than materializing the table
+        with self._conn_lock:
+            cursor = self.conn.execute("SELECT id, meta FROM songs")
+        for id, meta in cursor:
+            yield id, json.loads(meta)
+
+    def __len__(self) -> int:
+        with self._conn_lock:
+            return self.conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def played(self) -> Iterator[Tuple[str, int, Optional[float]]]:
+        # extracted by sqlite, sparing a json parse of every record
+        with self._conn_lock:
+            cursor = self.conn.execute(
+                "SELECT id, json_extract(meta, '$.play_count'), "
+                "json_extract(meta, '$.last_played') FROM songs "
+                "WHERE json_extract(meta, '$.play_count') > 0"
+            )
+        yield from cursor
+
+    def title_index(self) -> "TitleIndex":
+        return TitleIndex(self)
+
+    def iter_titles(self, prefix: str) -> Iterator[Tuple[str, str, str]]:
+        with self._conn_lock:
+            cursor = self.conn.execute(
+                "SELECT title, id, url FROM songs "
+                "WHERE title >= ? AND title != '' ORDER BY title",
+                (prefix,),
+            )
+        for title, id, url in cursor:
+            if not title.startswith(prefix):
+                return
+            yield title, id, url
+
+    def get_title(self, id: str) -> Optional[Tuple[str, str]]:
+        with self._conn_lock:
+            row = self.conn.execute(
+                "SELECT title, url FROM songs WHERE id = ? AND title IS NOT NULL",
+                (id,),
+            ).fetchone()
+        return row
+
+    def count_titles(self) -> int:
+        with self._conn_lock:
+            return self.conn.execute("SELECT COUNT(title) FROM songs").fetchone()[0]
+
+    def flush(self) -> None:
+        with self._conn_lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        with self._conn_lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+class TitleIndex:
+    """the titles of a sqlite metadb, read through its title index as they
+    are searched. stands in for a title snapshot, but is never out of date.
+    """
+
+    def __init__(self, storage: SqliteStorage):
+        self.storage = storage
+
+    def iter_prefix(self, prefix: str) -> Iterator[Tuple[str, str, str]]:
+        """yield (title, id, url) for every song whose title starts with
+        prefix, in title order.
+        """
+        return self.storage.iter_titles(prefix)
+
+    def get(self, id: str) -> Optional[Tuple[str, str]]:
+        """the (title, url) a song is indexed under, or None if it isn't."""
+        return self.storage.get_title(id)
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str]]:
+        return self.iter_prefix("")
+
+    def __len__(self) -> int:
+        return self.storage.count_titles()
+
+    def close(self) -> None:
+        pass
+
+
+def open_storage(
+    backend: str, path: str, journal_max_bytes: int = JOURNAL_MAX_BYTES
+) -> MetaStorage:
+    """build the storage for a metadb whose json snapshot lives at path.
+    the sqlite database sits alongside it, and migrates from it on first use.
+    """
+    if backend == MetaStorageBackends.JSON:
+        return JsonJournalStorage(path, journal_max_bytes=journal_max_bytes)
+    if backend == MetaStorageBackends.SQLITE:
+        return SqliteStorage(f"{os.path.splitext(path)[0]}.sqlite3", migrate_from=path)
+    raise ValueError(
+        f"unsupported metadb backend {backend}, expected one of {list(MetaStorageBackends)}"
+    )
@@ -0,0 +1,153 @@
+from typing import Iterable, Iterator, Optional, Tuple
+import bisect
+import mmap
+import os
+import struct
+import zlib
+
+MAGIC = b"PBTI"
+VERSION = 1
+
+# magic, version, record count, digest of the indexed songs. the file is a
+# local cache, so it is laid out in native byte order
+HEADER = struct.Struct("=4sIIQ")
+# byte lengths of a record's title, id and url, which follow it
+RECORD = struct.Struct("=III")
+OFFSET_SIZE = 4
+
+
+def digest(entries: Iterable[Tuple[str, str, str]]) -> int:
+    """order independent digest of (title, id, url) entries, telling whether
+    a snapshot still matches the songs it was written from.
+    """
+    total = 0
+    for title, id, url in entries:
+        total += zlib.crc32(f"{title}\0{id}\0{url}".encode())
+    return total & 0xFFFFFFFFFFFFFFFF
+
+
+def write(path: str, entries: Iterable[Tuple[str, str, str]]) -> None:
+    """write a snapshot of (title, id, url) entries to path, replacing any
+    existing one atomically.
+
+    the file holds a header, the record offsets in title order, the record
+    offsets in id order, then the records themselves, so lookups by title
+    prefix or by id are binary searches over the mapped file.
+    """
+    entries = list(entries)
+    records = [
+        (title.encode(), id.encode(), url.encode()) for title, id, url in entries
+    ]
+    # sorted by utf-8 bytes, which orders titles by code point, as str does
+    by_title = sorted(range(len(records)), key=lambda i: records[i][0])
+    by_id = sorted(range(len(records)), key=lambda i: records[i][1])
+    offsets = []
+    offset = 0
+    for title, id, url in records:
+        offsets.append(offset)
+        offset += RECORD.size + len(title) + len(id) + len(url)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                len(records),
+                digest(entries),
+            )
+        )
+        f.write(struct.pack(f"={len(records)}I", *(offsets[i] for i in by_title)))
+        f.write(struct.pack(f"={len(records)}I", *(offsets[i] for i in by_id)))
+        for title, id, url in records:
+            f.write(RECORD.pack(len(title), len(id), len(url)))
+            f.write(title)
+            f.write(id)
+            f.write(url)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class TitleSnapshot:
+    """read-only view of a snapshot written by ``write``, mapped into memory
+    rather than parsed, so opening one costs the same at any size.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self.mm) < HEADER.size:
+                raise ValueError(f"title snapshot '{path}' is truncated")
+            magic, version, self.count, self.digest = HEADER.unpack_from(self.mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"'{path}' is not a version {VERSION} title snapshot")
+            self.records = HEADER.size + 2 * OFFSET_SIZE * self.count
+            if len(self.mm) < self.records:
+                raise ValueError(f"title snapshot '{path}' is truncated")
+            middle = HEADER.size + OFFSET_SIZE * self.count
+            view = memoryview(self.mm)
+            self.by_title = view[HEADER.size : middle].cast("I")
+            self.by_id = view[middle : self.records].cast("I")
+        except Exception:
+            self.mm.close()
+            raise
+
+    def _record(self, offset: int) -> Tuple[bytes, bytes, bytes]:
+        start = self.records + offset
+        title_len, id_len, url_len = RECORD.unpack_from(self.mm, start)
+        start += RECORD.size
+        title_end = start + title_len
+        id_end = title_end + id_len
+        return (
+            self.mm[start:title_end],
+            self.mm[title_end:id_end],
+            self.mm[id_end : id_end + url_len],
+        )
+
+    def _title(self, i: int) -> bytes:
+        start = self.records + self.by_title[i]
+        title_len = RECORD.unpack_from(self.mm, start)[0]
+        start += RECORD.size
+        return self.mm[start : start + title_len]
+
+    def _id(self, i: int) -> bytes:
+        start = self.records + self.by_id[i]
+        title_len, id_len, _ = RECORD.unpack_from(self.mm, start)
+        start += RECORD.size + title_len
+        return self.mm[start : start + id_len]
+
+    def iter_prefix(self, prefix: str) -> Iterator[Tuple[str, str, str]]:
+        """yield (title, id, url) for every song whose title starts with
+        prefix, in title order.
+        """
+        key = prefix.encode()
+        i = bisect.bisect_left(range(self.count), key, key=self._title)
+        while i < self.count:
+            title, id, url = self._record(self.by_title[i])
+            if not title.startswith(key):
+                return
+            yield title.decode(), id.decode(), url.decode()
+            i += 1
+
+    def get(self, id: str) -> Optional[Tuple[str, str]]:
+        """the (title, url) a song is indexed under, or None if it isn't."""
+        key = id.encode()
+        i = bisect.bisect_left(range(self.count), key, key=self._id)
+        if i == self.count or self._id(i) != key:
+            return None
+        title, _, url = self._record(self.by_id[i])
+        return title.decode(), url.decode()
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str]]:
+        return self.iter_prefix("")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        # views into the map must be released before it can be closed
+        self.by_title.release()
+        self.by_id.release()
+        self.mm.close()
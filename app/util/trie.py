@@ -1,80 +1,264 @@
-from typing import List, Optional
-import collections
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class TrieNode:
-    def __init__(self):
-        self.children = collections.defaultdict(TrieNode)
+    """a radix tree node. ``label`` is the run of characters on the edge
+    leading into the node, and children are keyed by the first character
+    of their label. leaves have no children dict at all.
+    """
+
+    __slots__ = ("label", "children", "end")
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.children: Optional[Dict[str, "TrieNode"]] = None
         self.end: Optional[List[str]] = None
 
 
 class Trie:
+    """path-compressed trie (radix tree) mapping keys to lists of terminators."""
+
     def __init__(self):
         """
         Initialize your data structure here.
         """
         self.root = TrieNode()
 
+    @classmethod
+    def from_items(cls, items: Iterable[Tuple[str, str]]) -> "Trie":
+        """build a trie from (key, terminator) pairs in a single pass over
+        the sorted keys, much faster than inserting them one at a time.
+        children are ordered by key, and a key's terminators keep the order
+        they were given in.
+        """
+        t = cls()
+        # (node, length of its key) along the path to the last key added
+        stack = [(t.root, 0)]
+        previous = None
+        for key, terminator in sorted(items, key=lambda item: item[0]):
+            if key == previous:
+                stack[-1][0].end.append(terminator)
+                continue
+            common = 0
+            if previous is not None:
+                limit = min(len(previous), len(key))
+                while common < limit and previous[common] == key[common]:
+                    common += 1
+            popped = None
+            while stack[-1][1] > common:
+                popped = stack.pop()[0]
+            parent, depth = stack[-1]
+            if depth < common:
+                # the new key branches off partway along the edge just left
+                middle = TrieNode(popped.label[: common - depth])
+                popped.label = popped.label[common - depth :]
+                middle.children = {popped.label[0]: popped}
+                parent.children[middle.label[0]] = middle
+                stack.append((middle, common))
+                parent = middle
+            if not key:
+                parent.end = [terminator]
+            else:
+                leaf = TrieNode(key[common:])
+                leaf.end = [terminator]
+                if parent.children is None:
+                    parent.children = {}
+                parent.children[leaf.label[0]] = leaf
+                stack.append((leaf, len(key)))
+            previous = key
+        return t
+
     def insert(self, key: str, terminator: str) -> None:
         """
         Inserts a word into the trie.
         """
         current = self.root
-        for letter in key:
-            current = current.children[letter]
+        i = 0
+        while i < len(key):
+            child = current.children.get(key[i]) if current.children else None
+            if child is None:
+                child = TrieNode(key[i:])
+                if current.children is None:
+                    current.children = {}
+                current.children[key[i]] = child
+                current = child
+                break
+
+            label = child.label
+            if key.startswith(label, i):
+                # the whole edge matches, the usual case while descending
+                current = child
+                i += len(label)
+                continue
+            # key diverges or ends partway along the edge; split it
+            common = 1
+            limit = min(len(label), len(key) - i)
+            while common < limit and label[common] == key[i + common]:
+                common += 1
+            middle = TrieNode(label[:common])
+            child.label = label[common:]
+            middle.children = {child.label[0]: child}
+            current.children[key[i]] = middle
+            current = middle
+            i += common
 
         if not current.end:
             current.end = [terminator]
         else:
             current.end.append(terminator)
 
-        logger.info(f"item '{key}' inserted to trie, with terminator: {current.end}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"item '{key}' inserted to trie, with terminator: {current.end}"
+            )
 
     def search(self, key: str) -> Optional[List[str]]:
         """
         Returns terminator for word if it exists in trie
         """
         current = self.root
-        for letter in key:
-            current = current.children.get(letter)
-            if current is None:
+        i = 0
+        while i < len(key):
+            current = current.children.get(key[i]) if current.children else None
+            if current is None or not key.startswith(current.label, i):
                 logger.debug(f"could not find key {key} in trie")
                 return None
+            i += len(current.label)
 
         logger.debug(f"key exists in trie, with terminator: {current.end}")
         return current.end
 
-    def list_keys(self, node: TrieNode) -> List[str]:
-        """starting at the root or a provided node,
-        list all keys in the trie
+    def remove(self, key: str, terminator: str) -> bool:
+        """remove one terminator from key, removing the key itself once it
+        has none left. emptied nodes are pruned and a node left with a single
+        child and no terminators is merged into that child, so the tree stays
+        path-compressed.
+
+        Returns: True if the terminator was found and removed
         """
-        keys = []
+        # (parent, node) for each edge walked from the root
+        path = []
+        current = self.root
+        i = 0
+        while i < len(key):
+            child = current.children.get(key[i]) if current.children else None
+            if child is None or not key.startswith(child.label, i):
+                return False
+            path.append((current, child))
+            current = child
+            i += len(child.label)
 
-        for key, value in node.children.items():
-            if not value.end:
-                r = self.list_keys(value)
-                for el in r:
-                    keys.append(key + el)
-            else:
-                keys.append(key)
+        if not current.end or terminator not in current.end:
+            return False
+        current.end.remove(terminator)
+        if current.end:
+            return True
+        current.end = None
 
-        return keys
+        while path:
+            parent, node = path.pop()
+            if node.end or node.children:
+                if not node.end and len(node.children) == 1:
+                    (only,) = node.children.values()
+                    only.label = node.label + only.label
+                    parent.children[only.label[0]] = only
+                break
+            del parent.children[node.label[0]]
+            if parent.children:
+                # parent may now be a pass-through node; merge it next round
+                if path and not parent.end and len(parent.children) == 1:
+                    continue
+                break
+            parent.children = None
+        return True
 
-    def starts_with(self, prefix: str):
-        """
-        Returns if there is any word in the trie that starts with the given prefix.
+    def _find_prefix(self, prefix: str) -> Optional[Tuple[TrieNode, str]]:
+        """find the shallowest node whose key starts with prefix.
+
+        Returns: the node and its full key, or None if no key has the prefix
         """
         current = self.root
-
-        for letter in prefix:
-            current = current.children.get(letter)
-            if not current:
+        i = 0
+        while i < len(prefix):
+            current = current.children.get(prefix[i]) if current.children else None
+            if current is None:
                 return None
+            label = current.label
+            remaining = len(prefix) - i
+            if remaining < len(label):
+                # prefix ends partway along this edge
+                if not label.startswith(prefix[i:]):
+                    return None
+                return current, prefix[:i] + label
+            if not prefix.startswith(label, i):
+                return None
+            i += len(label)
+        return current, prefix
+
+    def iter_keys(
+        self, node: TrieNode, key: str = ""
+    ) -> Iterator[Tuple[str, List[str]]]:
+        """iteratively walk the subtree at node, yielding each key with its
+        terminators. a key is always yielded before the keys that extend it.
+
+        Args:
+            node (TrieNode): the subtree to walk
+            key (str): the key of node itself, prepended to every result
+        """
+        stack = [(key, node)]
+        while stack:
+            key, node = stack.pop()
+            if node.end:
+                yield key, node.end
+            if node.children:
+                stack.extend(
+                    (key + child.label, child)
+                    for child in reversed(node.children.values())
+                )
+
+    def list_keys(self, node: Optional[TrieNode] = None) -> List[str]:
+        """starting at the root or a provided node,
+        list all keys in the trie, relative to that node
+        """
+        return [key for key, _ in self.iter_keys(node or self.root)]
+
+    def starts_with(
+        self, prefix: str, limit: Optional[int] = None
+    ) -> Optional[List[Tuple[str, List[str]]]]:
+        """
+        Returns up to limit keys that start with the given prefix, each
+        paired with its terminators, or None if no key has the prefix.
+        """
+        found = self._find_prefix(prefix)
+        if found is None:
+            return None
+
+        matches = []
+        if limit is not None and limit <= 0:
+            return matches
+        for match in self.iter_keys(*found):
+            matches.append(match)
+            if limit is not None and len(matches) >= limit:
+                break
+        return matches
+
+    def iter_prefix(self, prefix: str) -> Iterator[Tuple[str, List[str]]]:
+        """lazily yield each key starting with prefix, with its terminators."""
+        found = self._find_prefix(prefix)
+        if found is None:
+            return iter(())
+        return self.iter_keys(*found)
 
-        # drill to end of trie from current node.
-        # add prefix to all returned values
-        matches = self.list_keys(current)
-        return [prefix + item for item in matches]
+    def node_count(self) -> int:
+        """the number of nodes in the trie, including the root."""
+        count = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            if node.children:
+                stack.extend(node.children.values())
+        return count
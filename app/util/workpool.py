@@ -0,0 +1,173 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from util import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, key: Hashable, fn: Callable[[], Any], priority: int):
+        self.key = key
+        self.fn = fn
+        self.priority = priority
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.perf_counter()
+        self.started = False
+        # whether the call counted against the threads urgent calls can't use
+        self.deferrable = False
+
+
+class WorkPool:
+    """runs blocking calls on a dedicated thread pool of ``workers`` threads.
+    calls waiting for a thread are started lowest priority value first, then
+    in submission order. a call cancelled while waiting never runs, while
+    one already running is left to finish and its result dropped.
+    calls with a priority value above ``urgent`` share at most
+    ``workers - 1`` threads, so an urgent call never waits behind them.
+    """
+
+    def __init__(
+        self, workers: int, name: str = "workpool", urgent: Optional[int] = None
+    ):
+        self.workers = max(1, workers)
+        self.urgent = urgent
+        # threads calls above the urgent priority may hold at once
+        self.deferrable_workers = max(1, self.workers - 1)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix=name
+        )
+        # (priority, submission order, job); entries left behind by a
+        # cancel or a bump are skipped when popped
+        self.heap: List[Tuple[int, int, Job]] = []
+        self.counter = itertools.count()
+        # key -> job waiting for a thread
+        self.pending: Dict[Hashable, Job] = {}
+        self.running = 0
+        self.running_deferrable = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.closed = False
+        self.wait_stats = metrics.LatencyStats()
+        self.run_stats = metrics.LatencyStats()
+
+    async def submit(self, key: Hashable, fn: Callable[[], Any], priority: int) -> Any:
+        """run fn on the pool once a thread is free and no waiting call has a
+        lower priority value. key identifies the call for ``bump`` and must
+        be unique among waiting calls.
+        """
+        job = Job(key, fn, priority)
+        self.pending[key] = job
+        heapq.heappush(self.heap, (priority, next(self.counter), job))
+        self._dispatch()
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            if not job.started:
+                self._forget(job)
+                self.cancelled += 1
+            # a running call's result is dropped when it finishes
+            job.future.cancel()
+            raise
+
+    def bump(self, key: Hashable, priority: int) -> bool:
+        """raise the priority of a waiting call. does nothing if the call is
+        not waiting or already has an equal or lower priority value.
+
+        Returns: True if the call was bumped
+        """
+        job = self.pending.get(key, None)
+        if job is None or job.priority <= priority:
+            return False
+        logger.debug(f"bumping '{key}' from priority {job.priority} to {priority}")
+        job.priority = priority
+        heapq.heappush(self.heap, (priority, next(self.counter), job))
+        # an urgent call may take a thread held back from the others
+        self._dispatch()
+        return True
+
+    def _forget(self, job: Job) -> None:
+        if self.pending.get(job.key, None) is job:
+            del self.pending[job.key]
+
+    def _peek(self) -> Optional[Job]:
+        while self.heap:
+            priority, _, job = self.heap[0]
+            if self.pending.get(job.key, None) is job and job.priority == priority:
+                return job
+            heapq.heappop(self.heap)
+        return None
+
+    def _dispatch(self) -> None:
+        while self.running < self.workers and not self.closed:
+            job = self._peek()
+            if job is None:
+                return
+            deferrable = self.urgent is not None and job.priority > self.urgent
+            if deferrable and self.running_deferrable >= self.deferrable_workers:
+                # every call still waiting is at least as deferrable
+                return
+            heapq.heappop(self.heap)
+            self._forget(job)
+            job.started = True
+            job.deferrable = deferrable
+            self.running += 1
+            if job.deferrable:
+                self.running_deferrable += 1
+            started_at = time.perf_counter()
+            self.wait_stats.record(started_at - job.enqueued_at)
+            run = asyncio.get_running_loop().run_in_executor(self.executor, job.fn)
+            run.add_done_callback(
+                lambda run, job=job, started_at=started_at: self._finish(
+                    job, run, started_at
+                )
+            )
+
+    def _finish(self, job: Job, run: asyncio.Future, started_at: float) -> None:
+        self.running -= 1
+        if job.deferrable:
+            self.running_deferrable -= 1
+        self.completed += 1
+        self.run_stats.record(time.perf_counter() - started_at)
+        if not job.future.done():
+            if run.cancelled():
+                # dropped from the executor by a shutdown before it started
+                job.future.cancel()
+            elif run.exception() is not None:
+                job.future.set_exception(run.exception())
+            else:
+                job.future.set_result(run.result())
+        self._dispatch()
+
+    def depth(self) -> int:
+        """number of calls waiting for a thread"""
+        return len(self.pending)
+
+    def stats(self) -> Dict[str, float]:
+        stats = {
+            "workers": self.workers,
+            "running": self.running,
+            "running_deferrable": self.running_deferrable,
+            "queued": self.depth(),
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+        }
+        for k, v in self.wait_stats.summary().items():
+            stats[f"wait_{k}"] = v
+        for k, v in self.run_stats.summary().items():
+            stats[f"run_{k}"] = v
+        return stats
+
+    def shutdown(self) -> None:
+        self.closed = True
+        # calls still waiting for a thread will never get one
+        for job in self.pending.values():
+            job.future.cancel()
+        self.pending = {}
+        self.heap = []
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,341 @@
+"""benchmarks of the songbird metadb and title index over synthetic libraries.
+
+not collected by pytest; run with ``make bench``, or directly:
+
+    python tests/benchmark/bench_songbird.py --output bench.json
+    python tests/benchmark/bench_songbird.py --baseline bench.json --threshold 0.25
+
+each library is benchmarked over several rounds, keeping each result's best
+value, so noise from other load on the machine doesn't read as a regression.
+results are written as json, and the run fails if any timing or throughput
+regressed past the threshold relative to the baseline.
+"""
+
+from typing import Callable, Dict, List, Optional
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "app"))
+from api.songbird import MetaDbManager, SongMeta, _get_url_from_title
+from util import metrics, trie
+
+SIZES = [1000, 10000, 100000]
+# relative slowdown past which a result counts as a regression
+THRESHOLD = 0.2
+SEED = 1234
+# rounds each library is benchmarked over
+ROUNDS = 5
+WORDS = (
+    "love night heart dream fire rain summer blue gold light dance road wild "
+    "river moon star city home girl boy time baby world lost young free ghost "
+    "sweet dark electric paradise highway thunder ocean velvet midnight echo"
+).split()
+# operations sampled by each throughput and latency measurement
+SAMPLES = 2000
+# seconds a timing is repeated for, at least, keeping its fastest run
+MIN_TIME = 0.5
+# results where a larger value is better, all others are timings or sizes
+HIGHER_IS_BETTER_SUFFIX = "_ops"
+# results reported but not gated: memory sizes, which depend on the
+# allocator's state, and mean latencies, which a few outliers swing where
+# the percentiles hold steady
+UNGATED_SUFFIXES = ("_mb", "_mean_us")
+
+logger = logging.getLogger(__name__)
+
+
+def make_library(path: str, size: int, rng: random.Random) -> List[str]:
+    """write a synthetic metadb of size songs to path.
+
+    Returns: the song titles
+    """
+    db = {}
+    titles = []
+    for i in range(size):
+        id = f"{i:011d}"
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+        titles.append(title)
+        db[id] = {
+            "url": f"https://www.youtube.com/watch?v={id}",
+            "file_path": f"/downloads/{id}.mp3",
+            "title": title,
+        }
+    with open(path, "w") as f:
+        json.dump(db, f)
+    return titles
+
+
+def rss_bytes() -> int:
+    """resident set size of this process, or its peak where the current
+    size can't be read.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # reported in bytes on macos, kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def fastest(fn: Callable[[], object]) -> float:
+    """seconds taken by the fastest of repeated calls to fn, made for at
+    least MIN_TIME, so short timings aren't decided by a single run.
+    """
+    best = float("inf")
+    spent = 0.0
+    while spent < MIN_TIME:
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+    return best
+
+
+def throughput(fn: Callable[[int], object], samples: int) -> float:
+    def run_all():
+        for i in range(samples):
+            fn(i)
+
+    return round(samples / fastest(run_all))
+
+
+def latency(stats: metrics.LatencyStats, prefix: str) -> Dict[str, float]:
+    # in microseconds, as most operations finish well within a millisecond
+    return {
+        f"{prefix}_mean_us": round(stats.total / stats.count * 1e6, 1),
+        f"{prefix}_p50_us": round(stats.percentile(50) * 1e6, 1),
+        f"{prefix}_p95_us": round(stats.percentile(95) * 1e6, 1),
+    }
+
+
+def bench_load(folder: str) -> Dict[str, float]:
+    path = os.path.join(folder, "metadb.json")
+    snapshot_path = os.path.join(folder, "metadb.titles")
+    results = {}
+    gc.collect()
+    before = rss_bytes()
+    db = MetaDbManager(path, fast_load=True, snapshot_path=snapshot_path)
+    results["load_rss_mb"] = round((rss_bytes() - before) / 2**20, 1)
+    db.close()
+    load = lambda **kwargs: MetaDbManager(path, **kwargs).close()
+    # no snapshot has been written yet
+    results["load_ms"] = round(
+        1000 * fastest(lambda: load(fast_load=True, snapshot_path=snapshot_path)), 2
+    )
+    db = MetaDbManager(path, fast_load=True, snapshot_path=snapshot_path)
+    generation, write = db.prepare_snapshot()
+    write()
+    db.close()
+
+    # a restart with the snapshot written above still current
+    results["load_snapshot_ms"] = round(
+        1000 * fastest(lambda: load(fast_load=True, snapshot_path=snapshot_path)), 2
+    )
+    results["load_validated_ms"] = round(
+        1000 * fastest(lambda: load(fast_load=False)), 2
+    )
+    return results
+
+
+def bench_add_song_meta(folder: str) -> Dict[str, float]:
+    db = MetaDbManager(os.path.join(folder, "metadb.json"), fast_load=True)
+    stats = metrics.LatencyStats(window=SAMPLES)
+    for i in range(SAMPLES):
+        song_meta = SongMeta(
+            url=f"https://www.youtube.com/watch?v=new{i}",
+            file_path=f"/downloads/new{i}.mp3",
+            title=f"New Song {i}",
+        )
+        start = time.perf_counter()
+        db.add_song_meta(f"new{i}", song_meta)
+        stats.record(time.perf_counter() - start)
+    db.wait_for_compaction()
+    db.close()
+    return latency(stats, "add_song_meta")
+
+
+def bench_trie(titles: List[str], rng: random.Random) -> Dict[str, float]:
+    items = [(title, str(i)) for i, title in enumerate(titles)]
+
+    def insert_all():
+        t = trie.Trie()
+        for title, id in items:
+            t.insert(title, id)
+        return t
+
+    results = {"trie_insert_ops": round(len(items) / fastest(insert_all))}
+    build = lambda: trie.Trie.from_items(items)
+    results["trie_build_ops"] = round(len(items) / fastest(build))
+    t = insert_all()
+    keys = [rng.choice(titles) for _ in range(SAMPLES)]
+    results["trie_search_ops"] = throughput(lambda i: t.search(keys[i]), SAMPLES)
+    prefixes = [key[: rng.randint(3, 8)] for key in keys]
+    results["trie_starts_with_ops"] = throughput(
+        lambda i: t.starts_with(prefixes[i]), SAMPLES
+    )
+    return results
+
+
+def bench_autocomplete(
+    folder: str, titles: List[str], rng: random.Random
+) -> Dict[str, float]:
+    db = MetaDbManager(
+        os.path.join(folder, "metadb.json"),
+        fast_load=True,
+        snapshot_path=os.path.join(folder, "metadb.titles"),
+    )
+    cog = types.SimpleNamespace(meta_db=db, meta_db_lock=asyncio.Lock())
+    prefixes = [rng.choice(titles)[: rng.randint(1, 8)] for _ in range(SAMPLES)]
+
+    async def complete_all(stats: metrics.LatencyStats) -> None:
+        for prefix in prefixes:
+            # stands in for the AutocompleteContext discord passes
+            ctx = types.SimpleNamespace(cog=cog, value=prefix)
+            start = time.perf_counter()
+            await _get_url_from_title(ctx)
+            stats.record(time.perf_counter() - start)
+
+    results = {}
+    # the second pass hits the prefix cache filled by the first
+    for label in ("autocomplete_cold", "autocomplete_warm"):
+        stats = metrics.LatencyStats(window=SAMPLES)
+        asyncio.run(complete_all(stats))
+        results.update(latency(stats, label))
+    db.close()
+    return results
+
+
+def run_round(size: int) -> Dict[str, float]:
+    """benchmark a fresh library of size songs, identical every round."""
+    rng = random.Random(SEED)
+    result = {}
+    with tempfile.TemporaryDirectory() as folder:
+        titles = make_library(os.path.join(folder, "metadb.json"), size, rng)
+        result.update(bench_load(folder))
+        result.update(bench_trie(titles, rng))
+        result.update(bench_autocomplete(folder, titles, rng))
+        # last, as it grows the library
+        result.update(bench_add_song_meta(folder))
+    return result
+
+
+def best(rounds: List[Dict[str, float]]) -> Dict[str, float]:
+    """each result's best value across rounds"""
+    combined = {}
+    for name in rounds[0]:
+        values = [result[name] for result in rounds]
+        if name.endswith(HIGHER_IS_BETTER_SUFFIX):
+            combined[name] = max(values)
+        else:
+            combined[name] = min(values)
+    return combined
+
+
+def run(sizes: List[int], rounds: int = ROUNDS) -> Dict[str, Dict[str, float]]:
+    """benchmark each size over rounds, each in a fresh process. a process's
+    memory layout alone can shift its timings by tens of percent, so rounds
+    sharing one would share its luck.
+    """
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            samples = pool.map(run_round, [size] * rounds, chunksize=1)
+        results[str(size)] = best(samples)
+        logger.info(f"{size} songs: {json.dumps(results[str(size)])}")
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float,
+) -> List[str]:
+    """Returns: a description of each result that regressed past threshold"""
+    regressions = []
+    for size, values in results.items():
+        for name, value in values.items():
+            previous = baseline.get(size, {}).get(name, None)
+            if not previous or name.endswith(UNGATED_SUFFIXES):
+                continue
+            if name.endswith(HIGHER_IS_BETTER_SUFFIX):
+                change = previous / value - 1 if value else float("inf")
+            else:
+                change = value / previous - 1
+            if change > threshold:
+                regressions.append(
+                    f"{name} at {size} songs: {previous} -> {value} ({change:+.0%} worse)"
+                )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(size) for size in s.split(",")],
+        default=SIZES,
+        help="comma separated library sizes",
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=ROUNDS,
+        help="rounds to benchmark each library over, keeping the best results",
+    )
+    parser.add_argument("--output", help="file to write json results to")
+    parser.add_argument("--baseline", help="json results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="relative slowdown that fails the run",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # the metadb and its storage log every load, drowning out the results
+    logging.getLogger("api").setLevel(logging.WARNING)
+    logging.getLogger("util").setLevel(logging.WARNING)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "rounds": args.rounds,
+        "results": run(args.sizes, max(1, args.rounds)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(report["results"], baseline, args.threshold)
+        for regression in regressions:
+            logger.error(f"regression: {regression}")
+        if regressions:
+            return 1
+        logger.info(f"no regressions past {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
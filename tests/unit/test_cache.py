@@ -0,0 +1,27 @@
+from util.cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used():
+    c = LRUCache(maxsize=2)
+    c.put("a", 1)
+    c.put("b", 2)
+    assert c.get("a") == 1
+    c.put("c", 3)
+    assert "b" not in c
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+
+
+def test_lru_counts_hits_and_misses():
+    c = LRUCache(maxsize=2)
+    c.put("a", 1)
+    c.get("a")
+    c.get("b")
+    c.peek("a")
+    assert (c.hits, c.misses) == (1, 1)
+
+
+def test_lru_zero_size_stores_nothing():
+    c = LRUCache(maxsize=0)
+    c.put("a", 1)
+    assert len(c) == 0
@@ -0,0 +1,38 @@
+import stat
+import pytest
+from util.loudness import gain_for, measure_integrated_loudness
+
+EBUR128_OUTPUT = """[Parsed_ebur128_0 @ 0x1] t: 0.4 M: -30.1 S:-120.7 I: -30.1 LUFS LRA: 0.0 LU
+[Parsed_ebur128_0 @ 0x1] Summary:
+
+  Integrated loudness:
+    I:         -18.5 LUFS
+    Threshold: -28.6 LUFS
+"""
+
+
+def _fake_ffmpeg(tmp_path, stderr: str, code: int = 0) -> str:
+    (tmp_path / "stderr.txt").write_text(stderr)
+    path = tmp_path / "ffmpeg"
+    path.write_text(f"#!/bin/sh\ncat '{tmp_path / 'stderr.txt'}' >&2\nexit {code}\n")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_measure_reads_summary(tmp_path):
+    ffmpeg = _fake_ffmpeg(tmp_path, EBUR128_OUTPUT)
+    assert measure_integrated_loudness("song.opus", executable=ffmpeg) == -18.5
+
+
+def test_measure_failures_return_none(tmp_path):
+    failing = _fake_ffmpeg(tmp_path, "song.opus: No such file", code=1)
+    assert measure_integrated_loudness("song.opus", executable=failing) is None
+    missing = str(tmp_path / "missing")
+    assert measure_integrated_loudness("song.opus", executable=missing) is None
+
+
+def test_gain_for():
+    assert gain_for(-14.0) == pytest.approx(1.0)
+    assert gain_for(-8.0) == pytest.approx(0.501, abs=1e-3)
+    # boosts are capped
+    assert gain_for(-70.0) == pytest.approx(gain_for(-20.0))
@@ -0,0 +1,25 @@
+from util.metrics import LatencyStats
+
+
+def test_latency_stats_summary():
+    stats = LatencyStats()
+    for ms in range(1, 101):
+        stats.record(ms / 1000)
+    summary = stats.summary()
+    assert summary["count"] == 100
+    assert summary["mean_ms"] == 50.5
+    assert summary["p50_ms"] == 51.0
+    assert summary["p95_ms"] == 95.0
+    assert summary["max_ms"] == 100.0
+
+
+def test_latency_stats_window_bounds_percentiles():
+    stats = LatencyStats(window=2)
+    for seconds in (10.0, 0.001, 0.001):
+        stats.record(seconds)
+    assert stats.percentile(100) == 0.001
+    assert stats.max == 10.0
+
+
+def test_latency_stats_empty():
+    assert LatencyStats().summary()["p95_ms"] == 0.0
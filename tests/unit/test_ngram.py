@@ -0,0 +1,85 @@
+from util.ngram import NgramIndex
+
+
+def _index(*keys):
+    index = NgramIndex()
+    for i, key in enumerate(keys):
+        index.insert(key, f"id{i}")
+    return index
+
+
+def test_substring_match_mid_title():
+    index = _index("Never Gonna Give You Up (Official Video) - Rick Astley", "Other")
+    assert index.search("rick astley", 5) == [
+        ("Never Gonna Give You Up (Official Video) - Rick Astley", ["id0"])
+    ]
+
+
+def test_substring_ranks_word_start_and_shorter_first():
+    index = _index("xxcatxx", "the cat sat on the mat", "cat")
+    assert [key for key, _ in index.search("cat", 3)] == [
+        "cat",
+        "the cat sat on the mat",
+        "xxcatxx",
+    ]
+
+
+def test_fuzzy_match_after_substring_matches():
+    index = _index("bohemian rhapsody", "bohemain rhapsody live")
+    results = index.search("bohemian rhapsody", 5)
+    assert [key for key, _ in results] == [
+        "bohemian rhapsody",
+        "bohemain rhapsody live",
+    ]
+
+
+def test_no_match():
+    index = _index("bohemian rhapsody")
+    assert index.search("zzzz", 5) == []
+    assert index.search("", 5) == []
+
+
+def test_short_query():
+    index = _index("abba", "xyz")
+    assert index.search("bb", 5) == [("abba", ["id0"])]
+
+
+def test_duplicate_keys_share_terminators():
+    index = NgramIndex()
+    index.insert("song", "id1")
+    index.insert("song", "id2")
+    assert index.search("song", 5) == [("song", ["id1", "id2"])]
+    assert len(index) == 1
+
+
+def test_limit():
+    index = _index(*[f"track {i}" for i in range(10)])
+    assert len(index.search("track", 3)) == 3
+
+
+def test_removed_keys_are_not_found():
+    index = _index("Bohemian Rhapsody", "Bohemian Like You")
+    assert index.remove("Bohemian Rhapsody", "id0")
+    assert not index.remove("Bohemian Rhapsody", "id0")
+    assert [key for key, _ in index.search("bohemian", 5)] == ["Bohemian Like You"]
+    assert index.search("rhapsody", 5) == []
+    assert index.search("bo", 5) == [("Bohemian Like You", ["id1"])]
+    assert len(index) == 1
+
+    index.insert("Bohemian Rhapsody", "new")
+    assert index.search("rhapsody", 5) == [("Bohemian Rhapsody", ["new"])]
+
+
+def test_retired_keys_release_their_postings():
+    index = _index("Bohemian Rhapsody", "Bohemian Like You")
+    before = {gram: list(posting) for gram, posting in index.postings.items()}
+    for _ in range(3):
+        index.insert("Bohemian Rhapsody Live", "retitled")
+        assert index.remove("Bohemian Rhapsody Live", "retitled")
+    assert len(index.docs) == 2
+    assert {gram: list(p) for gram, p in index.postings.items()} == before
+
+    index.remove("Bohemian Rhapsody", "id0")
+    index.remove("Bohemian Like You", "id1")
+    assert index.docs == {}
+    assert index.postings == {}
@@ -0,0 +1,34 @@
+import asyncio
+
+from util.ratelimit import TokenBucket
+
+
+def test_burst_passes_then_rate_applies(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+
+    async def run():
+        bucket = TokenBucket(rate=2.0, burst=2)
+        # freeze the clock so no tokens refill between acquisitions
+        bucket._refill = lambda: None
+        for _ in range(4):
+            await bucket.acquire()
+
+    asyncio.run(run())
+    # the first two use the burst, later ones queue half a second apart
+    assert delays == [0.5, 1.0]
+
+
+def test_unlimited_rate_never_waits():
+    bucket = TokenBucket(rate=0)
+
+    async def run():
+        for _ in range(10):
+            await bucket.acquire()
+
+    asyncio.run(run())
+    assert bucket.waited == 0
@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from util.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def run():
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "done"
+
+        results = await asyncio.gather(*(flights.do("id", work) for _ in range(3)))
+        assert results == ["done"] * 3
+        assert len(calls) == 1
+        assert (flights.started, flights.coalesced) == (1, 2)
+        assert len(flights) == 0
+
+        # once finished, the next call starts fresh work
+        assert await flights.do("id", work) == "done"
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+
+def test_cancelling_one_waiter_keeps_shared_work():
+    async def run():
+        flights = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            return "done"
+
+        first = asyncio.ensure_future(flights.do("id", work))
+        second = asyncio.ensure_future(flights.do("id", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "done"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(run())
+
+
+def test_cancelling_last_waiter_cancels_work():
+    async def run():
+        flights = SingleFlight()
+        started = asyncio.Event()
+
+        async def work():
+            started.set()
+            await asyncio.sleep(10)
+
+        waiter = asyncio.ensure_future(flights.do("id", work))
+        await started.wait()
+        task = flights.inflight["id"]
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert task.cancelled()
+        # done callbacks run on the next loop iteration
+        await asyncio.sleep(0)
+        assert len(flights) == 0
+
+    asyncio.run(run())
+
+
+def test_errors_propagate_to_every_waiter():
+    async def run():
+        flights = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(
+            flights.do("id", work), flights.do("id", work), return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+
+    asyncio.run(run())
@@ -1,12 +1,36 @@
+import asyncio
 import json
+import os
+import threading
+import time
+import types
 import pytest
+from aiohttp import web
 from api.songbird import (
+    _get_url_from_title,
+    read_until_title,
     YoutubeMetaFetcher,
     VimeoMetaFetcher,
     SoundcloudMetaFetcher,
+    CachedSong,
+    DownloadPriority,
+    DownloadsIndex,
+    EvictionPolicies,
+    GuildPlayer,
     MetaDbManager,
+    PlaybackSource,
+    ProviderRegistry,
     SongMeta,
+    SongQueue,
+    SongStream,
+    TitleBackfill,
+    TitleFetcher,
+    measure_songs,
+    plan_evictions,
 )
+from util import metrics
+from discord import AudioSource
+import api.songbird as songbird_api
 
 # --- URL parsers ---
 
@@ -47,6 +71,57 @@ class TestSoundcloudMetaFetcher:
         assert f.get_video_id() == "artist/track-name"
 
 
+class TestProviderRegistry:
+    def _registry(self):
+        return ProviderRegistry(
+            [YoutubeMetaFetcher, VimeoMetaFetcher, SoundcloudMetaFetcher]
+        )
+
+    def test_url_forms_share_one_cache_entry(self):
+        registry = self._registry()
+        urls = [
+            "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+            "https://youtu.be/dQw4w9WgXcQ?si=tracking",
+            "https://m.youtube.com/watch?v=dQw4w9WgXcQ&list=PLabc123&index=2",
+            "youtube.com/watch?feature=share&v=dQw4w9WgXcQ",
+        ]
+        for url in urls:
+            f = registry.get_meta_fetcher(url)
+            assert f.provider == "youtube"
+            assert f.url == "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+            assert f.get_video_id() == "dQw4w9WgXcQ"
+        assert len(registry.ids) == 1
+        assert registry.ids.hits == len(urls) - 1
+
+    def test_strips_tracking_params(self):
+        registry = self._registry()
+        f = registry.get_meta_fetcher(
+            "https://soundcloud.com/artist/track-name/?utm_source=clipboard#t=1"
+        )
+        assert f.url == "https://soundcloud.com/artist/track-name"
+        assert f.get_video_id() == "artist/track-name"
+        # the hash is needed to play an unlisted video, so is kept
+        f = registry.get_meta_fetcher(
+            "https://player.vimeo.com/video/123456789?h=abc&autoplay=1"
+        )
+        assert f.url == "https://player.vimeo.com/video/123456789?h=abc"
+        assert f.get_video_id() == "123456789"
+
+    def test_soundcloud_share_url(self):
+        f = self._registry().get_meta_fetcher("https://on.soundcloud.com/AbCdE12")
+        assert f.provider == "soundcloud"
+        assert f.get_video_id() == "on.soundcloud.com/AbCdE12"
+
+    def test_unsupported_url(self):
+        registry = self._registry()
+        assert registry.get_meta_fetcher("https://notyoutube.com/watch?v=nope") is None
+        assert (
+            registry.get_meta_fetcher("https://vimeo.com/channels/staffpicks") is None
+        )
+        assert registry.get_meta_fetcher("https://www.youtube.com/watch?v=nope") is None
+        assert len(registry.ids) == 0
+
+
 # --- playlist strip ---
 
 
@@ -54,17 +129,23 @@ class TestSoundcloudMetaFetcher:
     "url,expected",
     [
         (
-            "https://www.youtube.com/watch?v=abc123&list=PLxyz",
-            "https://www.youtube.com/watch?v=abc123",
+            "https://www.youtube.com/watch?v=abc123abc12&list=PLxyz&index=2",
+            "https://www.youtube.com/watch?v=abc123abc12",
+        ),
+        (
+            "https://www.youtube.com/watch?list=PLxyz&v=abc123abc12",
+            "https://www.youtube.com/watch?v=abc123abc12",
         ),
         (
-            "https://www.youtube.com/watch?v=abc123",
-            "https://www.youtube.com/watch?v=abc123",
+            "https://www.youtube.com/watch?v=abc123abc12",
+            "https://www.youtube.com/watch?v=abc123abc12",
         ),
     ],
 )
 def test_playlist_strip(url, expected):
-    assert url.split("&list")[0] == expected
+    canonical_url, fetcher = ProviderRegistry([YoutubeMetaFetcher]).canonicalize(url)
+    assert canonical_url == expected
+    assert fetcher is YoutubeMetaFetcher
 
 
 # --- MetaDbManager ---
@@ -91,6 +172,15 @@ def test_metadb_get_missing(tmp_path):
     assert db.get_song_meta("nonexistent") is None
 
 
+def test_metadb_find_missing_is_quiet(tmp_path, caplog):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    db.add_song_meta("a", SongMeta(url="https://u/a", file_path="/tmp/a", title="A"))
+    with caplog.at_level("ERROR"):
+        assert db.find_song_meta("nonexistent") is None
+        assert db.find_song_meta("a").title == "A"
+    assert not caplog.records
+
+
 def test_metadb_trie_populated(tmp_path):
     path = tmp_path / "metadb.json"
     db = MetaDbManager(str(path))
@@ -102,7 +192,7 @@ def test_metadb_trie_populated(tmp_path):
     db.add_song_meta("abc", meta)
     matches = db.trie.starts_with("Bohem")
     assert matches is not None
-    assert "Bohemian Rhapsody" in matches
+    assert ("Bohemian Rhapsody", ["abc"]) in matches
 
 
 def test_metadb_persists(tmp_path):
@@ -115,3 +205,1211 @@ def test_metadb_persists(tmp_path):
 
     db2 = MetaDbManager(str(path))
     assert db2.get_song_meta("xyz") is not None
+
+
+def test_metadb_fast_load_validates_on_first_access(tmp_path):
+    path = tmp_path / "metadb.json"
+    db = MetaDbManager(str(path))
+    db.add_song_meta(
+        "xyz",
+        SongMeta(
+            url="https://youtube.com/watch?v=xyz",
+            file_path="/tmp/xyz.mp3",
+            title="Song",
+        ),
+    )
+    db.storage.put(
+        "bad", {"url": "https://youtube.com/watch?v=bad", "title": "Bad Song"}
+    )
+    db.write()
+
+    db2 = MetaDbManager(str(path), fast_load=True)
+    assert db2.validated == set()
+    assert [match[1] for match in db2.find_songs_by_title("So")] == ["xyz"]
+    assert db2.get_song_meta("xyz").file_path == "/tmp/xyz.mp3"
+    assert "xyz" in db2.validated
+    # titled but missing required fields, so it only fails once read
+    assert db2.get_song_meta("bad") is None
+
+
+def _snapshot_db(tmp_path, titles):
+    db = MetaDbManager(
+        str(tmp_path / "metadb.json"), snapshot_path=str(tmp_path / "metadb.titles")
+    )
+    for id, title in titles.items():
+        db.add_song_meta(
+            id, SongMeta(url=f"https://u/{id}", file_path=f"/tmp/{id}", title=title)
+        )
+    return db
+
+
+def _write_snapshot(db):
+    generation, write = db.prepare_snapshot()
+    assert write()
+    return db.install_snapshot(generation)
+
+
+def test_metadb_serves_titles_from_snapshot(tmp_path):
+    db = _snapshot_db(tmp_path, {"1": "Song a", "2": "Song b", "3": "Other"})
+    assert db.snapshot_stale()
+    assert _write_snapshot(db)
+    assert not db.snapshot_stale()
+    assert db.indexed_titles == {}
+    assert [m[1] for m in db.find_songs_by_title("Song")] == ["1", "2"]
+
+    db2 = _snapshot_db(tmp_path, {})
+    assert db2.snapshot is not None and not db2.snapshot_stale()
+    assert db2.find_songs_by_title("Oth") == [("Other", "3", "https://u/3")]
+
+
+def test_metadb_snapshot_delta(tmp_path):
+    db = _snapshot_db(tmp_path, {"1": "Song a", "2": "Song b"})
+    _write_snapshot(db)
+    db.add_song_meta(
+        "3", SongMeta(url="https://u/3", file_path="/tmp/3", title="Song c")
+    )
+    db.add_song_meta("1", SongMeta(url="https://u/1", file_path="/tmp/1", title="Tune"))
+    db.remove_song_meta("2")
+    assert db.find_songs_by_title("Song") == [("Song c", "3", "https://u/3")]
+    assert [m[1] for m in db.find_songs_by_title("")] == ["3", "1"]
+    assert db.stats()["title_delta_songs"] == 2
+    assert db.stats()["title_snapshot_songs"] == 0
+    # plays leave the title index alone
+    generation = db.generation
+    db.record_play("3")
+    assert db.generation == generation
+
+    # not yet snapshotted changes make the snapshot on disk stale
+    db2 = _snapshot_db(tmp_path, {})
+    assert db2.snapshot is None
+    assert [m[1] for m in db2.find_songs_by_title("")] == ["3", "1"]
+    assert _write_snapshot(db2)
+    assert [m[1] for m in db2.find_songs_by_title("")] == ["3", "1"]
+
+
+def test_metadb_snapshot_not_installed_after_change(tmp_path):
+    db = _snapshot_db(tmp_path, {"1": "Song a"})
+    generation, write = db.prepare_snapshot()
+    db.add_song_meta(
+        "2", SongMeta(url="https://u/2", file_path="/tmp/2", title="Song b")
+    )
+    assert write()
+    assert not db.install_snapshot(generation)
+    assert db.snapshot is None and db.snapshot_stale()
+    assert [m[1] for m in db.find_songs_by_title("Song")] == ["1", "2"]
+
+
+class _FakeTitleFetcher:
+    def __init__(self, titles):
+        self.titles = titles
+        self.fetched = []
+
+    async def fetch(self, meta_fetcher):
+        self.fetched.append(meta_fetcher.url)
+        return self.titles.get(meta_fetcher.url, None)
+
+
+def _untitled_db(tmp_path, count):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    for i in range(count):
+        db.add_song_meta(
+            str(i),
+            SongMeta(url=f"https://vimeo.com/{i}", file_path=f"/tmp/{i}", title=None),
+        )
+    return db
+
+
+def test_title_backfill_commits_in_batches(tmp_path):
+    db = _untitled_db(tmp_path, 5)
+    fetcher = _FakeTitleFetcher(
+        {f"https://vimeo.com/{i}": f"Song {i}" for i in range(4)}
+    )
+    checkpoint = tmp_path / "backfill.json"
+    backfill = TitleBackfill(db, asyncio.Lock(), fetcher, str(checkpoint), batch_size=2)
+    commits = []
+    add_song_metas = db.add_song_metas
+    db.add_song_metas = lambda songs: commits.append(len(songs)) or add_song_metas(
+        songs
+    )
+
+    async def run():
+        pending = await backfill.pending()
+        return await backfill.run(pending, 1, lambda *_: asyncio.sleep(0))
+
+    assert asyncio.run(run()) == (5, 1)
+    assert commits == [2, 2]
+    assert [m[1] for m in db.find_songs_by_title("Song")] == ["0", "1", "2", "3"]
+    assert not checkpoint.exists()
+
+
+def test_title_backfill_resumes_after_interrupt(tmp_path):
+    db = _untitled_db(tmp_path, 4)
+    checkpoint = tmp_path / "backfill.json"
+
+    class _StallingFetcher(_FakeTitleFetcher):
+        async def fetch(self, meta_fetcher):
+            if meta_fetcher.url == "https://vimeo.com/2":
+                await asyncio.Event().wait()
+            return await super().fetch(meta_fetcher)
+
+    fetcher = _StallingFetcher({"https://vimeo.com/1": "Song 1"})
+
+    async def interrupted():
+        backfill = TitleBackfill(db, asyncio.Lock(), fetcher, str(checkpoint))
+        pending = await backfill.pending()
+        task = asyncio.create_task(
+            backfill.run(pending, 1, lambda *_: asyncio.sleep(0))
+        )
+        while len(fetcher.fetched) < 2:
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(interrupted())
+    # the title fetched before the interruption was kept
+    assert db.get_song_meta("1").title == "Song 1"
+    assert checkpoint.exists()
+
+    resumed = TitleBackfill(db, asyncio.Lock(), fetcher, str(checkpoint))
+    pending = asyncio.run(resumed.pending())
+    assert [id for id, _ in pending] == ["2", "3"]
+    pending = asyncio.run(resumed.pending(retry_failed=True))
+    assert [id for id, _ in pending] == ["0", "2", "3"]
+
+
+def test_title_backfill_command_is_admin_only():
+    permissions = songbird_api.Songbird.backfill_titles.default_member_permissions
+    assert permissions.administrator
+
+
+def test_normalize_songs_command_is_admin_only():
+    permissions = songbird_api.Songbird.normalize_songs.default_member_permissions
+    assert permissions.administrator
+
+
+def test_metadb_add_appends_to_journal(tmp_path):
+    path = tmp_path / "metadb.json"
+    db = MetaDbManager(str(path))
+    meta = SongMeta(
+        url="https://youtube.com/watch?v=abc", file_path="/tmp/abc.mp3", title="Song"
+    )
+    db.add_song_meta("abc", meta)
+    # snapshot is untouched, the add is a single journal record
+    assert json.loads(path.read_text()) == {}
+    lines = (tmp_path / "metadb.json.journal").read_text().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0]) == {"id": "abc", "meta": meta.model_dump()}
+
+
+def test_metadb_replays_journal_with_torn_write(tmp_path):
+    path = tmp_path / "metadb.json"
+    db = MetaDbManager(str(path))
+    meta = SongMeta(
+        url="https://youtube.com/watch?v=abc", file_path="/tmp/abc.mp3", title="Song"
+    )
+    db.add_song_meta("abc", meta)
+    db.close()
+    # simulate a crash partway through appending a second record
+    with open(tmp_path / "metadb.json.journal", "a") as f:
+        f.write('{"id": "def", "meta": {"url"')
+
+    db2 = MetaDbManager(str(path))
+    assert db2.get_song_meta("abc") is not None
+    assert db2.get_song_meta("def") is None
+    db2.add_song_meta("ghi", meta)
+    db2.close()
+
+    db3 = MetaDbManager(str(path))
+    assert db3.get_song_meta("ghi") is not None
+
+
+def test_metadb_compacts_journal_into_snapshot(tmp_path):
+    path = tmp_path / "metadb.json"
+    db = MetaDbManager(str(path), journal_max_bytes=1)
+    for i in range(3):
+        db.add_song_meta(
+            f"id{i}",
+            SongMeta(url=f"https://vimeo.com/{i}", file_path=f"/tmp/{i}", title=None),
+        )
+        db.wait_for_compaction()
+    db.close()
+
+    assert set(json.loads(path.read_text())) == {"id0", "id1", "id2"}
+    assert not (tmp_path / "metadb.json.journal.compacting").exists()
+    db2 = MetaDbManager(str(path))
+    assert db2.get_song_meta("id2") is not None
+
+
+def test_metadb_recovers_interrupted_compaction(tmp_path):
+    path = tmp_path / "metadb.json"
+    meta = SongMeta(url="https://vimeo.com/1", file_path="/tmp/1", title="One")
+    record = json.dumps({"id": "one", "meta": meta.model_dump()}) + "\n"
+    path.write_text("{}")
+    (tmp_path / "metadb.json.journal.compacting").write_text(record)
+
+    db = MetaDbManager(str(path))
+    assert db.get_song_meta("one") is not None
+    assert "one" in json.loads(path.read_text())
+    assert not (tmp_path / "metadb.json.journal.compacting").exists()
+
+
+def test_metadb_sqlite_backend(tmp_path):
+    path = tmp_path / "metadb.json"
+    db = MetaDbManager(str(path), backend="sqlite")
+    meta = SongMeta(
+        url="https://youtube.com/watch?v=abc", file_path="/tmp/abc.mp3", title="Song"
+    )
+    db.add_song_meta("abc", meta)
+    db.close()
+
+    db2 = MetaDbManager(str(path), backend="sqlite")
+    assert db2.get_song_meta("abc") == meta
+    assert db2.find_songs_by_title("So") == [("Song", "abc", meta.url)]
+
+
+@pytest.mark.parametrize("snapshot", [False, True])
+def test_metadb_untitling_a_song_unindexes_it(tmp_path, snapshot):
+    db = MetaDbManager(str(tmp_path / "metadb.json"), substring_index=True)
+    meta = SongMeta(url="https://u/a", file_path="/tmp/a", title="Song a")
+    db.add_song_meta("a", meta)
+    if snapshot:
+        db.snapshot_path = str(tmp_path / "metadb.titles")
+        generation, write = db.prepare_snapshot()
+        assert write() and db.install_snapshot(generation)
+    assert db.find_songs_by_title("Song") == [("Song a", "a", "https://u/a")]
+
+    db.add_song_meta("a", meta.model_copy(update={"title": None}))
+    assert db.find_songs_by_title("Song") == []
+    assert db.find_songs_by_substring("ong") == []
+
+
+def test_metadb_new_url_invalidates_cached_matches(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    meta = SongMeta(url="https://u/a", file_path="/tmp/a", title="Song a")
+    db.add_song_meta("a", meta)
+    assert db.find_songs_by_title("Song") == [("Song a", "a", "https://u/a")]
+
+    db.add_song_meta("a", meta.model_copy(update={"url": "https://u/b"}))
+    assert db.find_songs_by_title("Song") == [("Song a", "a", "https://u/b")]
+
+
+def test_metadb_sqlite_searches_titles_in_storage(tmp_path):
+    path = tmp_path / "metadb.json"
+    db = MetaDbManager(
+        str(path), backend="sqlite", fast_load=True, substring_index=True
+    )
+    for id in ("a", "b", "c"):
+        db.add_song_meta(
+            id,
+            SongMeta(url=f"https://u/{id}", file_path=f"/tmp/{id}", title=f"Song {id}"),
+        )
+    db.record_play("c")
+    db.close()
+
+    db2 = MetaDbManager(
+        str(path), backend="sqlite", fast_load=True, substring_index=True
+    )
+    assert db2.titles_live
+    assert db2.popularity.keys() == {"c"}
+    assert db2.indexed_titles == {}
+    assert [id for _, id, _ in db2.find_songs_by_title("Song")] == ["c", "a", "b"]
+
+    # changes reach searches, cached or not, without a title delta
+    db2.add_song_meta(
+        "a", SongMeta(url="https://u/a", file_path="/tmp/a", title="Other a")
+    )
+    db2.remove_song_meta("b")
+    assert [id for _, id, _ in db2.find_songs_by_title("Song")] == ["c"]
+    assert db2.find_songs_by_title("Oth") == [("Other a", "a", "https://u/a")]
+    assert [id for _, id, _ in db2.find_songs_by_substring("ther")] == ["a"]
+    assert db2.indexed_titles == {}
+    assert not db2.snapshot_stale()
+
+
+def _fake_autocomplete_ctx(db, value: str):
+    cog = types.SimpleNamespace(meta_db=db, meta_db_lock=asyncio.Lock())
+    return types.SimpleNamespace(cog=cog, value=value)
+
+
+def test_metadb_find_songs_by_title_limit(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    for i in range(30):
+        db.add_song_meta(
+            f"id{i}",
+            SongMeta(url=f"https://vimeo.com/{i}", file_path=f"/tmp/{i}", title="Song"),
+        )
+    matches = db.find_songs_by_title("So")
+    assert len(matches) == 25
+    assert matches[0] == ("Song", "id0", "https://vimeo.com/0")
+
+
+def test_autocomplete_labels(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    db.add_song_meta(
+        "abc",
+        SongMeta(url="https://vimeo.com/1", file_path="/tmp/1", title="A" * 120),
+    )
+    db.add_song_meta(
+        "def",
+        SongMeta(url="https://vimeo.com/2", file_path="/tmp/2", title="Bee"),
+    )
+    choices = asyncio.run(_get_url_from_title(_fake_autocomplete_ctx(db, "")))
+    assert [(c.name, c.value) for c in choices] == [
+        ("A" * 100, "https://vimeo.com/1"),
+        ("Bee | https://vimeo.com/2", "https://vimeo.com/2"),
+    ]
+    assert asyncio.run(_get_url_from_title(_fake_autocomplete_ctx(db, "x"))) == []
+
+
+def _add_titled(db, id: str, title: str):
+    db.add_song_meta(
+        id, SongMeta(url=f"https://vimeo.com/{id}", file_path=f"/tmp/{id}", title=title)
+    )
+
+
+def test_title_cache_hit_and_derived_from_parent(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    _add_titled(db, "1", "abba")
+    _add_titled(db, "2", "abc")
+    _add_titled(db, "3", "xyz")
+
+    assert len(db.find_songs_by_title("a")) == 2
+    assert db.find_songs_by_title("a") == db.find_songs_by_title("a")
+    assert db.title_cache.hits == 2
+    # "ab" then "abc" are answered from the complete result for "a"
+    assert [m[1] for m in db.find_songs_by_title("abc")] == ["2"]
+    assert db.title_cache_derived_hits == 1
+
+
+def test_title_cache_invalidated_on_add(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    _add_titled(db, "1", "abba")
+    assert len(db.find_songs_by_title("ab")) == 1
+    _add_titled(db, "2", "abc")
+    assert len(db.find_songs_by_title("ab")) == 2
+    assert len(db.find_songs_by_title("abc")) == 1
+
+
+def test_title_cache_truncated_parent_is_not_filtered(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    for i in range(30):
+        _add_titled(db, f"a{i}", f"a{i}")
+    _add_titled(db, "b", "a_late")
+    assert len(db.find_songs_by_title("a")) == 25
+    assert [m[1] for m in db.find_songs_by_title("a_")] == ["b"]
+    assert db.title_cache_derived_hits == 0
+
+
+def test_autocomplete_substring_mode(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"), substring_index=True)
+    _add_titled(db, "1", "Song (Official Video) - Artist")
+    _add_titled(db, "2", "Artist Interview")
+    choices = asyncio.run(_get_url_from_title(_fake_autocomplete_ctx(db, "artist")))
+    assert [c.value for c in choices] == ["https://vimeo.com/2", "https://vimeo.com/1"]
+    # an empty query still lists songs through the trie
+    choices = asyncio.run(_get_url_from_title(_fake_autocomplete_ctx(db, "")))
+    assert len(choices) == 2
+
+
+# --- DownloadsIndex ---
+
+
+def test_downloads_index_scan(tmp_path):
+    (tmp_path / "dQw4w9WgXcQ.mp3").write_bytes(b"")
+    (tmp_path / "metadb.json").write_text("{}")
+    (tmp_path / "artist").mkdir()
+    (tmp_path / "artist" / "track-name.mp3").write_bytes(b"")
+    index = DownloadsIndex(str(tmp_path), "mp3")
+    assert index.scan() == 2
+    assert index.get("dQw4w9WgXcQ") == str(tmp_path / "dQw4w9WgXcQ")
+    assert index.get("artist/track-name") == str(tmp_path / "artist" / "track-name")
+    # ids are matched exactly, never by substring
+    assert index.get("dQw4w9") is None
+
+
+def test_downloads_index_rescan_picks_up_changes(tmp_path):
+    (tmp_path / "a.mp3").write_bytes(b"")
+    index = DownloadsIndex(str(tmp_path), "mp3")
+    index.scan()
+    assert index.rescan() == 0
+
+    os.remove(tmp_path / "a.mp3")
+    (tmp_path / "b.mp3").write_bytes(b"")
+    (tmp_path / "artist").mkdir()
+    (tmp_path / "artist" / "c.mp3").write_bytes(b"")
+    # filesystems with coarse timestamps may not have ticked since the scan
+    index.dir_mtimes[str(tmp_path)] = 0
+    assert index.rescan() == 1
+    assert index.get("a") is None
+    assert index.get("b") == str(tmp_path / "b")
+    assert index.get("artist/c") == str(tmp_path / "artist" / "c")
+
+
+def test_downloads_index_add(tmp_path):
+    index = DownloadsIndex(str(tmp_path), "mp3")
+    index.scan()
+    index.add("xyz", str(tmp_path / "xyz"))
+    assert index.get("xyz") == str(tmp_path / "xyz")
+    index.remove("xyz")
+    assert index.get("xyz") is None
+
+
+# --- eviction ---
+
+
+def test_metadb_remove_song_meta_unindexes_title(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    _add_titled(db, "1", "Song One")
+    _add_titled(db, "2", "Song Two")
+    assert len(db.find_songs_by_title("Song")) == 2
+    assert db.remove_song_meta("1").title == "Song One"
+    assert db.remove_song_meta("1") is None
+    assert db.find_songs_by_title("Song") == [("Song Two", "2", "https://vimeo.com/2")]
+    assert "1" not in db.urls
+    db.close()
+
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    assert db.get_song_meta("1") is None
+    assert [id for _, id, _ in db.find_songs_by_title("Song")] == ["2"]
+
+
+def test_metadb_record_play_keeps_single_index_entry(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    _add_titled(db, "1", "Song")
+    generation = db.generation
+    assert db.record_play("1")
+    assert db.record_play("1")
+    assert db.get_song_meta("1").play_count == 2
+    assert db.get_song_meta("1").last_played is not None
+    assert db.trie.search("Song") == ["1"]
+    # play counts don't touch titles, so cached title queries stay valid
+    assert db.generation == generation
+    assert not db.record_play("missing")
+
+
+def test_metadb_plays_are_flushed_in_batches(tmp_path):
+    path = str(tmp_path / "metadb.json")
+    db = MetaDbManager(path)
+    _add_titled(db, "1", "Song")
+    _add_titled(db, "2", "Other")
+    puts = []
+    put_many = db.storage.put_many
+    db.storage.put_many = lambda items: puts.append(len(items)) or put_many(items)
+    for id in ["1", "2", "1"]:
+        assert db.record_play(id)
+    assert puts == []
+    assert db.storage.get("1")["play_count"] == 0
+    # reads include plays not yet flushed
+    assert db.get_song_meta("1").play_count == 2
+
+    assert db.flush_plays() == 2
+    assert puts == [2]
+    assert db.flush_plays() == 0
+    db.close()
+    assert MetaDbManager(path).get_song_meta("1").play_count == 2
+
+
+def test_metadb_ranks_title_matches_by_popularity(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    for id, title in [
+        ("1", "Song a"),
+        ("2", "Song b"),
+        ("3", "Song c"),
+        ("4", "Song d"),
+    ]:
+        _add_titled(db, id, title)
+    assert [m[1] for m in db.find_songs_by_title("Song", limit=2)] == ["1", "2"]
+    db.record_play("3")
+    db.record_play("3")
+    db.record_play("2")
+    # cached rankings are dropped once a song plays
+    assert [m[1] for m in db.find_songs_by_title("Song", limit=2)] == ["3", "2"]
+    assert [m[1] for m in db.find_songs_by_title("Song")] == ["3", "2", "1", "4"]
+
+    # plays long ago count for less than a recent one
+    year = 365 * 24 * 60 * 60
+    db.popularity["1"] = (10, time.time() - year)
+    db.record_play("4")
+    # of the songs played once, the most recent ranks first
+    assert [m[1] for m in db.find_songs_by_title("Song")] == ["3", "4", "2", "1"]
+
+
+def test_metadb_ranks_played_songs_found_past_the_limit(tmp_path):
+    db = MetaDbManager(str(tmp_path / "metadb.json"))
+    for id in "12345":
+        _add_titled(db, id, f"Song {id}")
+    db.record_play("5")
+    assert [m[1] for m in db.find_songs_by_title("Song", limit=2)] == ["5", "1"]
+    assert not db.title_cache.peek("Song").complete
+    assert [m[1] for m in db.find_songs_by_title("Song 5", limit=2)] == ["5"]
+    assert db.title_cache.peek("Song 5").complete
+
+
+def test_metadb_ranks_snapshot_and_delta_together(tmp_path):
+    db = _snapshot_db(tmp_path, {"1": "Song a", "2": "Song b"})
+    _write_snapshot(db)
+    db.add_song_meta(
+        "3", SongMeta(url="https://u/3", file_path="/tmp/3", title="Song c")
+    )
+    assert [m[1] for m in db.find_songs_by_title("Song")] == ["1", "2", "3"]
+    db.record_play("3")
+    db.record_play("2")
+    db.record_play("2")
+    assert db.find_songs_by_title("Song", limit=2) == [
+        ("Song b", "2", "https://u/2"),
+        ("Song c", "3", "https://u/3"),
+    ]
+
+
+def _cached(id, size=10, last_played=0.0, play_count=0):
+    return CachedSong(id, size, last_played, play_count)
+
+
+def test_plan_evictions_lru_respects_budget_and_protection():
+    songs = [
+        _cached("old", last_played=1.0),
+        _cached("queued", last_played=2.0),
+        _cached("mid", last_played=3.0),
+        _cached("new", last_played=4.0),
+    ]
+    assert plan_evictions(songs, set(), max_bytes=40, max_songs=0) == []
+    assert plan_evictions(songs, {"queued"}, max_bytes=25, max_songs=0) == [
+        "old",
+        "mid",
+    ]
+    assert plan_evictions(songs, set(), max_bytes=0, max_songs=3) == ["old"]
+    # protected songs are kept even if the budget can't be met
+    assert plan_evictions(songs, {"old", "queued", "mid", "new"}, 1, 1) == []
+
+
+def test_plan_evictions_lfu_prefers_rarely_played():
+    songs = [
+        _cached("favourite", last_played=1.0, play_count=9),
+        _cached("once", last_played=5.0, play_count=1),
+        _cached("never"),
+    ]
+    assert plan_evictions(
+        songs, set(), max_bytes=0, max_songs=1, policy=EvictionPolicies.LFU
+    ) == ["never", "once"]
+
+
+def test_measure_songs_stats_files(tmp_path):
+    song = tmp_path / "a.mp3"
+    song.write_bytes(b"x" * 7)
+    songs = measure_songs(
+        [
+            ("a", {"file_path": str(song), "last_played": 5.0, "play_count": 2}),
+            ("gone", {"file_path": str(tmp_path / "gone.mp3")}),
+        ]
+    )
+    assert songs == [_cached("a", 7, 5.0, 2), _cached("gone", 0, 0.0, 0)]
+
+
+# --- title fetching ---
+
+
+class _FakeContent:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.consumed = 0
+
+    async def iter_chunked(self, n):
+        for chunk in self.chunks:
+            self.consumed += 1
+            yield chunk
+
+
+def test_read_until_title_stops_after_closing_tag():
+    content = _FakeContent(
+        [b"<html><head><title>Song - You", b"Tube</TI", b"TLE></head>", b"x" * 100]
+    )
+    head = asyncio.run(read_until_title(content))
+    assert head == b"<html><head><title>Song - YouTube</TITLE>"
+    assert content.consumed == 3
+
+
+def test_read_until_title_gives_up_at_max_bytes():
+    content = _FakeContent([b"x" * 10] * 10)
+    head = asyncio.run(read_until_title(content, max_bytes=25))
+    assert head == b"x" * 30
+    assert content.consumed == 3
+
+
+@pytest.mark.parametrize(
+    "content_type,body",
+    [
+        ("text/html", "<html><head><title>My Söng</title></head>"),
+        ("text/html; charset=utf-8", "<html><head><title>My Söng</title></head>"),
+        (
+            "text/html",
+            '<html><head><meta charset="latin-1"><title>My Söng</title></head>',
+        ),
+    ],
+)
+def test_title_fetcher_decodes_with_or_without_charset(content_type, body):
+    async def page(request):
+        encoding = "latin-1" if "latin-1" in body else "utf-8"
+        return web.Response(
+            body=body.encode(encoding), headers={"Content-Type": content_type}
+        )
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/", page)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        titles = TitleFetcher(rates={})
+        try:
+            return await titles.fetch(YoutubeMetaFetcher(f"http://127.0.0.1:{port}/"))
+        finally:
+            await titles.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == "My Söng"
+
+
+# --- SongQueue ---
+
+
+def test_song_queue_order_and_membership():
+    queue = SongQueue(lambda url: None)
+    queue.append("b")
+    queue.append("c")
+    queue.appendleft("a")
+    queue.append("a")
+    assert list(queue) == ["a", "b", "c", "a"]
+    assert queue.head(2) == ["a", "b"]
+    assert queue.popleft() == "a"
+    assert "a" in queue
+    assert queue.popleft() == "b"
+    assert "b" not in queue
+    queue.clear()
+    assert queue.popleft() is None and "a" not in queue
+
+
+def test_song_queue_render_pages_with_titles():
+    titles = {"u3": "third song"}
+    lookups = []
+
+    def describe(url):
+        lookups.append(url)
+        return titles.get(url, None)
+
+    queue = SongQueue(describe)
+    for i in range(25):
+        queue.append(f"u{i}")
+    text, page, pages = queue.render_page(1, page_size=10)
+    assert (page, pages) == (1, 3)
+    assert text.splitlines()[3] == "3. third song"
+    assert text.splitlines()[0] == "0. u0"
+
+    text, page, pages = queue.render_page(99, page_size=10)
+    assert page == 3 and text.splitlines() == [f"{i}. u{i}" for i in range(20, 25)]
+
+    # resolved titles are cached, unknown ones are looked up again
+    lookups.clear()
+    queue.render_page(1, page_size=10)
+    assert "u3" not in lookups and "u0" in lookups
+    titles["u0"] = "first song"
+    assert queue.render_page(1, page_size=10)[0].startswith("0. first song")
+
+
+def test_song_queue_render_tail():
+    queue = SongQueue(lambda url: None)
+    for i in range(8):
+        queue.append(f"u{i}")
+    assert queue.render_tail(3) == "5. u5\n6. u6\n7. u7\n"
+
+
+# --- GuildPlayer ---
+
+
+def _fake_songbird(prefetch_count=2):
+    fake = types.SimpleNamespace(
+        prefetch_count=prefetch_count,
+        stream_uncached=False,
+        started=[],
+        priorities={},
+        bumps=[],
+        played=[],
+    )
+
+    async def get_song(url, priority=DownloadPriority.NOW_PLAYING):
+        fake.started.append(url)
+        fake.priorities[url] = priority
+        await asyncio.sleep(0)
+        return f"/downloads/{url}.mp3"
+
+    fake.get_song = get_song
+    fake.describe_song = lambda url: None
+
+    async def record_play(url):
+        fake.played.append(url)
+
+    fake.record_play = record_play
+    fake.song_gain = lambda url: 1.0
+    fake.bump_download = lambda url, priority: fake.bumps.append((url, priority))
+    return fake
+
+
+class _FakeVoiceClient:
+    """plays instantly; ``finish`` ends the current track from another thread
+    the way discord's audio player does."""
+
+    def __init__(self):
+        self.after = None
+        self.sources = []
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self.after is not None
+
+    def is_paused(self):
+        return False
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def play(self, source, after):
+        self.sources.append(source)
+        self.after = after
+
+    def stop(self):
+        self.finish()
+
+    def finish(self):
+        after, self.after = self.after, None
+        threading.Thread(target=after, args=(None,)).start()
+
+
+class _Track(str):
+    """stands in for a playing file's source"""
+
+    streaming = False
+
+
+def _scheduled_player():
+    songbird = _fake_songbird()
+    songbird.bot = types.SimpleNamespace(loop=asyncio.get_running_loop())
+    songbird.gap_stats = {
+        "prefetched": metrics.LatencyStats(),
+        "not_prefetched": metrics.LatencyStats(),
+    }
+    songbird.skip_stats = metrics.LatencyStats()
+    player = GuildPlayer(songbird, guild_id=1)
+    player.create_source = lambda path, gain: _Track(path)
+    player.voice_client = _FakeVoiceClient()
+    sent = []
+
+    async def send(msg):
+        sent.append(msg)
+
+    player.ctx = types.SimpleNamespace(followup=types.SimpleNamespace(send=send))
+    return player, sent
+
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+
+
+def test_prefetch_schedules_upcoming_and_cancels_removed():
+    async def run():
+        player = GuildPlayer(_fake_songbird(), guild_id=1)
+        player.queue.extend(["a", "b", "c"])
+        player.schedule_prefetch()
+        assert set(player.prefetches) == {"a", "b"}
+        a_task = player.prefetches["a"]
+
+        player.queue.clear()
+        player.schedule_prefetch()
+        assert player.prefetches == {}
+        await asyncio.sleep(0)
+        assert a_task.cancelled()
+
+    asyncio.run(run())
+
+
+def test_prefetch_priorities_follow_queue_position():
+    async def run():
+        songbird = _fake_songbird()
+        player = GuildPlayer(songbird, guild_id=1)
+        player.queue.extend(["a", "b"])
+        player.schedule_prefetch()
+        await asyncio.sleep(0)
+        assert songbird.priorities == {
+            "a": DownloadPriority.NEXT_UP,
+            "b": DownloadPriority.PREFETCH,
+        }
+        player.queue.popleft()
+        player.schedule_prefetch()
+        assert songbird.bumps == [("b", DownloadPriority.NEXT_UP)]
+        player.close()
+
+    asyncio.run(run())
+
+
+def test_resolve_song_takes_over_prefetch():
+    async def run():
+        songbird = _fake_songbird()
+        player = GuildPlayer(songbird, guild_id=1)
+        player.queue.append("a")
+        player.schedule_prefetch()
+        path, prefetched = await player.resolve_song("a")
+        assert (path, prefetched) == ("/downloads/a.mp3", True)
+        assert songbird.bumps == [("a", DownloadPriority.NOW_PLAYING)]
+        path, prefetched = await player.resolve_song("b")
+        assert (path, prefetched) == ("/downloads/b.mp3", False)
+        assert songbird.started == ["a", "b"]
+
+    asyncio.run(run())
+
+
+def test_players_have_independent_queues():
+    songbird = _fake_songbird()
+    first, second = GuildPlayer(songbird, 1), GuildPlayer(songbird, 2)
+    first.queue.append("a")
+    assert len(second.queue) == 0
+    assert first.queue_lock is not second.queue_lock
+
+
+def test_player_idle_detection():
+    player = GuildPlayer(_fake_songbird(), guild_id=1)
+    assert not player.is_idle(idle_timeout=60)
+    assert player.is_idle(idle_timeout=0)
+    player.queue.append("a")
+    assert not player.is_idle(idle_timeout=0)
+    player.queue.clear()
+    player.voice_client = types.SimpleNamespace(is_connected=lambda: True)
+    assert not player.is_idle(idle_timeout=0)
+
+
+def test_scheduler_plays_queue_in_order_on_track_end():
+    async def run():
+        player, sent = _scheduled_player()
+        player.queue.extend(["a", "b"])
+        player.ensure_scheduler()
+        player.wakeup.set()
+        await _settle()
+        vc = player.voice_client
+        assert vc.sources == ["/downloads/a.mp3"]
+        assert list(player.queue) == ["b"]
+
+        vc.finish()
+        await _settle()
+        assert vc.sources == ["/downloads/a.mp3", "/downloads/b.mp3"]
+        assert player.songbird.gap_stats["prefetched"].count == 1
+        assert player.songbird.played == ["a", "b"]
+
+        vc.finish()
+        await _settle()
+        assert sent[-1].startswith("No songs left in queue")
+        player.close()
+
+    asyncio.run(run())
+
+
+def _play_ctx(voice_client):
+    """interaction context whose defer, like discord's, may only be sent once"""
+    ctx = types.SimpleNamespace(voice_client=voice_client, responses=[], deferred=0)
+    done = lambda: ctx.deferred > 0 or bool(ctx.responses)
+
+    async def defer():
+        assert not done(), "interaction already responded to"
+        ctx.deferred += 1
+
+    async def respond(msg=None, embed=None):
+        ctx.responses.append(msg if embed is None else embed.title)
+
+    ctx.defer = defer
+    ctx.respond = respond
+    ctx.response = types.SimpleNamespace(is_done=done)
+    ctx.followup = types.SimpleNamespace(send=respond)
+    return ctx
+
+
+def test_play_starts_urls_in_order_given():
+    async def run():
+        player, _ = _scheduled_player()
+        vc = player.voice_client
+        player.queue.extend(["queued"])
+        ctx = _play_ctx(vc)
+        await player.play(ctx, ["a", "b"])
+        assert ctx.deferred == 1
+        await _settle()
+        assert vc.sources == ["/downloads/a.mp3"]
+        assert list(player.queue) == ["b", "queued"]
+        player.close()
+
+    asyncio.run(run())
+
+
+def test_play_enqueues_while_paused():
+    async def run():
+        player, _ = _scheduled_player()
+        vc = player.voice_client
+        vc.is_paused = lambda: True
+        player.queue.extend(["queued"])
+        ctx = _play_ctx(vc)
+        await player.play(ctx, ["a", "b"])
+        await _settle()
+        assert ctx.deferred == 0
+        assert len(ctx.responses) == 2
+        assert list(player.queue) == ["queued", "a", "b"]
+        assert vc.sources == []
+        player.close()
+
+    asyncio.run(run())
+
+
+def test_scheduler_skip_records_latency_and_continues_after_failure():
+    async def run():
+        player, sent = _scheduled_player()
+        songbird = player.songbird
+        get_song = songbird.get_song
+
+        async def flaky_get_song(url, priority):
+            return None if url == "bad" else await get_song(url, priority)
+
+        songbird.get_song = flaky_get_song
+        player.queue.extend(["a", "bad", "c"])
+        player.ensure_scheduler()
+        player.wakeup.set()
+        await _settle()
+
+        player.skip()
+        await _settle()
+        assert player.voice_client.sources == ["/downloads/a.mp3", "/downloads/c.mp3"]
+        assert any("error" in msg for msg in sent)
+        assert songbird.skip_stats.count == 1
+        player.close()
+
+    asyncio.run(run())
+
+
+def test_download_playlist_bounded_and_in_order():
+    async def run():
+        songbird = _fake_songbird()
+        running, peak = 0, 0
+
+        async def get_song(url, priority):
+            nonlocal running, peak
+            songbird.started.append(url)
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return None if url == "u3" else f"/downloads/{url}.mp3"
+
+        songbird.get_song = get_song
+        player = GuildPlayer(songbird, guild_id=1)
+        urls = [f"u{i}" for i in range(6)]
+        player.queue.extend(urls[1:])
+        reports = []
+
+        async def progress(done, failed, total):
+            reports.append((done, failed, total))
+
+        done, failed = await player.download_playlist(urls, 2, progress)
+        assert (done, failed) == (6, 1)
+        assert peak == 2
+        # u0 was no longer queued, so it was left to the scheduler
+        assert songbird.started == urls[1:]
+        assert reports[-1] == (6, 1, 6)
+
+    asyncio.run(run())
+
+
+# --- playback sources ---
+
+
+class _FakeSource(AudioSource):
+    def __init__(self, opus: bool, frames: int = 100, volume=None):
+        self.opus = opus
+        self.remaining = frames
+        self.cleaned_up = False
+        if volume is not None:
+            self.volume = volume
+
+    def read(self):
+        if self.remaining == 0:
+            return b""
+        self.remaining -= 1
+        return b"o" if self.opus else b"p"
+
+    def is_opus(self):
+        return self.opus
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+class _FakeVolumeSource(_FakeSource):
+    def __init__(self, volume):
+        super().__init__(opus=False, volume=volume)
+
+
+def test_playback_source_counts_frames_and_swaps():
+    first = _FakeSource(opus=True)
+    source = PlaybackSource("/downloads/a.opus", first)
+    for _ in range(50):
+        source.read()
+    assert source.is_opus()
+    assert source.position == pytest.approx(1.0)
+
+    second = _FakeSource(opus=False)
+    source.replace(second)
+    assert first.cleaned_up
+    assert source.read() == b"p"
+    assert not source.is_opus()
+    assert source.frames == 51
+
+
+def test_set_volume_switches_between_opus_and_pcm(monkeypatch):
+    player = GuildPlayer(_fake_songbird(), guild_id=1)
+    opened = []
+
+    def open_source(song_path, position=0.0, gain=1.0):
+        opened.append((player.volume, round(position, 2)))
+        if player.volume == 1.0:
+            return _FakeSource(opus=True)
+        return _FakeVolumeSource(player.volume)
+
+    player._open_source = open_source
+    monkeypatch.setattr(songbird_api, "PCMVolumeTransformer", _FakeVolumeSource)
+    player.voice_client = types.SimpleNamespace(
+        is_playing=lambda: True, is_paused=lambda: False, encoder=object()
+    )
+    player.source = player.create_source("/downloads/a.opus")
+    for _ in range(100):
+        player.source.read()
+
+    player.set_volume(1.0)
+    assert opened == [(1.0, 0.0)]
+    player.set_volume(0.5)
+    assert opened[-1] == (0.5, 2.0)
+    assert player.source.read() == b"p"
+    # already decoding to pcm, so only the scale changes
+    player.set_volume(0.25)
+    assert len(opened) == 2
+    assert player.source.source.volume == 0.25
+    player.set_volume(1.0)
+    assert opened[-1] == (1.0, 2.02)
+
+
+def test_set_volume_scales_loudness_gain(monkeypatch):
+    player = GuildPlayer(_fake_songbird(), guild_id=1)
+    player._open_source = lambda song_path, position=0.0, gain=1.0: (
+        _FakeVolumeSource(player.volume * gain)
+    )
+    monkeypatch.setattr(songbird_api, "PCMVolumeTransformer", _FakeVolumeSource)
+    player.voice_client = types.SimpleNamespace(
+        is_playing=lambda: True, is_paused=lambda: False, encoder=object()
+    )
+    player.volume = 0.5
+    player.source = player.create_source("/downloads/a.mp3", gain=0.8)
+    assert player.source.source.volume == pytest.approx(0.4)
+    player.set_volume(0.25)
+    assert player.source.source.volume == pytest.approx(0.2)
+
+
+def test_playback_source_hands_stream_over_to_download():
+    stream = _FakeSource(opus=True)
+    source = PlaybackSource("https://stream", stream, streaming=True)
+    for _ in range(10):
+        source.read()
+    downloaded = _FakeSource(opus=False)
+    source.hand_over("/downloads/a.mp3", downloaded)
+    assert source.read() == b"p"
+    assert stream.cleaned_up
+    assert not source.streaming
+    assert source.song_path == "/downloads/a.mp3"
+    assert source.frames == 11
+
+
+def test_playback_source_waits_for_download_when_stream_runs_out():
+    source = PlaybackSource(
+        "https://stream", _FakeSource(opus=True, frames=2), streaming=True
+    )
+    source.read()
+    source.read()
+    reads = []
+    reader = threading.Thread(target=lambda: reads.append(source.read()))
+    reader.start()
+    time.sleep(0.05)
+    assert source.waiting
+    source.hand_over("/downloads/a.mp3", _FakeSource(opus=False))
+    reader.join(timeout=1)
+    assert reads == [b"p"]
+    assert source.position == pytest.approx(0.06)
+
+
+def test_playback_source_stream_plays_out_when_download_fails():
+    source = PlaybackSource(
+        "https://stream", _FakeSource(opus=True, frames=2), streaming=True
+    )
+    source.hand_over("https://stream", None)
+    assert [source.read() for _ in range(3)] == [b"o", b"o", b""]
+
+
+def test_scheduler_streams_uncached_song_until_downloaded():
+    async def run():
+        player, sent = _scheduled_player()
+        songbird = player.songbird
+        downloaded = asyncio.Event()
+
+        async def get_song(url, priority):
+            await downloaded.wait()
+            return f"/downloads/{url}.mp3"
+
+        async def needs_download(url):
+            return True
+
+        async def resolve_stream(url):
+            return SongStream(f"https://stream/{url}", {})
+
+        songbird.get_song = get_song
+        songbird.needs_download = needs_download
+        songbird.resolve_stream = resolve_stream
+        songbird.stream_uncached = True
+        opened = []
+
+        def open_source(song_path, position=0.0, gain=1.0, before_options=""):
+            opened.append((song_path, round(position, 2)))
+            return _FakeSource(opus=song_path.startswith("https"))
+
+        player._open_source = open_source
+        player.queue.extend(["a"])
+        player.ensure_scheduler()
+        player.wakeup.set()
+        await _settle()
+        source = player.voice_client.sources[0]
+        assert source.streaming
+        assert opened == [("https://stream/a", 0.0)]
+        for _ in range(5):
+            source.read()
+
+        downloaded.set()
+        await _settle()
+        assert opened[-1] == ("/downloads/a.mp3", 0.1)
+        assert source.read() == b"p"
+        assert source.song_path == "/downloads/a.mp3"
+        assert songbird.played == ["a"]
+        player.close()
+
+    asyncio.run(run())
+
+
+def test_stream_before_options_quote_headers():
+    stream = SongStream("https://stream", {"User-Agent": "pig bot"})
+    assert stream.before_options().startswith(songbird_api.STREAM_BEFORE_OPTIONS)
+    assert "-headers 'User-Agent: pig bot\r\n'" in stream.before_options()
@@ -0,0 +1,152 @@
+import json
+import pytest
+from util.storage import (
+    JsonJournalStorage,
+    SqliteStorage,
+    open_storage,
+)
+
+
+def _item(id: str, title=None):
+    return {"url": f"https://vimeo.com/{id}", "file_path": f"/tmp/{id}", "title": title}
+
+
+def test_sqlite_put_and_get(tmp_path):
+    s = SqliteStorage(str(tmp_path / "metadb.sqlite3"))
+    s.load()
+    s.put("1", _item("1", "One"))
+    assert s.get("1") == _item("1", "One")
+    assert s.get("2") is None
+    assert len(s) == 1
+
+
+def test_sqlite_put_replaces(tmp_path):
+    s = SqliteStorage(str(tmp_path / "metadb.sqlite3"))
+    s.load()
+    s.put("1", _item("1"))
+    s.put("1", _item("1", "One"))
+    assert dict(s.items()) == {"1": _item("1", "One")}
+
+
+def test_sqlite_title_index_and_plays(tmp_path):
+    s = SqliteStorage(str(tmp_path / "metadb.sqlite3"))
+    s.load()
+    s.put("1", _item("1", "Two"))
+    s.put("2", _item("2", "To"))
+    s.put("3", _item("3", "Cafe\u0301"))
+    s.put("4", dict(_item("4"), play_count=2, last_played=5.0))
+    titles = s.title_index()
+    assert list(titles.iter_prefix("T")) == [
+        ("To", "2", "https://vimeo.com/2"),
+        ("Two", "1", "https://vimeo.com/1"),
+    ]
+    # titles are indexed normalized, the way they are searched
+    assert titles.get("3") == ("Caf\u00e9", "https://vimeo.com/3")
+    assert titles.get("4") is None
+    assert len(titles) == 3
+    assert list(s.played()) == [("4", 2, 5.0)]
+
+
+def test_json_storage_has_no_title_index(tmp_path):
+    s = JsonJournalStorage(str(tmp_path / "metadb.json"))
+    s.load()
+    s.put("1", dict(_item("1", "One"), play_count=1))
+    assert s.title_index() is None
+    assert list(s.played()) == [("1", 1, None)]
+
+
+def test_sqlite_uses_wal(tmp_path):
+    s = SqliteStorage(str(tmp_path / "metadb.sqlite3"))
+    s.load()
+    assert s.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_sqlite_migrates_json_once(tmp_path):
+    json_path = tmp_path / "metadb.json"
+    source = JsonJournalStorage(str(json_path))
+    source.load()
+    source.put("1", _item("1", "One"))
+    source.close()
+
+    s = open_storage("sqlite", str(json_path))
+    s.load()
+    assert s.get("1") == _item("1", "One")
+    assert not json_path.exists()
+    assert (tmp_path / "metadb.json.migrated").exists()
+    s.close()
+
+    # a second open must not re-import or clobber newer records
+    json_path.write_text(json.dumps({"1": _item("1", "Stale")}))
+    s = open_storage("sqlite", str(json_path))
+    s.load()
+    assert s.get("1")["title"] == "One"
+
+
+def test_open_storage_rejects_unknown_backend(tmp_path):
+    with pytest.raises(ValueError):
+        open_storage("redis", str(tmp_path / "metadb.json"))
+
+
+def test_sqlite_delete(tmp_path):
+    s = SqliteStorage(str(tmp_path / "metadb.sqlite3"))
+    s.load()
+    s.put("1", _item("1", "One"))
+    s.delete("1")
+    s.delete("missing")
+    assert s.get("1") is None
+    assert len(s) == 0
+
+
+def test_json_delete_survives_replay_and_compaction(tmp_path):
+    path = str(tmp_path / "metadb.json")
+    s = JsonJournalStorage(path)
+    s.load()
+    s.put("1", _item("1", "One"))
+    s.put("2", _item("2", "Two"))
+    s.delete("1")
+    s.close()
+
+    s = JsonJournalStorage(path)
+    s.load()
+    assert dict(s.items()) == {"2": _item("2", "Two")}
+    s.flush()
+    s.close()
+    assert json.loads((tmp_path / "metadb.json").read_text()) == {
+        "2": _item("2", "Two")
+    }
+
+
+def test_json_compaction_keeps_journal_of_a_failed_one(tmp_path, monkeypatch):
+    path = str(tmp_path / "metadb.json")
+    s = JsonJournalStorage(path, journal_max_bytes=1)
+
+    def fail(db):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(s, "_write_snapshot", fail)
+    s.load()
+    # each put starts a compaction that fails, as if the bot then crashed
+    s.put("1", _item("1", "One"))
+    s.wait_for_compaction()
+    s.put("2", _item("2", "Two"))
+    s.wait_for_compaction()
+    s.close()
+
+    s = JsonJournalStorage(path)
+    s.load()
+    assert dict(s.items()) == {"1": _item("1", "One"), "2": _item("2", "Two")}
+    assert not (tmp_path / "metadb.json.journal.compacting").exists()
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_put_many_survives_reload(tmp_path, backend):
+    path = str(tmp_path / "metadb.json")
+    s = open_storage(backend, path)
+    s.load()
+    s.put("1", _item("1"))
+    s.put_many([("1", _item("1", "One")), ("2", _item("2", "Two"))])
+    s.close()
+    s = open_storage(backend, path)
+    s.load()
+    assert dict(s.items()) == {"1": _item("1", "One"), "2": _item("2", "Two")}
+    s.close()
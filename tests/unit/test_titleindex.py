@@ -0,0 +1,75 @@
+import random
+
+import pytest
+from util import titleindex
+from util.titleindex import TitleSnapshot
+
+ENTRIES = [
+    ("Song b", "2", "https://a/2"),
+    ("Song a", "1", "https://a/1"),
+    ("Other", "3", "https://a/3"),
+    ("Song a", "0", "https://a/0"),
+    ("Été", "4", "https://a/4"),
+]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / "titles")
+    titleindex.write(path, ENTRIES)
+    snapshot = TitleSnapshot(path)
+    yield snapshot
+    snapshot.close()
+
+
+def test_iter_prefix_in_title_order(snapshot):
+    assert list(snapshot.iter_prefix("Song")) == [
+        ("Song a", "1", "https://a/1"),
+        ("Song a", "0", "https://a/0"),
+        ("Song b", "2", "https://a/2"),
+    ]
+    assert list(snapshot.iter_prefix("Ét")) == [("Été", "4", "https://a/4")]
+    assert list(snapshot.iter_prefix("Songs")) == []
+
+
+def test_get_by_id(snapshot):
+    assert snapshot.get("3") == ("Other", "https://a/3")
+    assert snapshot.get("5") is None
+    assert len(snapshot) == len(ENTRIES)
+
+
+def test_digest_matches_entries_in_any_order(snapshot):
+    assert snapshot.digest == titleindex.digest(reversed(ENTRIES))
+    assert snapshot.digest != titleindex.digest(ENTRIES[1:])
+
+
+def test_empty_snapshot(tmp_path):
+    path = str(tmp_path / "titles")
+    titleindex.write(path, [])
+    snapshot = TitleSnapshot(path)
+    assert list(snapshot) == []
+    assert snapshot.get("1") is None
+    snapshot.close()
+
+
+def test_rejects_truncated_file(tmp_path):
+    path = tmp_path / "titles"
+    titleindex.write(str(path), ENTRIES)
+    path.write_bytes(path.read_bytes()[:30])
+    with pytest.raises(ValueError):
+        TitleSnapshot(str(path))
+
+
+def test_iter_prefix_matches_reference(tmp_path):
+    rng = random.Random(5)
+    entries = [
+        ("".join(rng.choice("abé") for _ in range(rng.randint(1, 5))), str(i), "u")
+        for i in range(300)
+    ]
+    path = str(tmp_path / "titles")
+    titleindex.write(path, entries)
+    snapshot = TitleSnapshot(path)
+    for prefix in ["", "a", "ab", "é", "béa"]:
+        expected = sorted(e for e in entries if e[0].startswith(prefix))
+        assert sorted(snapshot.iter_prefix(prefix)) == expected
+    snapshot.close()
@@ -1,3 +1,4 @@
+import random
 import pytest
 from util.trie import Trie
 
@@ -26,8 +27,8 @@ def test_starts_with_match():
     t.insert("bohemian like you", "id2")
     results = t.starts_with("bohem")
     assert results is not None
-    assert "bohemian rhapsody" in results
-    assert "bohemian like you" in results
+    assert ("bohemian rhapsody", ["id1"]) in results
+    assert ("bohemian like you", ["id2"]) in results
 
 
 def test_starts_with_no_match():
@@ -47,3 +48,126 @@ def test_list_keys_all():
     t.insert("def", "id2")
     keys = t.list_keys(t.root)
     assert set(keys) == {"abc", "def"}
+
+
+def test_starts_with_returns_extensions_of_shorter_keys():
+    t = Trie()
+    t.insert("song", "id1")
+    t.insert("song two", "id2")
+    t.insert("songbird", "id3")
+    assert t.starts_with("so") == [
+        ("song", ["id1"]),
+        ("song two", ["id2"]),
+        ("songbird", ["id3"]),
+    ]
+
+
+def test_starts_with_prefix_ends_mid_edge():
+    t = Trie()
+    t.insert("hello world", "id1")
+    assert t.starts_with("hello wo") == [("hello world", ["id1"])]
+    assert t.starts_with("hello wx") is None
+
+
+def test_starts_with_limit():
+    t = Trie()
+    for i in range(10):
+        t.insert(f"track {i}", f"id{i}")
+    assert len(t.starts_with("track", limit=3)) == 3
+    assert len(t.starts_with("", limit=25)) == 10
+    assert t.starts_with("track", limit=0) == []
+
+
+def test_search_prefix_of_key_is_not_a_match():
+    t = Trie()
+    t.insert("abcdef", "id1")
+    assert t.search("abc") is None
+    assert t.search("abcdefg") is None
+    t.insert("abc", "id2")
+    assert t.search("abc") == ["id2"]
+    assert t.search("abcdef") == ["id1"]
+
+
+def test_list_keys_nested():
+    t = Trie()
+    t.insert("ab", "id1")
+    t.insert("abc", "id2")
+    t.insert("abd", "id3")
+    assert t.list_keys() == ["ab", "abc", "abd"]
+
+
+def test_node_count_is_path_compressed():
+    t = Trie()
+    t.insert("bohemian rhapsody", "id1")
+    t.insert("bohemian like you", "id2")
+    # root, the shared "bohemian " edge and one leaf per title
+    assert t.node_count() == 4
+
+
+def _assert_compressed(t: Trie):
+    stack = list(t.root.children.values()) if t.root.children else []
+    while stack:
+        node = stack.pop()
+        children = node.children or {}
+        assert node.end or len(children) >= 2
+        for first, child in children.items():
+            assert child.label[0] == first
+        stack.extend(children.values())
+
+
+def test_remove_terminator_then_key():
+    t = Trie()
+    t.insert("song", "1")
+    t.insert("song", "2")
+    assert t.remove("song", "1")
+    assert t.search("song") == ["2"]
+    assert not t.remove("song", "1")
+    assert not t.remove("so", "2")
+    assert t.remove("song", "2")
+    assert t.search("song") is None
+    assert t.node_count() == 1
+
+
+def test_remove_merges_pass_through_nodes():
+    t = Trie()
+    for key in ["test", "team", "tea"]:
+        t.insert(key, key)
+    assert t.remove("tea", "tea")
+    _assert_compressed(t)
+    assert sorted(t.list_keys()) == ["team", "test"]
+    assert t.remove("test", "test")
+    _assert_compressed(t)
+    assert t.list_keys() == ["team"]
+    assert t.node_count() == 2
+
+
+def test_remove_matches_reference_under_random_churn():
+    rng = random.Random(7)
+    t = Trie()
+    reference = {}
+    for _ in range(2000):
+        key = "".join(rng.choice("ab") for _ in range(rng.randint(1, 6)))
+        if reference.get(key) and rng.random() < 0.5:
+            assert t.remove(key, reference.pop(key))
+        elif key not in reference:
+            reference[key] = key
+            t.insert(key, key)
+    _assert_compressed(t)
+    assert sorted(t.list_keys()) == sorted(reference)
+
+
+def test_from_items_matches_incremental_inserts():
+    rng = random.Random(11)
+    items = [
+        ("".join(rng.choice("abc") for _ in range(rng.randint(1, 6))), str(i))
+        for i in range(500)
+    ]
+    built = Trie.from_items(items)
+    inserted = Trie()
+    for key, terminator in items:
+        inserted.insert(key, terminator)
+    _assert_compressed(built)
+    assert sorted(built.list_keys()) == sorted(inserted.list_keys())
+    assert built.node_count() == inserted.node_count()
+    for key, _ in items:
+        assert built.search(key) == inserted.search(key)
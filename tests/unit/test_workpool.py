@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import pytest
+from util.workpool import Job, WorkPool
+
+
+def test_waiting_calls_run_by_priority_then_order():
+    async def run():
+        pool = WorkPool(workers=1)
+        gate = threading.Event()
+        order = []
+
+        def job(name):
+            def fn():
+                if name == "blocker":
+                    gate.wait()
+                order.append(name)
+                return name
+
+            return fn
+
+        blocker = asyncio.create_task(pool.submit("blocker", job("blocker"), 0))
+        await asyncio.sleep(0)
+        tasks = [
+            asyncio.create_task(pool.submit(name, job(name), priority))
+            for name, priority in [("backfill", 3), ("prefetch", 2), ("now", 0)]
+        ]
+        await asyncio.sleep(0)
+        assert pool.depth() == 3
+        gate.set()
+        assert await asyncio.gather(blocker, *tasks) == [
+            "blocker",
+            "backfill",
+            "prefetch",
+            "now",
+        ]
+        assert order == ["blocker", "now", "prefetch", "backfill"]
+        assert pool.stats()["completed"] == 4
+        pool.shutdown()
+
+    asyncio.run(run())
+
+
+def test_urgent_call_runs_while_every_other_thread_prefetches():
+    async def run():
+        pool = WorkPool(workers=3, urgent=1)
+        gate = threading.Event()
+        prefetches = [
+            asyncio.create_task(pool.submit(f"prefetch{i}", gate.wait, 2))
+            for i in range(4)
+        ]
+        await asyncio.sleep(0)
+        # one thread is held back for urgent calls
+        assert pool.running == 2
+        assert pool.depth() == 2
+        now = await asyncio.wait_for(pool.submit("now", lambda: "now", 0), 1)
+        assert now == "now"
+        # a waiting call bumped to urgent takes the held back thread
+        bumped = asyncio.create_task(pool.submit("bumped", lambda: "bumped", 2))
+        await asyncio.sleep(0)
+        assert pool.bump("bumped", 1)
+        assert await asyncio.wait_for(bumped, 1) == "bumped"
+        gate.set()
+        await asyncio.gather(*prefetches)
+        assert pool.stats()["running_deferrable"] == 0
+        pool.shutdown()
+
+    asyncio.run(run())
+
+
+def test_shutdown_cancels_calls_that_never_ran():
+    async def run():
+        pool = WorkPool(workers=1)
+        gate = threading.Event()
+        blocker = asyncio.create_task(pool.submit("blocker", gate.wait, 0))
+        waiting = asyncio.create_task(pool.submit("waiting", lambda: None, 0))
+        await asyncio.sleep(0)
+        # a call dispatched, then dropped by the executor before it started
+        job = Job("dropped", lambda: None, 0)
+        job.started = True
+        pool.running += 1
+        run = asyncio.get_running_loop().create_future()
+        run.cancel()
+        pool._finish(job, run, 0.0)
+        assert job.future.cancelled()
+
+        pool.shutdown()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(waiting, 1)
+        gate.set()
+        assert await asyncio.wait_for(blocker, 1)
+
+    asyncio.run(run())
+
+
+def test_bump_moves_waiting_call_ahead():
+    async def run():
+        pool = WorkPool(workers=1)
+        gate = threading.Event()
+        order = []
+        blocker = asyncio.create_task(pool.submit("blocker", gate.wait, 0))
+        await asyncio.sleep(0)
+        first = asyncio.create_task(pool.submit("a", lambda: order.append("a"), 2))
+        second = asyncio.create_task(pool.submit("b", lambda: order.append("b"), 2))
+        await asyncio.sleep(0)
+        assert pool.bump("b", 0)
+        assert not pool.bump("b", 1)
+        assert not pool.bump("missing", 0)
+        gate.set()
+        await asyncio.gather(blocker, first, second)
+        assert order == ["b", "a"]
+        pool.shutdown()
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiting_call_never_runs():
+    async def run():
+        pool = WorkPool(workers=1)
+        gate = threading.Event()
+        ran = []
+        blocker = asyncio.create_task(pool.submit("blocker", gate.wait, 0))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(pool.submit("a", lambda: ran.append("a"), 1))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert pool.depth() == 0
+        gate.set()
+        await blocker
+        await asyncio.sleep(0.01)
+        assert ran == []
+        assert pool.stats()["cancelled"] == 1
+        pool.shutdown()
+
+    asyncio.run(run())
+
+
+def test_exceptions_reach_the_caller():
+    async def run():
+        pool = WorkPool(workers=2)
+
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            await pool.submit("a", fail, 0)
+        assert pool.running == 0
+        pool.shutdown()
+
+    asyncio.run(run())